@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CORE', '0005_parameter_metaselect'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parameter',
+            name='version',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def initial_stamp(apps, schema_editor):
+    parameterstamp = apps.get_model("CORE", "ParameterStamp")
+    parameterstamp.objects.create(id=1, version=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CORE', '0006_parameter_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParameterStamp',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'default_permissions': [],
+            },
+        ),
+        migrations.RunPython(initial_stamp),
+    ]
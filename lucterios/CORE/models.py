@@ -24,6 +24,7 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import unicode_literals
 from os.path import dirname, join, exists, isfile
+from datetime import timedelta
 from os import walk, makedirs, unlink
 from shutil import rmtree
 from zipfile import ZipFile
@@ -33,12 +34,12 @@ from imp import load_source
 
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.contrib.auth.models import User, Group
-from django.db import models
-from django.db.models.signals import post_migrate
+from django.db import models, transaction, IntegrityError
+from django.db.models.signals import post_migrate, post_delete
 from django.utils.translation import ugettext_lazy as _, ugettext_lazy
-from django.utils import six
+from django.utils import six, timezone
 
-from lucterios.framework.models import LucteriosModel, LucteriosVirtualField
+from lucterios.framework.models import LucteriosModel, LucteriosVirtualField, LucteriosLogEntry, LucteriosScheduler
 from lucterios.framework.error import LucteriosException, IMPORTANT
 from lucterios.framework.xfersearch import get_search_query_from_criteria
 from lucterios.framework.signal_and_lock import Signal
@@ -54,6 +55,7 @@ class Parameter(LucteriosModel):
     args = models.CharField(_('arguments'), max_length=200, default="{}")
     value = models.TextField(_('value'), blank=True)
     metaselect = models.TextField('meta', blank=True)
+    version = models.IntegerField(default=0, editable=False)
 
     value_txt = LucteriosVirtualField(verbose_name=_('value'), compute_from='get_value')
 
@@ -88,6 +90,12 @@ class Parameter(LucteriosModel):
             db_param.value = pvalue
         db_param.save()
 
+    def save(self, *args, **kwargs):
+        LucteriosModel.save(self, *args, **kwargs)
+        # atomic increment: other processes compare versions to refresh their cache
+        Parameter.objects.filter(pk=self.pk).update(version=models.F('version') + 1)
+        ParameterStamp.increment()
+
     def get_meta_select(self):
         from django.db.models import Q
         import importlib
@@ -124,6 +132,33 @@ class Parameter(LucteriosModel):
         default_permissions = ['add', 'change']
 
 
+class ParameterStamp(models.Model):
+    """
+    Single row counter, incremented by each change of a parameter:
+    it never goes back, even when a parameter is deleted and another created.
+    """
+    STAMP_ID = 1
+
+    version = models.BigIntegerField(default=0)
+
+    @classmethod
+    def get_query(cls):
+        return cls.objects.filter(id=cls.STAMP_ID).values('version')
+
+    @classmethod
+    def increment(cls):
+        if cls.objects.filter(id=cls.STAMP_ID).update(version=models.F('version') + 1) == 0:
+            try:
+                with transaction.atomic():
+                    cls.objects.create(id=cls.STAMP_ID, version=1)
+            except IntegrityError:
+                # created by another process in the meantime
+                cls.objects.filter(id=cls.STAMP_ID).update(version=models.F('version') + 1)
+
+    class Meta(object):
+        default_permissions = []
+
+
 class LucteriosUser(User, LucteriosModel):
 
     @classmethod
@@ -472,6 +507,8 @@ def core_checkparam():
     Parameter.check_and_create(name='CORE-MessageBefore', typeparam=0, title=_("CORE-MessageBefore"), args="{'Multi':True, 'HyperText':True}", value='')
     Parameter.check_and_create(name='CORE-AuditLog', typeparam=0, title=_("CORE-AuditLog"), args="{'Multi':True, 'HyperText':True}", value='')
     Parameter.check_and_create(name='CORE-PluginPermission', typeparam=0, title=_("CORE-PluginPermission"), args="{'Multi':True, 'HyperText':False}", value='{}')
+    Parameter.check_and_create(name='CORE-AuditLogRetention', typeparam=0, title=_("CORE-AuditLogRetention"), args="{'Multi':True, 'HyperText':False}", value='{}')
+    Parameter.check_and_create(name='CORE-AuditLogArchive', typeparam=1, title=_("CORE-AuditLogArchive"), args="{'Min':0, 'Max':10000}", value='0')
 
 
 def set_auditlog_states():
@@ -482,12 +519,46 @@ def set_auditlog_states():
         pass
 
 
+def get_auditlog_retention():
+    from lucterios.CORE.parameters import Params
+    try:
+        retention = Params.getobject('CORE-AuditLogRetention')
+    except LucteriosException:
+        retention = None
+    return retention if isinstance(retention, dict) else {}
+
+
+def get_auditlog_archive():
+    from lucterios.CORE.parameters import Params
+    try:
+        return Params.getvalue('CORE-AuditLogArchive')
+    except LucteriosException:
+        return 0
+
+
+def purge_auditlog_retention():
+    """Purge log entries older than their retention and archive old ones"""
+    from lucterios.framework.auditlog_archive import LogEntryArchive
+    for modelname, nb_days in get_auditlog_retention().items():
+        LucteriosLogEntry.objects.purge(modelname, timezone.now() - timedelta(days=int(nb_days)))
+    if get_auditlog_archive() > 0:
+        LogEntryArchive.archive(timezone.now() - timedelta(days=get_auditlog_archive()))
+
+
+def set_auditlog_retention():
+    if (len(get_auditlog_retention()) > 0) or (get_auditlog_archive() > 0):
+        LucteriosScheduler.add_task(purge_auditlog_retention, minutes=24 * 60)
+    else:
+        LucteriosScheduler.remove(purge_auditlog_retention)
+
+
 @Signal.decorate('auditlog_register')
 def core_auditlog_register():
     auditlog.register(Parameter, include_fields=['value_txt'])
     auditlog.register(LucteriosUser)
     auditlog.register(LucteriosGroup)
     set_auditlog_states()
+    set_auditlog_retention()
 
 
 def post_after_migrate(sender, **kwargs):
@@ -500,4 +571,9 @@ def post_after_migrate(sender, **kwargs):
         Signal.call_signal("convertdata")
 
 
+def parameter_deleted(sender, **kwargs):
+    ParameterStamp.increment()
+
+
 post_migrate.connect(post_after_migrate)
+post_delete.connect(parameter_deleted, sender=Parameter, dispatch_uid="parameter_stamp")
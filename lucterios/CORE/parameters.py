@@ -30,8 +30,12 @@ from django.utils.translation import ugettext_lazy
 from django.utils import six
 from django.apps import apps
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.signals import request_started
+from django.db import DatabaseError
+from django.db.models import Subquery
+from django.db.models.signals import post_save, post_delete
 
-from lucterios.CORE.models import Parameter
+from lucterios.CORE.models import Parameter, ParameterStamp
 from lucterios.framework.xfercomponents import XferCompLabelForm, XferCompMemo, XferCompEdit, XferCompFloat, XferCompCheck, XferCompSelect,\
     XferCompPassword, XferCompCheckList
 from lucterios.framework.error import LucteriosException, GRAVE
@@ -227,6 +231,12 @@ class Params(object):
 
     _PARAM_CACHE_LIST = {}
 
+    _PARAM_ROWS = None
+
+    _stamp = None
+
+    _check_needed = True
+
     _paramlock = threading.RLock()
 
     @classmethod
@@ -234,14 +244,59 @@ class Params(object):
         cls._paramlock.acquire()
         try:
             cls._PARAM_CACHE_LIST.clear()
+            cls._PARAM_ROWS = None
+            cls._stamp = None
+        finally:
+            cls._paramlock.release()
+
+    @classmethod
+    def request_started(cls, **_kwargs):
+        cls._check_needed = True
+
+    @classmethod
+    def param_changed(cls, instance, **_kwargs):
+        cls._paramlock.acquire()
+        try:
+            if instance.name in cls._PARAM_CACHE_LIST.keys():
+                del cls._PARAM_CACHE_LIST[instance.name]
+            if (cls._PARAM_ROWS is not None) and (instance.name in cls._PARAM_ROWS.keys()):
+                del cls._PARAM_ROWS[instance.name]
+            cls._check_needed = True
         finally:
             cls._paramlock.release()
 
+    @classmethod
+    def _get_stamp(cls):
+        stamp = ParameterStamp.get_query().first()
+        return stamp['version'] if stamp is not None else 0
+
+    @classmethod
+    def _check_version(cls):
+        if (cls._PARAM_ROWS is not None) and (not cls._check_needed or (cls._get_stamp() == cls._stamp)):
+            cls._check_needed = False
+            return
+        old_rows = cls._PARAM_ROWS if cls._PARAM_ROWS is not None else {}
+        cls._PARAM_ROWS = {}
+        cls._stamp = 0
+        # stamp read with the rows, in the same query
+        for param in Parameter.objects.annotate(stamp=Subquery(ParameterStamp.get_query())):
+            cls._PARAM_ROWS[param.name] = param
+            cls._stamp = param.stamp or 0
+        cls._check_needed = False
+        for name in list(cls._PARAM_CACHE_LIST.keys()):
+            if (name not in old_rows.keys()) or (name not in cls._PARAM_ROWS.keys()) or (old_rows[name].version != cls._PARAM_ROWS[name].version):
+                del cls._PARAM_CACHE_LIST[name]
+
     @classmethod
     def _get(cls, name):
+        try:
+            cls._check_version()
+        except DatabaseError:
+            # database not migrated yet
+            raise LucteriosException(GRAVE, "Parameter %s not found!" % name)
         if name not in cls._PARAM_CACHE_LIST.keys():
             try:
-                cls._PARAM_CACHE_LIST[name] = ParamCache(name)
+                cls._PARAM_CACHE_LIST[name] = ParamCache(name, cls._PARAM_ROWS.get(name))
             except ObjectDoesNotExist:
                 raise LucteriosException(GRAVE, "Parameter %s unknown!" % name)
             except Exception:
@@ -261,7 +316,6 @@ class Params(object):
         param = Parameter.objects.get(name=name)
         param.value = value
         param.save()
-        cls.clear()
 
     @classmethod
     def getobject(cls, name):
@@ -337,3 +391,6 @@ def set_param_plugin(value):
 tools.WrapAction.mode_connect_notfree = notfree_mode_connect
 PluginManager.get_param = lambda *_args: get_param_plugin()
 PluginManager.set_param = lambda *args: set_param_plugin(args[-1])
+request_started.connect(Params.request_started, dispatch_uid="params_request_started", weak=False)
+post_save.connect(Params.param_changed, sender=Parameter, dispatch_uid="params_changed", weak=False)
+post_delete.connect(Params.param_changed, sender=Parameter, dispatch_uid="params_changed", weak=False)
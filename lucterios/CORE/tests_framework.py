@@ -25,14 +25,32 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import unicode_literals
 
 from django.utils import six
-
-from lucterios.framework.test import LucteriosTest
+from django.db import connection
+from django.db.models import Q, F
+from django.db.models.fields import CharField
+from django.core.signals import request_started
+from django.test.utils import CaptureQueriesContext
+from django.test.client import RequestFactory
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, Permission
+from django.contrib.sessions.backends.db import SessionStore
+
+from lucterios.framework.test import LucteriosTest, AsychronousLucteriosTest, add_user
 from lucterios.framework.xfergraphic import XferContainerAcknowledge, XFER_DBOX_WARNING, XferContainerCustom
+from lucterios.framework.xfercomponents import XferCompGrid
+from lucterios.framework.xfersearch import FieldDescList, get_search_query, get_criteria_list
+from lucterios.framework.fulltext import FullTextIndex
+from lucterios.framework import xfersearch, signal_and_lock, fulltext
+from lucterios.framework.error import LucteriosException
 from lucterios.framework.tools import WrapAction
+from lucterios.framework.models import get_items_filtered, LucteriosLogEntry, LucteriosRecordLock, LucteriosSession
+from lucterios.framework.middleware import AuditlogMiddleware
+from lucterios.framework.reporting import TextWidthCache, LucteriosPDF, initial_fonts
+from lucterios.framework.printgenerators import calcul_text_size, convert_to_html
 
-from lucterios.CORE.models import Parameter
+from lucterios.CORE.models import Parameter, ParameterStamp, LucteriosUser, LucteriosGroup
 from lucterios.CORE.parameters import Params
-from lucterios.CORE.views import ParamSave
+from lucterios.CORE.views import ParamSave, SearchChoices
 
 
 class GenericTest(LucteriosTest):
@@ -111,6 +129,265 @@ class GenericTest(LucteriosTest):
         self.assertEqual(self.value, True)
         self.assertEquals(self.json_meta['observer'], 'core.acknowledge')
 
+    def test_grid_related_queries(self):
+        group = LucteriosGroup.objects.create(name='my_group')
+        for username in ('aaa', 'bbb'):
+            add_user(username).groups.add(group)
+        grid = XferCompGrid('user')
+        with self.assertNumQueries(3):
+            grid.set_model(LucteriosUser.objects.all(), ['username', 'groups'])
+        self.assertEqual(grid.nb_lines, 3)
+        self.assertEqual(len(grid.record_ids), 3)
+
+        for username in ('ccc', 'ddd', 'eee', 'fff'):
+            add_user(username).groups.add(group)
+        grid = XferCompGrid('user')
+        with self.assertNumQueries(3):
+            grid.set_model(LucteriosUser.objects.all(), ['username', 'groups'])
+        self.assertEqual(grid.nb_lines, 7)
+        json_value = grid.get_json_value()
+        self.assertEqual([record['groups'] for record in json_value if record['username'] == 'ccc'], [['my_group']])
+
+    def test_grid_count_cached(self):
+        for username in ('aaa', 'bbb', 'ccc', 'ddd'):
+            add_user(username)
+        self.xfer.params = {'GRID_SIZE%user': '2'}
+        grid = XferCompGrid('user')
+        with self.assertNumQueries(2):
+            grid.set_model(LucteriosUser.objects.filter(is_staff=False), ['username'], self.xfer)
+        self.assertEqual(grid.nb_lines, 4)
+        self.assertEqual(grid.page_max, 3)
+        self.assertEqual(len(grid.record_ids), 2)
+
+        self.xfer.params['GRID_PAGE%user'] = '1'
+        self.xfer.params['GRID_FLIP%user'] = '1'
+        grid = XferCompGrid('user')
+        with self.assertNumQueries(1):
+            grid.set_model(LucteriosUser.objects.filter(is_staff=False), ['username'], self.xfer)
+        self.assertEqual(grid.nb_lines, 4)
+        self.assertEqual(grid.page_num, 1)
+        self.assertEqual(len(grid.record_ids), 2)
+        self.assertFalse('GRID_FLIP%user' in self.xfer.params)
+
+        self.xfer.params['GRID_FLIP%user'] = '1'
+        grid = XferCompGrid('user')
+        with self.assertNumQueries(2):
+            grid.set_model(LucteriosUser.objects.filter(is_staff=True), ['username'], self.xfer)
+        self.assertEqual(grid.nb_lines, 1)
+
+        add_user('eee')
+        grid = XferCompGrid('user')
+        with self.assertNumQueries(2):
+            grid.set_model(LucteriosUser.objects.filter(is_staff=False), ['username'], self.xfer)
+        self.assertEqual(grid.nb_lines, 5)
+        self.assertEqual(grid.page_num, 1)
+
+    def test_grid_columns(self):
+        grid = XferCompGrid('grid')
+        grid.add_header('name', 'name')
+        grid.add_header('nb', 'nb', 'N0')
+        grid.add_header('amount', 'amount', 'N2')
+        grid.add_header('valid', 'valid', 'B')
+        grid.set_value(5, 'name', 'abc')
+        grid.set_value(3, 'amount', 12.5)
+        grid.set_value(5, 'valid', True)
+        grid.set_value(3, '__tag__', 'x')
+        grid.set_value(5, 'nb', 7)
+        self.assertEqual(grid.record_ids, [5, 3])
+        self.assertEqual(grid.get_column('nb'), [7, 0])
+        self.assertEqual(grid.get_value(3, 'name'), '')
+        self.assertEqual(grid.records[3], {'name': '', 'nb': 0, 'amount': 12.5, 'valid': False, '__tag__': 'x', '__color_ref__': None})
+        self.assertEqual(list(grid.records.keys()), [5, 3])
+        grid.records[3]['nb'] = 4
+        grid.records[5]['__tag__'] = 'y'
+        self.assertEqual(grid.get_value(3, 'nb'), 4)
+        self.assertEqual(grid.records[5]['__tag__'], 'y')
+        del grid.records[5]['__tag__']
+        self.assertFalse('__tag__' in grid.records[5])
+        grid.records[8] = {'name': 'xyz'}
+        self.assertEqual(grid.record_ids, [5, 3, 8])
+        self.assertEqual(grid.get_value(8, 'name'), 'xyz')
+        del grid.records[8]
+        self.assertEqual(grid.record_ids, [5, 3])
+        with self.assertRaises(KeyError):
+            grid.records[8]
+        grid.set_value(3, 'nb', 0)
+        self.assertEqual(grid.get_json_value(), [{'id': 5, 'name': 'abc', 'nb': 7, 'amount': 0.0, 'valid': True, '__color_ref__': None},
+                                                 {'id': 3, 'name': '', 'nb': 0, 'amount': 12.5, 'valid': False, '__color_ref__': None, '__tag__': 'x'}])
+
+    def test_grid_keyset_pager(self):
+        for username in ('aaa', 'bbb', 'ccc', 'ddd', 'eee', 'fff', 'ggg'):
+            add_user(username)
+        self.xfer.params = {'GRID_SIZE%user': '3', 'GRID_ORDER%user': '-username'}
+        grid = XferCompGrid('user')
+        grid.keyset_pager = True
+        grid.set_model(LucteriosUser.objects.all(), ['username'], self.xfer)
+        self.assertEqual(grid.nb_lines, 8)
+        self.assertEqual([record['username'] for record in grid.get_json_value()], ['ggg', 'fff', 'eee'])
+        self.assertTrue('GRID_CURSOR%user' in self.xfer.params)
+
+        for page_num, usernames in ((1, ['ddd', 'ccc', 'bbb']), (2, ['admin', 'aaa']), (1, ['ddd', 'ccc', 'bbb']), (1, ['ddd', 'ccc', 'bbb']), (0, ['ggg', 'fff', 'eee'])):
+            self.xfer.params['GRID_PAGE%user'] = six.text_type(page_num)
+            grid = XferCompGrid('user')
+            grid.keyset_pager = True
+            with CaptureQueriesContext(connection) as queries:
+                grid.set_model(LucteriosUser.objects.all(), ['username'], self.xfer)
+            self.assertEqual(grid.page_num, page_num)
+            self.assertEqual([record['username'] for record in grid.get_json_value()], usernames)
+            for query in queries.captured_queries:
+                self.assertFalse('OFFSET' in query['sql'], query['sql'])
+
+        self.xfer.params['GRID_PAGE%user'] = '2'
+        self.xfer.params['GRID_ORDER%user'] = 'username'
+        grid = XferCompGrid('user')
+        grid.keyset_pager = True
+        grid.set_model(LucteriosUser.objects.all(), ['username'], self.xfer)
+        self.assertEqual([record['username'] for record in grid.get_json_value()], ['fff', 'ggg'])
+
+        LucteriosUser.objects.filter(username__in=('bbb', 'eee')).update(last_login='2019-04-01 12:00')
+        self.xfer.params = {'GRID_SIZE%user': '3', 'GRID_ORDER%user': 'last_login'}
+        usernames = []
+        for page_num in range(3):
+            self.xfer.params['GRID_PAGE%user'] = six.text_type(page_num)
+            grid = XferCompGrid('user')
+            grid.keyset_pager = True
+            grid.set_model(LucteriosUser.objects.all(), ['username'], self.xfer)
+            usernames.extend([record['username'] for record in grid.get_json_value()])
+            self.assertFalse('GRID_CURSOR%user' in self.xfer.params)
+        self.assertEqual(sorted(usernames), ['aaa', 'admin', 'bbb', 'ccc', 'ddd', 'eee', 'fff', 'ggg'])
+
+    def test_search_fields_cached(self):
+        LucteriosGroup.objects.create(name='first')
+        user = LucteriosUser()
+        user.get_search_fields = lambda: ['username', 'groups']
+        fields_desc = FieldDescList()
+        fields_desc.initial(user)
+        self.assertEqual([item[1] for item in fields_desc.get('groups').field_list], ['first'])
+        selector, script = fields_desc.get_select_and_script()
+        self.assertEqual(len(selector), 2)
+        self.assertTrue("findLists['groups']" in script, script)
+
+        with self.assertNumQueries(0):
+            fields_desc = FieldDescList()
+            fields_desc.initial(user)
+            self.assertEqual(fields_desc.get_select_and_script(), (selector, script))
+
+        LucteriosGroup.objects.create(name='second')
+        fields_desc = FieldDescList()
+        fields_desc.initial(user)
+        self.assertEqual([item[1] for item in fields_desc.get('groups').field_list], ['first', 'second'])
+
+        # change made by another process: no signal, reloaded when expired
+        LucteriosGroup.objects.filter(name='second').update(name='third')
+        fields_desc = FieldDescList()
+        fields_desc.initial(user)
+        self.assertEqual([item[1] for item in fields_desc.get('groups').field_list], ['first', 'second'])
+        old_timeout = xfersearch.SEARCH_FIELDS_CACHE_TIMEOUT
+        xfersearch.SEARCH_FIELDS_CACHE_TIMEOUT = -1
+        try:
+            fields_desc = FieldDescList()
+            fields_desc.initial(user)
+            self.assertEqual([item[1] for item in fields_desc.get('groups').field_list], ['first', 'third'])
+        finally:
+            xfersearch.SEARCH_FIELDS_CACHE_TIMEOUT = old_timeout
+
+        # custom fields: the whole definition is in the key
+        user.get_search_fields = lambda: ['username', ('custom_1', CharField(verbose_name='color'), 'first_name', Q())]
+        fields_desc = FieldDescList()
+        fields_desc.initial(user)
+        self.assertEqual(fields_desc.get('custom_1').description, 'color')
+        user.get_search_fields = lambda: ['username', ('custom_1', CharField(verbose_name='size'), 'last_name', Q())]
+        fields_desc = FieldDescList()
+        fields_desc.initial(user)
+        self.assertEqual(fields_desc.get('custom_1').description, 'size')
+        self.assertEqual(fields_desc.get('custom_1').dbfieldname, 'last_name')
+
+    def test_search_multivalued(self):
+        group1 = LucteriosGroup.objects.create(name='first')
+        group2 = LucteriosGroup.objects.create(name='second')
+        add_user('aaa').groups.set([group1, group2])
+        add_user('bbb').groups.set([group1])
+        add_user('ccc').groups.set([group2])
+        user = LucteriosUser()
+        user.get_search_fields = lambda: ['username', 'groups']
+        fields_desc = FieldDescList()
+        fields_desc.initial(user)
+
+        def search(criteria):
+            filter_result = fields_desc.get_query_from_criterialist(get_criteria_list(criteria))[0]
+            query_set = get_items_filtered(LucteriosUser, filter_result)
+            self.assertFalse(query_set.query.distinct, six.text_type(query_set.query))
+            return sorted([item.username for item in query_set])
+
+        self.assertEqual(search('groups||8||%d;%d' % (group1.id, group2.id)), ['aaa', 'bbb', 'ccc'])
+        self.assertEqual(search('groups||9||%d;%d' % (group1.id, group2.id)), ['aaa'])
+        self.assertEqual(search('groups||9||%d' % group2.id), ['aaa', 'ccc'])
+        self.assertEqual(search('username||7||b//groups||8||%d' % group1.id), ['bbb'])
+
+        self.assertFalse(get_items_filtered(LucteriosUser, Q(username='aaa')).query.distinct)
+        self.assertTrue(get_items_filtered(LucteriosUser, Q(groups__in=[group1, group2])).query.distinct)
+        self.assertEqual(get_items_filtered(LucteriosUser, Q(groups__in=[group1, group2])).count(), 3)
+
+    def test_search_lazy_choices(self):
+        for group_name in ('first', 'second', 'third'):
+            LucteriosGroup.objects.create(name=group_name)
+        user = LucteriosUser()
+        user.get_search_fields = lambda: ['username', 'groups']
+        old_lazy_size = xfersearch.SEARCH_LIST_LAZY_SIZE
+        xfersearch.SEARCH_LIST_LAZY_SIZE = 2
+        try:
+            fields_desc = FieldDescList()
+            fields_desc.initial(user)
+        finally:
+            xfersearch.SEARCH_LIST_LAZY_SIZE = old_lazy_size
+        group_desc = fields_desc.get('groups')
+        self.assertEqual(group_desc.field_type, 'listmult')
+        self.assertEqual(group_desc.field_list, [])
+        self.assertTrue("findLazy['groups']=" in fields_desc.get_select_and_script()[1])
+        choices, nb_lines = group_desc.get_choices('ir')
+        self.assertEqual(nb_lines, 2)
+        self.assertEqual([choice[1] for choice in choices], ['first', 'third'])
+        choices, nb_lines = group_desc.get_choices('', 1, 2)
+        self.assertEqual(nb_lines, 3)
+        self.assertEqual([choice[1] for choice in choices], ['third'])
+        group_id = LucteriosGroup.objects.get(name='second').id
+        self.assertEqual(group_desc.get_value(six.text_type(group_id), 8), '"second"')
+
+    def test_search_choices(self):
+        self.factory.xfer = SearchChoices()
+        self.calljson('/CORE/searchChoices', {'modelname': 'CORE.PrintModel', 'fieldname': 'kind', 'page': 1, 'size': 2}, False)
+        self.assert_observer('core.choices', 'CORE', 'searchChoices')
+        self.assertEqual(self.response_json['nb_lines'], 3)
+        self.assertEqual(self.response_json['page_max'], 2)
+        self.assertEqual(self.response_json['choices'], [['2', 'Rapport']])
+
+        self.factory.xfer = SearchChoices()
+        self.calljson('/CORE/searchChoices', {'modelname': 'CORE.PrintModel', 'fieldname': 'name'}, False)
+        self.assert_observer('core.exception', 'CORE', 'searchChoices')
+
+        LucteriosGroup.objects.create(name='first')
+        old_user = self.factory.user
+        LucteriosUser.get_search_fields = classmethod(lambda cls: ['username', 'groups'])
+        try:
+            self.factory.user = LucteriosUser.objects.create(username='choices')
+            self.factory.xfer = SearchChoices()
+            self.calljson('/CORE/searchChoices', {'modelname': 'CORE.LucteriosUser', 'fieldname': 'groups'}, False)
+            self.assert_observer('core.exception', 'CORE', 'searchChoices')
+            self.factory.user.user_permissions.add(Permission.objects.get(codename='change_user'))
+            self.factory.user = LucteriosUser.objects.get(username='choices')
+            self.factory.xfer = SearchChoices()
+            self.calljson('/CORE/searchChoices', {'modelname': 'CORE.LucteriosUser', 'fieldname': 'groups'}, False)
+            self.assert_observer('core.exception', 'CORE', 'searchChoices')
+            self.factory.user.user_permissions.add(Permission.objects.get(codename='view_group'))
+            self.factory.user = LucteriosUser.objects.get(username='choices')
+            self.factory.xfer = SearchChoices()
+            self.calljson('/CORE/searchChoices', {'modelname': 'CORE.LucteriosUser', 'fieldname': 'groups'}, False)
+            self.assert_observer('core.choices', 'CORE', 'searchChoices')
+            self.assertEqual([choice[1] for choice in self.response_json['choices']], ['first'])
+        finally:
+            del LucteriosUser.get_search_fields
+            self.factory.user = old_user
+
     def test_message(self):
         def fillresponse_message():
             self.factory.xfer.message("Finished!", XFER_DBOX_WARNING)
@@ -173,6 +450,176 @@ class GenericTest(LucteriosTest):
         self.assert_observer('core.acknowledge', 'CORE', 'paramSave')
         self.assertEqual(Params.getvalue('param_text'), 'new value')
 
+    def test_record_locker(self):
+        def new_request():
+            session = SessionStore()
+            session.create()
+            request = RequestFactory().get('/')
+            request.user = AnonymousUser()
+            request.COOKIES[settings.SESSION_COOKIE_NAME] = session.session_key
+            return request
+
+        request1 = new_request()
+        request2 = new_request()
+        user = LucteriosUser.objects.get(username='admin')
+        try:
+            for store in (signal_and_lock.MemoryRecordLockStore(), signal_and_lock.DatabaseRecordLockStore()):
+                signal_and_lock.RecordLocker._store = store
+                signal_and_lock.RecordLocker.clear()
+                params = signal_and_lock.RecordLocker.lock(request1, user)
+                self.assertEqual(params, {'LOCK_IDENT': 'lucterios.CORE.models-LucteriosUser-1'})
+                self.assertTrue(signal_and_lock.RecordLocker.is_lock(user))
+                self.assertTrue(signal_and_lock.RecordLocker.has_item_lock(LucteriosUser))
+                self.assertFalse(signal_and_lock.RecordLocker.has_item_lock(LucteriosGroup))
+                with self.assertRaises(LucteriosException):
+                    signal_and_lock.RecordLocker.lock(request2, user)
+                signal_and_lock.RecordLocker.lock(request1, user)
+                signal_and_lock.RecordLocker.unlock(request2, params)
+                self.assertTrue(signal_and_lock.RecordLocker.is_lock(user))
+                signal_and_lock.RecordLocker.unlock(request1, params)
+                self.assertFalse(signal_and_lock.RecordLocker.is_lock(user))
+
+                signal_and_lock.RecordLocker.lock(request1, user)
+                signal_and_lock.RecordLocker.unlock(request1)
+                self.assertFalse(signal_and_lock.RecordLocker.has_item_lock(LucteriosUser))
+
+                with self.settings(RECORD_LOCK_TTL=-1):
+                    signal_and_lock.RecordLocker.lock(request1, user)
+                self.assertFalse(signal_and_lock.RecordLocker.is_lock(user))
+                signal_and_lock.RecordLocker.lock(request2, user)
+                self.assertTrue(signal_and_lock.RecordLocker.is_lock(user))
+
+            # expired locks purged when a new lock is taken
+            group1 = LucteriosGroup.objects.create(name='locked')
+            group2 = LucteriosGroup.objects.create(name='other')
+            with self.settings(RECORD_LOCK_TTL=-1):
+                signal_and_lock.RecordLocker.lock(request1, group1)
+            self.assertEqual(LucteriosRecordLock.objects.filter(modelname__endswith='LucteriosGroup').count(), 1)
+            signal_and_lock.RecordLocker.lock(request1, group2)
+            self.assertEqual(list(LucteriosRecordLock.objects.filter(modelname__endswith='LucteriosGroup').values_list('lock_ident', flat=True)),
+                             [signal_and_lock.RecordLocker.get_lock_ident(group2)])
+
+            # taken by another process between the owner check and the insert
+            class RacedStore(signal_and_lock.MemoryRecordLockStore):
+
+                def set(self, lock_ident, modelname, session_key, expire_date):
+                    return False
+            signal_and_lock.RecordLocker._store = RacedStore()
+            with self.assertRaises(LucteriosException):
+                signal_and_lock.RecordLocker.lock(request1, group2)
+
+            # same table seen from another process
+            signal_and_lock.RecordLocker._store = signal_and_lock.DatabaseRecordLockStore()
+            with self.assertRaises(LucteriosException):
+                signal_and_lock.RecordLocker.lock(request1, user)
+        finally:
+            signal_and_lock.RecordLocker.clear()
+            signal_and_lock.RecordLocker._store = None
+
+    def test_auditlog_actor(self):
+        request = RequestFactory().get('/', HTTP_X_FORWARDED_FOR='10.1.2.3, 192.168.0.1')
+        user = LucteriosUser.objects.get(username='admin')
+        request.user = user
+        middleware = AuditlogMiddleware()
+        middleware.process_request(request)
+        try:
+            log_entry = LucteriosLogEntry.objects.log_create(user, action=LucteriosLogEntry.Action.UPDATE, changes='{}')
+            self.assertEqual(log_entry.username, 'admin')
+            self.assertEqual(log_entry.remote_addr, '10.1.2.3')
+        finally:
+            middleware.process_response(request, None)
+        log_entry = LucteriosLogEntry.objects.log_create(user, action=LucteriosLogEntry.Action.UPDATE, changes='{}')
+        self.assertEqual(log_entry.username, None)
+        self.assertEqual(log_entry.remote_addr, None)
+
+        request.user = AnonymousUser()
+        middleware.process_request(request)
+        try:
+            log_entry = LucteriosLogEntry.objects.log_create(user, action=LucteriosLogEntry.Action.UPDATE, changes='{}')
+            self.assertEqual(log_entry.username, None)
+            self.assertEqual(log_entry.remote_addr, '10.1.2.3')
+        finally:
+            middleware.process_response(request, None)
+
+    def test_text_width_cache(self):
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+        initial_fonts()
+        TextWidthCache.clear()
+        for text in ('', '1 234,56', '2019-12-31', 'Abc {def} ~ xyz', 'Total 1 234,56 €', 'élève'):
+            self.assertAlmostEqual(TextWidthCache.get_width(text, 'sans-serif', 9), stringWidth(text, 'sans-serif', 9), delta=1e-9)
+        self.assertEqual(len(TextWidthCache._widths), 6)
+        self.assertEqual(list(TextWidthCache._char_widths.keys()), ['sans-serif'])
+        self.assertEqual(calcul_text_size('{[b]}abc{[/b]}'), calcul_text_size('abc'))
+
+        old_max_size = TextWidthCache.MAX_SIZE
+        TextWidthCache.MAX_SIZE = 3
+        try:
+            TextWidthCache.clear()
+            TextWidthCache.get_width('aaa', 'sans-serif', 9)
+            TextWidthCache.get_width('bbb', 'sans-serif', 9)
+            TextWidthCache.get_width('ccc', 'sans-serif', 9)
+            TextWidthCache.get_width('aaa', 'sans-serif', 9)
+            TextWidthCache.get_width('ddd', 'sans-serif', 9)
+            self.assertEqual(list(TextWidthCache._widths.keys()), [('ccc', 'sans-serif', 9), ('aaa', 'sans-serif', 9), ('ddd', 'sans-serif', 9)])
+        finally:
+            TextWidthCache.MAX_SIZE = old_max_size
+            TextWidthCache.clear()
+
+    def test_convert_plain_text(self):
+        from lxml import etree
+        self.assertEqual(etree.tostring(convert_to_html('cell', 1234.5)), b'<cell font_family="sans-serif" font_size="9" line_height="10" text_align="left" spacing="0.0">1234.5</cell>')
+        self.assertEqual(etree.tostring(convert_to_html('cell', '')), b'<cell font_family="sans-serif" font_size="9" line_height="10" text_align="left" spacing="0.0"/>')
+        self.assertEqual(etree.tostring(convert_to_html('text', 'a{[b]}b{[/b]}', text_align='center')),
+                         b'<text font_family="sans-serif" font_size="9" line_height="10" text_align="center" spacing="0.0">a<b>b</b></text>')
+        self.assertEqual(etree.tostring(convert_to_html('text', 'a & b')), b'<text font_family="sans-serif" font_size="9" line_height="10" text_align="left" spacing="0.0">a &amp; b</text>')
+
+        lpdf = LucteriosPDF('')
+        self.assertEqual(lpdf.get_para_texts(convert_to_html('cell', '12,50'), False), ['12,50'])
+        self.assertEqual(lpdf.get_para_texts(convert_to_html('cell', ' '), False), [''])
+        self.assertEqual(len(lpdf._para_texts), 0)
+        para_texts = lpdf.get_para_texts(convert_to_html('cell', '{[i]}12,50{[/i]}'), False)
+        self.assertEqual(para_texts, ['<i>12,50</i>'])
+        self.assertTrue(lpdf.get_para_texts(convert_to_html('cell', '{[i]}12,50{[/i]}'), False) is para_texts)
+        self.assertEqual(len(lpdf._para_texts), 1)
+
+    def test_parameters_shared_cache(self):
+        Parameter.objects.create(name='param_one', typeparam=0, value='one')
+        Parameter.objects.create(name='param_two', typeparam=1, value='2')
+        Params.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(Params.getvalue('param_one'), 'one')
+            self.assertEqual(Params.getvalue('param_two'), 2)
+            self.assertEqual(Params.getvalue('CORE-Wizard'), True)
+        param_one = Params._get('param_one')
+
+        # written by another process: no signal in this one
+        Parameter.objects.filter(name='param_two').update(value='5', version=F('version') + 1)
+        ParameterStamp.increment()
+        with self.assertNumQueries(0):
+            self.assertEqual(Params.getvalue('param_two'), 2)
+        request_started.send(sender=self.__class__)
+        with self.assertNumQueries(2):
+            self.assertEqual(Params.getvalue('param_two'), 5)
+            self.assertEqual(Params.getvalue('param_one'), 'one')
+        self.assertTrue(Params._get('param_one') is param_one)
+        request_started.send(sender=self.__class__)
+        with self.assertNumQueries(1):
+            self.assertEqual(Params.getvalue('param_two'), 5)
+
+        Params.setvalue('param_one', 'first')
+        self.assertEqual(Params.getvalue('param_one'), 'first')
+        self.assertEqual(Params.getvalue('param_two'), 5)
+
+        # deleted then created by another process: same number of rows
+        old_rows, old_cache = dict(Params._PARAM_ROWS), dict(Params._PARAM_CACHE_LIST)
+        Parameter.objects.filter(name='param_two').delete()
+        Parameter.objects.bulk_create([Parameter(name='param_three', typeparam=0, value='three')])
+        Params._PARAM_ROWS, Params._PARAM_CACHE_LIST = old_rows, old_cache
+        request_started.send(sender=self.__class__)
+        self.assertEqual(Params.getvalue('param_three'), 'three')
+        with self.assertRaises(LucteriosException):
+            Params.getvalue('param_two')
+
     def test_parameters_memo(self):
         param = Parameter.objects.create(name='param_memo', typeparam=0)
         param.args = "{'Multi':True}"
@@ -284,3 +731,56 @@ class GenericTest(LucteriosTest):
         self.calljson('/CORE/paramSave', {'params': 'param_select', 'param_select': '1'}, False)
         self.assert_observer('core.acknowledge', 'CORE', 'paramSave')
         self.assertEqual(Params.getvalue('param_select'), 1)
+
+
+class FullTextTest(AsychronousLucteriosTest):
+
+    def test_search_fulltext(self):
+        add_user('jeanne')
+        add_user('marc')
+        self.assertTrue(FullTextIndex.register(LucteriosUser))
+        try:
+            self.assertEqual(FullTextIndex.build(LucteriosUser), LucteriosUser.objects.count())
+            # table list of a process started before the build
+            FullTextIndex._tables = set()
+            self.assertFalse(FullTextIndex.is_ready(LucteriosUser))
+            request_started.send(sender=self.__class__)
+            self.assertTrue(FullTextIndex.is_ready(LucteriosUser))
+            add_user('anne')
+
+            query_set = LucteriosUser.objects.filter(get_search_query('first_name||5||ANN', LucteriosUser)[0])
+            self.assertTrue('MATCH' in six.text_type(query_set.query))
+            self.assertEqual(sorted([user.username for user in query_set]), ['anne', 'jeanne'])
+
+            user = LucteriosUser.objects.get(username='marc')
+            user.first_name = 'marianne'
+            user.save()
+            LucteriosUser.objects.get(username='anne').delete()
+            query_set = LucteriosUser.objects.filter(get_search_query('first_name||5||ann', LucteriosUser)[0])
+            self.assertEqual(sorted([user.username for user in query_set]), ['jeanne', 'marc'])
+
+            query_set = LucteriosUser.objects.filter(get_search_query('first_name||5||ar', LucteriosUser)[0])
+            self.assertFalse('MATCH' in six.text_type(query_set.query))
+            self.assertEqual(sorted([user.username for user in query_set]), ['marc'])
+
+            # same result as the 'icontains' lookup
+            for search_text in ('ann', 'ANNE', 'rian', 'e_n', 'n%e', 'jeanne marc'):
+                query_set = LucteriosUser.objects.filter(get_search_query('first_name||5||%s' % search_text, LucteriosUser)[0])
+                self.assertTrue('MATCH' in six.text_type(query_set.query), search_text)
+                self.assertEqual(sorted([user.username for user in query_set]),
+                                 sorted([user.username for user in LucteriosUser.objects.filter(first_name__icontains=search_text)]), search_text)
+        finally:
+            FullTextIndex.drop(LucteriosUser)
+            FullTextIndex.unregister(LucteriosUser)
+
+    def test_fulltext_models(self):
+        labels = FullTextIndex.get_indexable_labels()
+        self.assertTrue('CORE.PrintModel' in labels)
+        self.assertFalse(LucteriosLogEntry._meta.label in labels)
+        self.assertFalse(LucteriosSession._meta.label in labels)
+        old_search = fulltext.FULLTEXT_SEARCH
+        fulltext.FULLTEXT_SEARCH = ['CORE.LucteriosUser', 'dummy.Example']
+        try:
+            self.assertEqual(FullTextIndex.get_indexable_labels(), ['CORE.LucteriosUser', 'dummy.Example'])
+        finally:
+            fulltext.FULLTEXT_SEARCH = old_search
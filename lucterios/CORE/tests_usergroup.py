@@ -23,21 +23,29 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
-from datetime import date
+from datetime import date, timedelta
+from tempfile import mkdtemp
+from shutil import rmtree
+from os import listdir
 
 from django.contrib.auth.models import Permission
-from django.utils import six
+from django.db import transaction, DatabaseError
+from django.db.models.query import QuerySet
+from django.utils import six, timezone
 
 from lucterios.framework.test import LucteriosTest, add_empty_user, add_user
 from lucterios.framework import tools, signal_and_lock
 from lucterios.framework.auditlog import LucteriosAuditlogModelRegistry
+from lucterios.framework.models import LucteriosLogEntry
+from lucterios.framework.auditlog_archive import LogEntryArchive
 
 from lucterios.CORE.views_usergroup import UsersList, UsersDelete, UsersDisabled, UsersEnabled, UsersEdit,\
-    AudiLogConfig, GroupsDelete
+    AudiLogConfig, AudiLogChange, AudiLogPurge, GroupsDelete, AuditLogShow
 from lucterios.CORE.views_usergroup import GroupsList, GroupsEdit
 
 from lucterios.CORE.views import Unlock
-from lucterios.CORE.models import LucteriosGroup, LucteriosUser
+from lucterios.CORE.models import LucteriosGroup, LucteriosUser, get_auditlog_retention, purge_auditlog_retention,\
+    get_auditlog_archive
 from lucterios.CORE import parameters
 
 
@@ -463,6 +471,127 @@ class UserTest(LucteriosTest):
         self.assert_json_equal('', 'lucterioslogentry/@2/action', 0)
         self.assert_json_equal('', 'lucterioslogentry/@2/object_repr', "abc")
 
+    def test_auditlog_retention(self):
+        user = LucteriosUser.objects.get(username='admin')
+        for day_idx in range(10):
+            log_entry = LucteriosLogEntry.objects.log_create(user, action=LucteriosLogEntry.Action.UPDATE, changes='{}')
+            LucteriosLogEntry.objects.filter(id=log_entry.id).update(timestamp=timezone.now() - timedelta(days=10 * day_idx))
+        log_entry = LucteriosLogEntry.objects.log_create(LucteriosGroup.objects.create(name='truc'), action=LucteriosLogEntry.Action.CREATE, changes='{}')
+        LucteriosLogEntry.objects.filter(id=log_entry.id).update(timestamp=timezone.now() - timedelta(days=100))
+
+        self.factory.xfer = AudiLogConfig()
+        self.calljson('/CORE/audiLogConfig', {'type_selected': 'CORE.LucteriosUser'}, False)
+        self.assert_json_equal('FLOAT', 'AuditLogRetention', 0)
+
+        self.factory.xfer = AudiLogChange()
+        self.calljson('/CORE/audiLogChange', {'type_selected': 'CORE.LucteriosUser', 'AuditLogSetting': 'CORE', 'AuditLogRetention': '35'}, False)
+        self.assert_observer('core.acknowledge', 'CORE', 'audiLogChange')
+        self.assertEqual(get_auditlog_retention(), {'CORE.LucteriosUser': 35})
+
+        self.factory.xfer = AudiLogConfig()
+        self.calljson('/CORE/audiLogConfig', {'type_selected': 'CORE.LucteriosUser'}, False)
+        self.assert_json_equal('FLOAT', 'AuditLogRetention', 35)
+
+        purge_auditlog_retention()
+        self.assertEqual(LucteriosLogEntry.objects.filter(modelname='CORE.LucteriosUser').count(), 4)
+        self.assertEqual(LucteriosLogEntry.objects.filter(modelname='CORE.LucteriosGroup').count(), 1)
+
+        self.factory.xfer = AudiLogPurge()
+        self.calljson('/CORE/audiLogPurge', {'type_selected': 'CORE.LucteriosUser', 'CONFIRME': 'YES'}, False)
+        self.assert_observer('core.acknowledge', 'CORE', 'audiLogPurge')
+        self.assertEqual(LucteriosLogEntry.objects.filter(modelname='CORE.LucteriosUser').count(), 0)
+        self.assertEqual(LucteriosLogEntry.objects.filter(modelname='CORE.LucteriosGroup').count(), 1)
+
+        self.factory.xfer = AudiLogChange()
+        self.calljson('/CORE/audiLogChange', {'type_selected': 'CORE.LucteriosUser', 'AuditLogSetting': 'CORE', 'AuditLogRetention': '0'}, False)
+        self.assertEqual(get_auditlog_retention(), {})
+
+
+    def test_auditlog_archive(self):
+        user = LucteriosUser.objects.get(username='admin')
+        group = LucteriosGroup.objects.create(name='truc')
+        for day_idx in range(5):
+            log_entry = LucteriosLogEntry.objects.log_create(user, action=LucteriosLogEntry.Action.UPDATE, changes='{}')
+            LucteriosLogEntry.objects.filter(id=log_entry.id).update(timestamp=timezone.now() - timedelta(days=10 * day_idx))
+        log_entry = LucteriosLogEntry.objects.log_create(group, action=LucteriosLogEntry.Action.CREATE, changes='{}')
+        LucteriosLogEntry.objects.filter(id=log_entry.id).update(timestamp=timezone.now() - timedelta(days=100))
+        oldest_timestamp = LucteriosLogEntry.objects.filter(modelname='CORE.LucteriosUser').order_by('timestamp').first().timestamp
+        archive_dir = mkdtemp()
+        try:
+            with self.settings(MEDIA_ROOT=archive_dir):
+                LogEntryArchive.clear()
+                self.assertEqual(LogEntryArchive.archive(timezone.now() - timedelta(days=15)), 4)
+                self.assertEqual(LucteriosLogEntry.objects.count(), 2)
+                self.assertEqual(sorted(listdir(LogEntryArchive.get_dir())), ['CORE.LucteriosGroup', 'CORE.LucteriosUser'])
+                self.assertEqual(len(LogEntryArchive.get_segments('CORE.LucteriosUser')), 1)
+
+                self.assertEqual(LucteriosLogEntry.objects.get_for_object(user).count(), 2)
+                archived_items = LucteriosLogEntry.objects.get_archived_for_object(user)
+                self.assertEqual(len(archived_items), 3)
+                self.assertEqual(archived_items[-1].timestamp, oldest_timestamp)
+                self.assertTrue(LucteriosLogEntry.objects.has_archived_for_object(user))
+                self.assertEqual(LucteriosLogEntry.objects.count(), 2)
+
+                self.factory.xfer = AuditLogShow()
+                self.calljson('/CORE/auditLogShow', {'model': 'CORE.LucteriosUser', 'objid': user.id}, False)
+                self.assert_observer('core.custom', 'CORE', 'auditLogShow')
+                self.assert_count_equal('lucterioslogentry', 2)
+                self.assert_count_equal('archivedlucterioslogentry', 3)
+                self.assertEqual(LucteriosLogEntry.objects.count(), 2)
+
+                self.assertEqual(LogEntryArchive.archive(timezone.now() - timedelta(days=15)), 0)
+                self.assertEqual(len(LogEntryArchive.get_segments('CORE.LucteriosUser')), 1)
+
+                # archive rolled back with its transaction: entries shown once, from the table
+                with self.assertRaises(ValueError):
+                    with transaction.atomic():
+                        self.assertEqual(LogEntryArchive.archive(timezone.now() - timedelta(days=5)), 1)
+                        raise ValueError()
+                self.assertEqual(len(LogEntryArchive.get_segments('CORE.LucteriosUser')), 2)
+                self.assertEqual(LucteriosLogEntry.objects.get_for_object(user).count(), 2)
+                self.assertEqual(len(LucteriosLogEntry.objects.get_archived_for_object(user)), 3)
+
+                # delete failing: the new segments are removed
+                def delete_failed(*_args):
+                    raise DatabaseError()
+                old_delete = QuerySet.delete
+                QuerySet.delete = delete_failed
+                try:
+                    with self.assertRaises(DatabaseError):
+                        LogEntryArchive.archive(timezone.now() - timedelta(days=5))
+                finally:
+                    QuerySet.delete = old_delete
+                self.assertEqual(len(LogEntryArchive.get_segments('CORE.LucteriosUser')), 2)
+                self.assertEqual(LucteriosLogEntry.objects.count(), 2)
+                LogEntryArchive._delete_segment('CORE.LucteriosUser', LogEntryArchive.get_segments('CORE.LucteriosUser')[-1])
+
+                LucteriosLogEntry.objects.purge('CORE.LucteriosUser', timezone.now() - timedelta(days=35))
+                self.assertEqual(len(LucteriosLogEntry.objects.get_archived_for_object(user)), 2)
+                self.assertEqual(len(LogEntryArchive.get_segments('CORE.LucteriosUser')), 1)
+                LucteriosLogEntry.objects.purge('CORE.LucteriosUser', timezone.now() - timedelta(days=15))
+                self.assertEqual(len(LucteriosLogEntry.objects.get_archived_for_object(user)), 0)
+                self.assertFalse(LucteriosLogEntry.objects.has_archived_for_object(user))
+                self.assertEqual(len(LogEntryArchive.get_segments('CORE.LucteriosUser')), 0)
+                self.assertEqual(len(LucteriosLogEntry.objects.get_archived_for_object(group)), 1)
+
+                self.factory.xfer = AudiLogPurge()
+                self.calljson('/CORE/audiLogPurge', {'type_selected': 'CORE.LucteriosUser', 'CONFIRME': 'YES'}, False)
+                self.assertEqual(LucteriosLogEntry.objects.get_for_object(user).count(), 0)
+                self.assertEqual(len(LucteriosLogEntry.objects.get_archived_for_object(group)), 1)
+
+                self.factory.xfer = AudiLogPurge()
+                self.calljson('/CORE/audiLogPurge', {'type_selected': 'CORE.LucteriosGroup', 'CONFIRME': 'YES'}, False)
+                self.assertEqual(len(LucteriosLogEntry.objects.get_archived_for_object(group)), 0)
+                self.assertEqual(listdir(LogEntryArchive.get_dir()), [])
+        finally:
+            LogEntryArchive.clear()
+            rmtree(archive_dir)
+
+        self.factory.xfer = AudiLogChange()
+        self.calljson('/CORE/audiLogChange', {'AuditLogSetting': 'CORE', 'AuditLogArchive': '30'}, False)
+        self.assert_observer('core.acknowledge', 'CORE', 'audiLogChange')
+        self.assertEqual(get_auditlog_archive(), 30)
+
 
 class GroupTest(LucteriosTest):
 
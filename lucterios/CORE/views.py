@@ -53,9 +53,10 @@ from lucterios.framework.xfercomponents import XferCompPassword, XferCompImage,
 from lucterios.framework.xferadvance import XferListEditor, XferAddEditor, XferDelete, XferSave, TITLE_MODIFY, TITLE_DELETE, \
     TITLE_CLONE, TITLE_OK, TITLE_CANCEL, TITLE_CLOSE, TEXT_TOTAL_NUMBER, action_list_sorted,\
     TITLE_CREATE
+from lucterios.framework.xfersearch import FieldDescList, TYPE_LIST, TYPE_LISTMULT, SEARCH_LIST_PAGE_SIZE, SEARCH_LIST_PAGE_MAX
 from lucterios.framework.error import LucteriosException, IMPORTANT
 from lucterios.framework.filetools import get_user_dir, xml_validator, read_file, md5sum
-from lucterios.framework import signal_and_lock, tools
+from lucterios.framework import signal_and_lock, tools, xfersearch
 
 from lucterios.CORE.parameters import Params, secure_mode_connect, notfree_mode_connect
 from lucterios.CORE.models import Parameter, Label, PrintModel, SavedCriteria, LucteriosUser, LucteriosGroup
@@ -136,6 +137,44 @@ class Download(XferContainerAbstract):
                 "<< get %s [%s]", request.path, request.user)
 
 
+@MenuManage.describ('')
+class SearchChoices(XferContainerAbstract):
+    observer_name = 'core.choices'
+
+    def _check_view_permission(self, model):
+        # rights of an inherited model are usually those of its parent (ex: auth.User for LucteriosUser)
+        view_rights = ["%s.%s_%s" % (right_model._meta.app_label, action, right_model._meta.model_name)
+                       for right_model in [model] + model._meta.get_parent_list()
+                       for action in ('view', 'change') if action in right_model._meta.default_permissions]
+        if (len(view_rights) > 0) and not any([WrapAction.is_permission(self.request, view_right) for view_right in view_rights]):
+            raise LucteriosException(IMPORTANT, _("Bad permission for '%s'") % self.request.user)
+
+    def fillresponse(self, modelname='', fieldname='', searchFilter='', page=0, size=SEARCH_LIST_PAGE_SIZE):
+        try:
+            model = apps.get_model(modelname)
+        except (LookupError, ValueError):
+            model = None
+        if not hasattr(model, 'get_search_fields'):
+            raise LucteriosException(IMPORTANT, _("Unknown model!"))
+        fields_desc = FieldDescList()
+        fields_desc.initial(model)
+        field_desc_item = fields_desc.get(fieldname)
+        if (field_desc_item is None) or (field_desc_item.field_type not in (TYPE_LIST, TYPE_LISTMULT)):
+            raise LucteriosException(IMPORTANT, _("Unknown field!"))
+        for right_model in [model] + list(field_desc_item.list_models):
+            self._check_view_permission(right_model)
+        size = max(1, min(size, SEARCH_LIST_PAGE_MAX))
+        page = max(0, page)
+        choices, nb_lines = field_desc_item.get_choices(searchFilter, page, size)
+        self.responsejson['choices'] = choices
+        self.responsejson['nb_lines'] = nb_lines
+        self.responsejson['page_num'] = page
+        self.responsejson['page_max'] = int((nb_lines - 1) / size) + 1
+
+
+xfersearch.search_choices_view_class = SearchChoices
+
+
 @MenuManage.describ('')
 class Menu(XferContainerMenu):
     caption = 'menu'
@@ -26,7 +26,8 @@ from __future__ import unicode_literals
 from django.utils import six, translation
 from django.utils.translation import ugettext_lazy as _
 
-from lucterios.framework.tools import MenuManage, FORMTYPE_MODAL, CLOSE_NO, SELECT_NONE, get_actions_json, CLOSE_YES
+from lucterios.framework.tools import MenuManage, FORMTYPE_MODAL, CLOSE_NO, SELECT_NONE, get_actions_json, CLOSE_YES,\
+    get_babel_locale
 from lucterios.framework.xferbasic import XferContainerAbstract
 from lucterios.framework.xfergraphic import XferContainerAcknowledge
 from lucterios.framework import signal_and_lock
@@ -41,7 +42,6 @@ def get_info_server():
     from django import VERSION
     from django.conf import settings
     from django.utils.module_loading import import_module
-    import locale
     for appname in settings.INSTALLED_APPS:
         if ("django" not in appname) and ("lucterios.framework" != appname):
             appmodule = import_module(appname)
@@ -60,7 +60,7 @@ def get_info_server():
     django_version = "%d.%d.%d" % (VERSION[0], VERSION[1], VERSION[2])
     os_version = "%s %s %s" % (uname()[0], uname()[4], uname()[2])
     try:
-        locale_lang = locale.getlocale(locale.LC_CTYPE)[0]
+        locale_lang = six.text_type(get_babel_locale())
         django_lang = translation.get_language()
         if not locale_lang.startswith(django_lang):
             django_lang = '%s/%s' % (locale_lang, django_lang)
@@ -23,6 +23,7 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
+import json
 
 from django.utils.translation import ugettext_lazy as _
 from django.apps.registry import apps
@@ -31,14 +32,15 @@ from django.db.models import Q
 from lucterios.framework.xferadvance import XferDelete, XferAddEditor, XferListEditor, TITLE_MODIFY, TITLE_DELETE, TITLE_CREATE
 from lucterios.framework.xfergraphic import XferContainerAcknowledge, XferContainerCustom
 from lucterios.framework.xfercomponents import XferCompGrid, XferCompSelect,\
-    XferCompCheckList, XferCompButton, XferCompImage, XferCompLabelForm
+    XferCompCheckList, XferCompButton, XferCompImage, XferCompLabelForm, XferCompFloat
 from lucterios.framework.tools import MenuManage, FORMTYPE_NOMODAL, SELECT_SINGLE, SELECT_MULTI, ActionsManage,\
     FORMTYPE_REFRESH, CLOSE_NO, SELECT_NONE, FORMTYPE_MODAL
 from lucterios.framework.error import LucteriosException, IMPORTANT
 from lucterios.framework.signal_and_lock import LucteriosSession, Signal
 from lucterios.framework.models import LucteriosScheduler, LucteriosLogEntry
 
-from lucterios.CORE.models import LucteriosGroup, LucteriosUser, Parameter, set_auditlog_states
+from lucterios.CORE.models import LucteriosGroup, LucteriosUser, Parameter, set_auditlog_states, get_auditlog_retention, set_auditlog_retention,\
+    get_auditlog_archive
 from lucterios.CORE.parameters import Params
 from django.contrib.contenttypes.models import ContentType
 from django.utils import six
@@ -161,6 +163,7 @@ class SessionList(XferListEditor):
     icon = "session.png"
     model = LucteriosSession
     field_id = 'session'
+    keyset_pager = True
 
     def fillresponse_header(self):
         self.new_tab(_("Sessions"))
@@ -236,10 +239,20 @@ class AuditLogShow(XferContainerCustom):
             self.add_component(lbl)
             log_items = LucteriosLogEntry.objects.get_for_model(self.model)
         grid = XferCompGrid(self.field_id)
+        grid.keyset_pager = True
         grid.set_model(log_items, None, self)
         grid.set_location(1, self.get_max_row() + 1, 2)
         grid.set_size(200, 500)
         self.add_component(grid)
+        if objid != 0:
+            archived_items = LucteriosLogEntry.objects.get_archived_for_object(self.item)
+            if len(archived_items) > 0:
+                grid = XferCompGrid('archived' + self.field_id)
+                grid.set_objects(LucteriosLogEntry, archived_items, None, self)
+                grid.description = _("archived log entries")
+                grid.set_location(1, self.get_max_row() + 1, 2)
+                grid.set_size(200, 500)
+                self.add_component(grid)
 
 
 @MenuManage.describ('sessions.change_session', FORMTYPE_NOMODAL, 'core.right', _("To manage audit logs."))
@@ -248,6 +261,7 @@ class AudiLogConfig(XferListEditor):
     icon = "auditlog.png"
     model = LucteriosLogEntry
     field_id = 'lucterioslogentry'
+    keyset_pager = True
 
     def fillresponse_header(self):
         self.new_tab(_("Log entries"))
@@ -275,9 +289,21 @@ class AudiLogConfig(XferListEditor):
         sel.set_location(1, row, 3)
         sel.description = _('settings')
         self.add_component(sel)
+        type_selected = self.getparam('type_selected', '')
+        if type_selected != '':
+            retention = XferCompFloat('AuditLogRetention', 0, 100000, 0)
+            retention.set_value(get_auditlog_retention().get(type_selected, 0))
+            retention.set_location(1, row + 1, 3)
+            retention.description = _('retention (days)')
+            self.add_component(retention)
+        archive = XferCompFloat('AuditLogArchive', 0, 10000, 0)
+        archive.set_value(get_auditlog_archive())
+        archive.set_location(1, row + 2, 3)
+        archive.description = _('archive after (days)')
+        self.add_component(archive)
         btn = XferCompButton('ChangeAL')
         btn.set_action(self.request, AudiLogChange.get_action(TITLE_MODIFY, "images/edit.png"), modal=FORMTYPE_MODAL, close=CLOSE_NO)
-        btn.set_location(2, row + 1)
+        btn.set_location(2, row + 3)
         self.add_component(btn)
 
 
@@ -288,10 +314,20 @@ class AudiLogChange(XferContainerAcknowledge):
     model = LucteriosLogEntry
     field_id = 'lucterioslogentry'
 
-    def fillresponse(self, AuditLogSetting=[]):
+    def fillresponse(self, AuditLogSetting=[], type_selected='', AuditLogRetention=0.0, AuditLogArchive=None):
         Parameter.change_value('CORE-AuditLog', "\n".join(AuditLogSetting))
+        if AuditLogArchive is not None:
+            Parameter.change_value('CORE-AuditLogArchive', six.text_type(int(float(AuditLogArchive))))
+        if type_selected != '':
+            retention = get_auditlog_retention()
+            if (AuditLogRetention is not None) and (int(AuditLogRetention) > 0):
+                retention[type_selected] = int(AuditLogRetention)
+            elif type_selected in retention:
+                del retention[type_selected]
+            Parameter.change_value('CORE-AuditLogRetention', json.dumps(retention))
         Params.clear()
         set_auditlog_states()
+        set_auditlog_retention()
 
 
 @ActionsManage.affect_grid(_('purge'), "images/delete.png", unique=SELECT_NONE)
@@ -304,5 +340,4 @@ class AudiLogPurge(XferContainerAcknowledge):
 
     def fillresponse(self, type_selected=''):
         if self.confirme(_('Do you want to purge those logs ?')):
-            for log_entry in LucteriosLogEntry.objects.filter(modelname=type_selected):
-                log_entry.delete()
+            LucteriosLogEntry.objects.purge(type_selected)
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from lucterios.framework.models import LucteriosVersionField
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dummy', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='other',
+            name='version',
+            field=LucteriosVersionField(),
+        ),
+    ]
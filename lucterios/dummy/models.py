@@ -28,7 +28,7 @@ from django.db import models
 from django.utils.translation import ugettext_lazy as _
 from django.core.validators import MinValueValidator, MaxValueValidator
 
-from lucterios.framework.models import LucteriosModel, LucteriosDecimalField,\
+from lucterios.framework.models import LucteriosModel, LucteriosDecimalField, LucteriosVersionField,\
     LucteriosVirtualField
 from lucterios.framework.signal_and_lock import Signal
 from lucterios.CORE.models import Parameter
@@ -88,6 +88,7 @@ class Other(LucteriosModel):
                                  format_string=lambda: "N4",
                                  validators=[MinValueValidator(-5000.0), MaxValueValidator(5000.0)])
     bool = models.BooleanField(default=False)
+    version = LucteriosVersionField()
 
 
 @Signal.decorate('auditlog_register')
@@ -26,15 +26,16 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import unicode_literals
 from datetime import datetime
 from time import sleep
+from threading import Thread
 
 from django.utils import six
-from django.utils.translation import activate
+from django.utils.translation import activate, deactivate_all
 from django.conf import settings
 
 from lucterios.framework.test import LucteriosTest, AsychronousLucteriosTest
 from lucterios.CORE.parameters import Params
 from lucterios.CORE.views_usergroup import SessionList
-from lucterios.framework.tools import format_to_string, set_locale_lang
+from lucterios.framework.tools import format_to_string, set_locale_lang, compile_format, get_babel_locale, get_date_formating
 
 
 class DummyTest(LucteriosTest):
@@ -195,6 +196,41 @@ class DummyTest(LucteriosTest):
         self.assertEqual(format_to_string(2, {'0': 'aaa', '1': 'bbb', '2': 'ccc'}, "{0}"), "ccc", "check select 2")
         self.assertEqual(format_to_string(3, {'0': 'aaa', '1': 'bbb', '2': 'ccc'}, "{0}"), "3", "check select 3")
 
+    def test_formating_column(self):
+        set_locale_lang('fr')
+        activate('fr')
+
+        select_format = compile_format({'0': 'aaa', '1': 'bbb', '2': 'ccc'}, "{[b]}{0}{[/b]}")
+        self.assertIs(compile_format({'0': 'aaa', '1': 'bbb', '2': 'ccc'}, "{[b]}{0}{[/b]}"), select_format, "check cached")
+        self.assertEqual(select_format.format_column([0, 2, None, 3]), ["{[b]}aaa{[/b]}", "{[b]}ccc{[/b]}", "{[b]}---{[/b]}", "{[b]}3{[/b]}"], "check select column")
+        self.assertEqual(compile_format(None, "{[i]}{0}{[/i]};{[b]}{0}{[/b]};zero").format_column([1234.56, -1234.56, 0.0, "abc", ["x", "y"]]),
+                         ["{[i]}1234.56{[/i]}", "{[b]}1234.56{[/b]}", "zero", "{[i]}abc{[/i]}", "{[i]}x{[br/]}y{[/i]}"], "check num column")
+        self.assertEqual(compile_format('C2EUR', '{0};{[b]}{0}{[/b]}').format_column([-1234.56, 0, 894730.124, None, "abc"]),
+                         ["{[b]}1 234,56 €{[/b]}", "{[b]}0,00 €{[/b]}", "894 730,12 €", "---", "abc"], "check currency column")
+
+    def test_formating_threads(self):
+        results = {}
+
+        def format_in_lang(lang):
+            set_locale_lang(lang)
+            results[lang] = set([format_to_string(1234.56, "N2", "{0}") for _ in range(500)])
+        threads = [Thread(target=format_in_lang, args=(lang,)) for lang in ('fr', 'en')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results['fr'], set(["1 234,56"]), "check fr thread")
+        self.assertEqual(results['en'], set(["1,234.56"]), "check en thread")
+
+    def test_formating_deactivated(self):
+        with self.settings(LANGUAGE_CODE='en'):
+            deactivate_all()
+            try:
+                self.assertEqual(get_babel_locale().language, 'en', "check default locale")
+                self.assertEqual(get_date_formating(datetime(2017, 4, 23).date()), "April 23, 2017", "check default date")
+            finally:
+                activate('fr')
+
     def test_formating_fr(self):
         set_locale_lang('fr')
         activate('fr')
@@ -24,19 +24,25 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import unicode_literals
 from base64 import b64decode
+import json
 
-from django.utils import six
+from django.utils import six, translation
 from django.utils.translation import activate
 from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from lucterios.framework.test import LucteriosTest
 from lucterios.framework.printgenerators import ActionGenerator
+from lucterios.framework.reporting import transforme_xml2pdf, transforme_model2pdf
 from lucterios.framework.tools import set_locale_lang
+from lucterios.framework.models import LucteriosLogEntry, LogEntryBuffer
+from lucterios.framework.auditlog import LucteriosAuditlogModelRegistry, auditlog
 
 from lucterios.dummy.views import ExampleList, ExampleAddModify, ExampleShow, \
     ExamplePrint, ExampleListing, ExampleSearch, ExampleLabel, OtherList, \
     OtherAddModify, OtherShow, ExampleReporting
-from lucterios.dummy.models import Example
+from lucterios.dummy.models import Example, Other
 
 
 class ExampleTest(LucteriosTest):
@@ -286,6 +292,30 @@ class ExampleTest(LucteriosTest):
         self.assert_xml_equal("page/body/table/rows[3]/cell[2]/font", '918,05 €')
         self.assert_xml_equal("page/body/table/rows[3]/cell[3]", '11 mai 2014 + 04:57')
 
+    def test_printlisting_model(self):
+        from lxml import etree
+        from reportlab import rl_config
+        for item_idx in range(0, 50):
+            Example.objects.create(name='uvw_%d' % item_idx, value=12 + item_idx, price=34.18 * item_idx + 78.15,
+                                   date='1997-10-07', time='21:43', valid=True, comment="")
+        xfer = ExampleListing()
+        xfer._initialize(self.factory.create_request('/lucterios.dummy/exampleListing', {'PRINT_MODE': '3', 'TITLE': 'special example', 'INFO': 'comment', 'WITHNUM': True}))
+        xfer.report_mode = 1
+        generator = xfer.get_report_generator()
+        model_xml = generator.build(xfer.request)
+        self.assertTrue(model_xml is generator.modelxml)
+        self.assertEqual(len(model_xml.xpath('page/body/table/rows')), 55)
+        model_text = etree.tostring(model_xml)
+        old_invariant = rl_config.invariant
+        rl_config.invariant = 1
+        try:
+            pdf_content = transforme_model2pdf(model_xml, '')
+            self.assertEqual(pdf_content[:5], b'%PDF-')
+            self.assertEqual(pdf_content, transforme_xml2pdf(model_text, ''))
+        finally:
+            rl_config.invariant = old_invariant
+        self.assertEqual(etree.tostring(model_xml), model_text)
+
     def testlisting_pdf(self):
         for item_idx in range(0, 150):
             Example.objects.create(name='uvw_%d' % item_idx, value=12 + item_idx, price=34.18 * item_idx + 78.15,
@@ -295,6 +325,57 @@ class ExampleTest(LucteriosTest):
         self.assert_observer('core.print', 'lucterios.dummy', 'exampleListing')
         self.save_pdf()
 
+    def testlisting_pdf_download(self):
+        from os import listdir, unlink
+        from os.path import join
+        from lucterios.framework import xferprinting
+        from lucterios.framework.filetools import get_user_path
+        from lucterios.CORE.views import Download
+        for item_idx in range(0, 150):
+            Example.objects.create(name='uvw_%d' % item_idx, value=12 + item_idx, price=34.18 * item_idx + 78.15,
+                                   date='1997-10-07', time='21:43', valid=True, comment="")
+        print_dir = get_user_path(xferprinting.PRINT_FILE_DIR, '')
+        print_files = set(listdir(print_dir))
+        self.factory.xfer = ExampleListing()
+        self.calljson('/lucterios.dummy/exampleListing', {'PRINT_MODE': '3', 'MODEL': 1}, False)
+        self.assert_observer('core.print', 'lucterios.dummy', 'exampleListing')
+        self.assertFalse('download' in self.response_json['print'])
+        self.assertEqual(set(listdir(print_dir)), print_files)
+
+        old_maxsize = xferprinting.PRINT_INLINE_MAXSIZE
+        xferprinting.PRINT_INLINE_MAXSIZE = 1024
+        try:
+            self.factory.xfer = ExampleListing()
+            self.calljson('/lucterios.dummy/exampleListing', {'PRINT_MODE': '3', 'MODEL': 1}, False)
+            self.assert_observer('core.print', 'lucterios.dummy', 'exampleListing')
+        finally:
+            xferprinting.PRINT_INLINE_MAXSIZE = old_maxsize
+        self.assertEqual(self.response_json['print']['content'], '')
+        download = self.response_json['print']['download']
+        self.assertEqual(download[:29], "CORE/download?filename=print/")
+        filename, sign = download[23:].split('&sign=')
+        self.assertEqual(set(listdir(print_dir)) - print_files, set([filename[6:]]))
+
+        self.factory.xfer = Download()
+        response = self.factory.call('/CORE/download', {'filename': filename, 'sign': sign})
+        pdf_content = b"".join(response.streaming_content)
+        self.assertEqual(pdf_content[:5], b'%PDF-')
+        self.assertEqual(int(response["Content-Length"]), len(pdf_content))
+        self.assertEqual(response["Content-Type"], 'application/pdf')
+        self.assertTrue(len(pdf_content) > 1024)
+        unlink(join(print_dir, filename[6:]))
+
+        xferprinting.PRINT_INLINE_MAXSIZE = None
+        try:
+            self.factory.xfer = ExampleListing()
+            self.calljson('/lucterios.dummy/exampleListing', {'PRINT_MODE': '3', 'MODEL': 1}, False)
+            self.assert_observer('core.print', 'lucterios.dummy', 'exampleListing')
+        finally:
+            xferprinting.PRINT_INLINE_MAXSIZE = old_maxsize
+        self.assertFalse('download' in self.response_json['print'])
+        self.assertEqual(b64decode(self.response_json['print']['content'])[:5], b'%PDF-')
+        self.assertEqual(set(listdir(print_dir)), print_files)
+
     def testreporting(self):
         for item_idx in range(0, 25):
             Example.objects.create(name='uvw_%d' % item_idx, value=12 + item_idx, price=34.18 * item_idx + 78.15,
@@ -390,6 +471,127 @@ class ExampleTest(LucteriosTest):
         self.assert_action_equal(self.json_actions[1], ('Fermer', 'images/close.png'))
         self.assert_json_equal('LABELFORM', "bool", False)
 
+    def test_other_version(self):
+        self.factory.xfer = OtherAddModify()
+        self.calljson('/lucterios.dummy/otherAddModify', {'SAVE': 'YES', 'text': 'abc', 'bool': '1', 'real': '-159.37', 'integer': '13'}, False)
+        self.assert_observer('core.acknowledge', 'lucterios.dummy', 'otherAddModify')
+        self.assertEqual(Other.objects.get(id=1).version, 1)
+
+        self.factory.xfer = OtherShow()
+        self.calljson('/lucterios.dummy/otherShow', {'other': '1'}, False)
+        self.assert_observer('core.custom', 'lucterios.dummy', 'otherShow')
+        self.assertFalse('RECORD_VERSION' in self.json_context)
+        self.assertFalse('LOCK_IDENT' in self.json_context)
+
+        self.factory.xfer = OtherAddModify()
+        self.calljson('/lucterios.dummy/otherAddModify', {'other': '1'}, False)
+        self.assert_observer('core.custom', 'lucterios.dummy', 'otherAddModify')
+        self.assertEqual(self.json_context['RECORD_VERSION'], '1')
+        self.assertFalse('LOCK_IDENT' in self.json_context)
+        self.assertEqual(self.response_json['close'], None)
+
+        self.factory.xfer = OtherAddModify()
+        self.calljson('/lucterios.dummy/otherAddModify', {'SAVE': 'YES', 'other': '1', 'RECORD_VERSION': '1', 'integer': '14'}, False)
+        self.assert_observer('core.acknowledge', 'lucterios.dummy', 'otherAddModify')
+        self.assertFalse('RECORD_VERSION' in self.json_context)
+        self.assertEqual(Other.objects.get(id=1).version, 2)
+
+        self.factory.xfer = OtherAddModify()
+        self.calljson('/lucterios.dummy/otherAddModify', {'SAVE': 'YES', 'other': '1', 'RECORD_VERSION': '1', 'integer': '15'}, False)
+        self.assert_observer('core.exception', 'lucterios.dummy', 'otherAddModify')
+        self.assert_json_equal('', 'message', "Cet enregistrement a été modifié par un autre utilisateur!{[br/]}Fermez-le et rouvrez-le pour obtenir les dernières modifications.")
+        self.assertEqual(Other.objects.get(id=1).integer, 14)
+        self.assertEqual(Other.objects.get(id=1).version, 2)
+
+    def test_auditlog_snapshot(self):
+        LucteriosAuditlogModelRegistry.set_state_packages(['dummy'])
+        try:
+            example = Example.objects.get(name='abc')
+            example.value = 14
+            example.comment = 'new comment'
+            with CaptureQueriesContext(connection) as queries:
+                example.save()
+            self.assertEqual([query['sql'].split()[0] for query in queries.captured_queries], ['INSERT', 'UPDATE'])
+            log_entry = LucteriosLogEntry.objects.get(modelname='dummy.Example', object_id=example.id)
+            self.assertEqual(log_entry.action, LucteriosLogEntry.Action.UPDATE)
+            self.assertEqual(json.loads(log_entry.changes), {'value': ['12', '14'], 'comment': ['blablabla', 'new comment'], 'virtual': ['146.8872', '171.3684']})
+
+            example.value = 15
+            example.save()
+            changes = json.loads(LucteriosLogEntry.objects.filter(object_id=example.id).first().changes)
+            self.assertEqual(sorted(changes.keys()), ['value', 'virtual'])
+            self.assertEqual(changes['value'], ['14', '15'])
+
+            with CaptureQueriesContext(connection) as queries:
+                example.save()
+            self.assertEqual(len(queries.captured_queries), 1)
+
+            Example.objects.filter(id=example.id).update(value=20)
+            example.refresh_from_db()
+            with CaptureQueriesContext(connection) as queries:
+                example.save()
+            self.assertEqual(len(queries.captured_queries), 1)
+            example.value = 21
+            example.save()
+            changes = json.loads(LucteriosLogEntry.objects.filter(object_id=example.id).first().changes)
+            self.assertEqual(changes['value'], ['20', '21'])
+        finally:
+            LucteriosAuditlogModelRegistry.set_state_packages([])
+
+    def test_auditlog_buffer(self):
+        LucteriosAuditlogModelRegistry.set_state_packages(['dummy'])
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                with LogEntryBuffer():
+                    for example in Example.objects.all():
+                        example.value = 1
+                        example.save()
+                    new_example = Example.objects.create(name='new', value=5, price=10.0, time='12:00')
+                    new_example.value = 6
+                    new_example.save()
+                    self.assertEqual(LucteriosLogEntry.objects.count(), 0)
+            log_queries = [query['sql'].split()[0] for query in queries.captured_queries if LucteriosLogEntry._meta.db_table in query['sql'] and not query['sql'].startswith('SELECT')]
+            self.assertEqual(log_queries, ['DELETE', 'INSERT'])
+            self.assertEqual(LucteriosLogEntry.objects.filter(action=LucteriosLogEntry.Action.UPDATE).count(), 6)
+            self.assertEqual(LucteriosLogEntry.objects.filter(action=LucteriosLogEntry.Action.CREATE).count(), 1)
+            self.assertEqual(LucteriosLogEntry.objects.get_for_object(new_example).count(), 2)
+            self.assertEqual(hasattr(new_example, '_last_log'), connection.features.can_return_ids_from_bulk_insert)
+
+            with self.assertRaises(ValueError):
+                with LogEntryBuffer():
+                    new_example.value = 7
+                    new_example.save()
+                    raise ValueError()
+            self.assertEqual(LucteriosLogEntry.objects.get_for_object(new_example).count(), 2)
+            self.assertFalse(hasattr(new_example, '_last_log'))
+        finally:
+            LucteriosAuditlogModelRegistry.set_state_packages([])
+
+    def test_auditlog_message(self):
+        example = Example.objects.get(name='abc')
+        log_entry = LucteriosLogEntry.objects.log_create(example, action=LucteriosLogEntry.Action.UPDATE,
+                                                         changes=json.dumps({'value': ['12', '14'], 'comment': ['blablabla', 'new'], 'virtual': ['146.8872', '171.3684']}))
+        LucteriosLogEntry._fields_info = {}
+        log_entry = LucteriosLogEntry.objects.get(id=log_entry.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(sorted(log_entry.get_message()), ['comment: "blablabla" -> "new"', 'value: "12" -> "14"'])
+        self.assertEqual(sorted(LucteriosLogEntry._fields_info.keys()), [('dummy.Example', 'comment', 'fr'), ('dummy.Example', 'value', 'fr'), ('dummy.Example', 'virtual', 'fr')])
+        self.assertEqual(log_entry._message_cache[1], log_entry.get_message())
+
+        param_log = LucteriosLogEntry(modelname='CORE.Parameter', action=LucteriosLogEntry.Action.UPDATE, changes=json.dumps({'typeparam': [1, 0]}))
+        self.assertEqual(param_log.get_message(), ['typeparam: "Entier" -> "Chaîne"'])
+        with translation.override('en'):
+            self.assertEqual(param_log.get_message(), ['typeparam: "Integer" -> "String"'])
+        self.assertEqual(param_log.get_message(), ['typeparam: "Entier" -> "Chaîne"'])
+
+        log_entry.change_additional_data('other', LucteriosLogEntry.Action.ADD, {'modelname': 'dummy.Other', 'changes': {'text': ['', 'abc'], 'integer': ['', '5']}})
+        self.assertEqual(log_entry.get_message()[-1], 'other: ajouter = "text: "abc"" "integer: "5""')
+
+    def test_auditlog_tracked_fields(self):
+        self.assertEqual([field.name for field in auditlog.get_tracked_fields(Example)], ['id', 'name', 'value', 'price', 'date', 'time', 'valid', 'comment', 'virtual'])
+        self.assertEqual([field.name for field in auditlog.get_tracked_fields(Other)], ['id', 'text', 'integer', 'real', 'bool'])
+        self.assertIs(auditlog.get_tracked_fields(Other), auditlog.get_tracked_fields(Other))
+
     def test_printaction(self):
         generator = ActionGenerator(ExampleShow(), False)
         xml = generator.generate(self.factory.create_request('/lucterios.dummy/examplePrint', {'example': '2'}))
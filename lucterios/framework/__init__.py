@@ -21,3 +21,5 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
+
+default_app_config = 'lucterios.framework.apps.FrameworkConfig'
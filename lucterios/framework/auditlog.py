@@ -27,15 +27,38 @@ import threading
 import json
 
 from django.db.models.base import Model
-from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed, post_init
 from django.utils import six
 from django.core.exceptions import ObjectDoesNotExist
 
 from lucterios.framework.models import LucteriosLogEntry
-from lucterios.framework.auditlog_tools import model_instance_diff, get_sender_ident_for_m2m
+from lucterios.framework.auditlog_tools import model_instance_diff, get_sender_ident_for_m2m, track_field
 from lucterios.framework.tools import get_dico_from_setquery
 
 
+def get_snapshot(instance):
+    snapshot = {}
+    for field in instance._meta.concrete_fields:
+        if field.attname in instance.__dict__:
+            snapshot[field.attname] = instance.__dict__[field.attname]
+    return snapshot
+
+
+def get_old_instance(sender, instance):
+    snapshot = getattr(instance, '_auditlog_snapshot', None)
+    if (snapshot is not None) and not instance._state.adding and (len(snapshot) == len(sender._meta.concrete_fields)):
+        field_names = [field.attname for field in sender._meta.concrete_fields]
+        return sender.from_db(instance._state.db, field_names, [snapshot[field_name] for field_name in field_names])
+    try:
+        return sender.objects.get(pk=instance.pk)
+    except sender.DoesNotExist:
+        return None
+
+
+def lct_log_snapshot(sender, instance, **kwargs):
+    instance._auditlog_snapshot = get_snapshot(instance)
+
+
 def log_create(sender, instance, created, **kwargs):
     if created:
         changes = model_instance_diff(None, instance)
@@ -43,17 +66,14 @@ def log_create(sender, instance, created, **kwargs):
         instance._last_log = LucteriosLogEntry.objects.log_create(
             instance,
             action=LucteriosLogEntry.Action.CREATE,
-            changes=json.dumps(changes, default=six.text_type),
+            changes=json.dumps(changes, default=six.text_type, separators=(',', ':')),
         )
 
 
 def log_update(sender, instance, **kwargs):
     if instance.pk is not None:
-        try:
-            old = sender.objects.get(pk=instance.pk)
-        except sender.DoesNotExist:
-            pass
-        else:
+        old = get_old_instance(sender, instance)
+        if old is not None:
             new = instance
 
             changes = model_instance_diff(old, new)
@@ -63,7 +83,7 @@ def log_update(sender, instance, **kwargs):
                 instance._last_log = LucteriosLogEntry.objects.log_create(
                     instance,
                     action=LucteriosLogEntry.Action.UPDATE,
-                    changes=json.dumps(changes, default=six.text_type),
+                    changes=json.dumps(changes, default=six.text_type, separators=(',', ':')),
                 )
 
 
@@ -74,11 +94,12 @@ def log_delete(sender, instance, **kwargs):
         instance._last_log = LucteriosLogEntry.objects.log_create(
             instance,
             action=LucteriosLogEntry.Action.DELETE,
-            changes=json.dumps(changes, default=six.text_type),
+            changes=json.dumps(changes, default=six.text_type, separators=(',', ':')),
         )
 
 
 def lct_log_create(sender, instance, created, **kwargs):
+    lct_log_snapshot(sender, instance)
     if LucteriosAuditlogModelRegistry.get_state(instance._meta.app_label):
         try:
             sub_obj = instance.get_auditlog_object()
@@ -104,11 +125,8 @@ def lct_log_update(sender, instance, **kwargs):
         if sub_obj is None:
             log_update(sender, instance, **kwargs)
         elif instance.pk is not None:
-            try:
-                old = sender.objects.get(pk=instance.pk)
-            except sender.DoesNotExist:
-                pass
-            else:
+            old = get_old_instance(sender, instance)
+            if old is not None:
                 new = instance
                 changes = model_instance_diff(old, new)
                 if changes:
@@ -224,6 +242,7 @@ class LucteriosAuditlogModelRegistry(object):
         self._signals[pre_save] = lct_log_update
         self._signals[m2m_changed] = lct_log_m2m
         self._signals[post_delete] = lct_log_delete
+        self._signals[post_init] = lct_log_snapshot
 
     def register(self, model=None, include_fields=[], exclude_fields=[], mapping_fields=[]):
         """
@@ -241,10 +260,12 @@ class LucteriosAuditlogModelRegistry(object):
             if not issubclass(cls, Model):
                 raise TypeError("Supplied model is not a valid model.")
 
+            version_field = cls.get_version_field() if hasattr(cls, 'get_version_field') else None
             self._registry[cls] = {
                 'include_fields': include_fields,
-                'exclude_fields': exclude_fields,
+                'exclude_fields': exclude_fields + ([version_field] if version_field is not None else []),
                 'mapping_fields': mapping_fields,
+                'tracked_fields': None,
             }
             self._connect_signals(cls)
 
@@ -319,5 +340,19 @@ class LucteriosAuditlogModelRegistry(object):
             'mapping_fields': self._registry[model]['mapping_fields'],
         }
 
+    def get_tracked_fields(self, model):
+        """
+        Get the fields to compare for a registered model, filtered by include/exclude and cached.
+        """
+        model_entry = self._registry[model]
+        if model_entry['tracked_fields'] is None:
+            fields = [field for field in model._meta.fields if track_field(field)]
+            if model_entry['include_fields']:
+                fields = [field for field in fields if field.name in model_entry['include_fields']]
+            if model_entry['exclude_fields']:
+                fields = [field for field in fields if field.name not in model_entry['exclude_fields']]
+            model_entry['tracked_fields'] = fields
+        return model_entry['tracked_fields']
+
 
 auditlog = LucteriosAuditlogModelRegistry()
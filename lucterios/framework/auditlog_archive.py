@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+'''
+Cold archive of audit log entries for Lucterios
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2019 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+from __future__ import unicode_literals
+from os import makedirs, replace, unlink, listdir
+from os.path import join, exists, isfile, isdir, getmtime
+from shutil import rmtree
+import threading
+import gzip
+import json
+
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import smart_text
+
+from lucterios.framework.models import LucteriosLogEntry
+
+ARCHIVE_FIELDS = ('id', 'modelname', 'username', 'object_pk', 'object_id', 'object_repr', 'action', 'changes', 'remote_addr', 'timestamp', 'additional_data')
+
+SEGMENT_EXT = '.jsonl.gz'
+
+INDEX_EXT = '.json'
+
+
+def get_time_value(timestamp):
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    return timestamp.timestamp()
+
+
+class LogEntryArchive(object):
+    """
+    Log entries older than a given age leave the database for gzipped JSON lines segments.
+    Each model type has its own directory of segments, so that a purge only touches the segments of this model.
+    Inside a segment, entries are sorted by object: the index of a segment keeps its time range
+    and, for each object, the position of its first line and its number of lines.
+    The archive is read only when looking at the log of an object: reading never writes in the database.
+    Entries still in the table (archive rolled back with its transaction) are not read from the archive.
+    """
+
+    ARCHIVE_DIR = 'auditlog'
+
+    SEGMENT_SIZE = 10000
+
+    _indexes = {}
+
+    _lock = threading.RLock()
+
+    @classmethod
+    def get_dir(cls, modelname=None, create=False):
+        from django.conf import settings
+        archive_dir = join(settings.MEDIA_ROOT, cls.ARCHIVE_DIR)
+        if modelname is not None:
+            archive_dir = join(archive_dir, modelname)
+        if create and not exists(archive_dir):
+            makedirs(archive_dir)
+        return archive_dir
+
+    @classmethod
+    def clear(cls):
+        cls._lock.acquire()
+        try:
+            cls._indexes = {}
+        finally:
+            cls._lock.release()
+
+    @classmethod
+    def get_segments(cls, modelname):
+        model_dir = cls.get_dir(modelname)
+        if not isdir(model_dir):
+            return []
+        # a segment is visible only once its index is written
+        return sorted([file_name[:-len(INDEX_EXT)] for file_name in listdir(model_dir) if file_name.endswith(INDEX_EXT)])
+
+    @classmethod
+    def _load_index(cls, modelname, segment_name):
+        index_path = join(cls.get_dir(modelname), segment_name + INDEX_EXT)
+        index_mtime = getmtime(index_path)
+        index_item = cls._indexes.get(index_path)
+        if (index_item is None) or (index_item[0] != index_mtime):
+            with open(index_path, 'r') as index_file:
+                index_item = (index_mtime, json.load(index_file))
+            cls._indexes[index_path] = index_item
+        return index_item[1]
+
+    @classmethod
+    def _write_segment(cls, modelname, segment_name, log_entries):
+        model_dir = cls.get_dir(modelname, True)
+        log_entries = sorted(log_entries, key=lambda log_entry: (smart_text(log_entry.object_pk), log_entry.id))
+        objects = {}
+        with gzip.open(join(model_dir, segment_name + SEGMENT_EXT + '.tmp'), 'wt', encoding='utf-8') as segment_file:
+            for line_idx, log_entry in enumerate(log_entries):
+                entry_values = dict([(fieldname, getattr(log_entry, fieldname)) for fieldname in ARCHIVE_FIELDS])
+                entry_values['timestamp'] = log_entry.timestamp.isoformat()
+                segment_file.write(json.dumps(entry_values, separators=(',', ':')) + "\n")
+                object_ref = objects.setdefault(smart_text(log_entry.object_pk), [line_idx, 0])
+                object_ref[1] += 1
+        time_values = [get_time_value(log_entry.timestamp) for log_entry in log_entries]
+        index = {'begin': min(time_values), 'end': max(time_values), 'count': len(log_entries), 'objects': objects}
+        replace(join(model_dir, segment_name + SEGMENT_EXT + '.tmp'), join(model_dir, segment_name + SEGMENT_EXT))
+        with open(join(model_dir, segment_name + INDEX_EXT + '.tmp'), 'w') as index_file:
+            json.dump(index, index_file, separators=(',', ':'))
+        replace(join(model_dir, segment_name + INDEX_EXT + '.tmp'), join(model_dir, segment_name + INDEX_EXT))
+
+    @classmethod
+    def _delete_segment(cls, modelname, segment_name):
+        model_dir = cls.get_dir(modelname)
+        for file_ext in (INDEX_EXT, SEGMENT_EXT):
+            if isfile(join(model_dir, segment_name + file_ext)):
+                unlink(join(model_dir, segment_name + file_ext))
+        cls._indexes.pop(join(model_dir, segment_name + INDEX_EXT), None)
+
+    @classmethod
+    def _read_segment(cls, modelname, segment_name, first_line=0, nb_lines=None):
+        log_entries = []
+        with gzip.open(join(cls.get_dir(modelname), segment_name + SEGMENT_EXT), 'rt', encoding='utf-8') as segment_file:
+            for line_idx, line in enumerate(segment_file):
+                if line_idx < first_line:
+                    continue
+                if (nb_lines is not None) and (line_idx >= (first_line + nb_lines)):
+                    break
+                entry_values = json.loads(line)
+                entry_values['timestamp'] = parse_datetime(entry_values['timestamp'])
+                log_entries.append(LucteriosLogEntry(**entry_values))
+        return log_entries
+
+    @classmethod
+    def archive(cls, before):
+        """
+        Move the log entries older than a date from the database into new segments, one by model type for each chunk.
+        """
+        nb_archived = 0
+        cls._lock.acquire()
+        try:
+            while True:
+                with transaction.atomic():
+                    # rows archived by another process at the same time are skipped
+                    log_entries = list(LucteriosLogEntry.objects.filter(timestamp__lt=before).order_by('id')
+                                       .select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)[:cls.SEGMENT_SIZE])
+                    if len(log_entries) == 0:
+                        break
+                    model_entries = {}
+                    for log_entry in log_entries:
+                        model_entries.setdefault(log_entry.modelname, []).append(log_entry)
+                    segments = []
+                    try:
+                        for modelname, entries in model_entries.items():
+                            segments.append((modelname, "%s-%d" % (timezone.now().strftime('%Y%m%d%H%M%S%f'), entries[0].id)))
+                            cls._write_segment(segments[-1][0], segments[-1][1], entries)
+                        LucteriosLogEntry.objects.filter(id__in=[log_entry.id for log_entry in log_entries]).delete()
+                    except Exception:
+                        for modelname, segment_name in segments:
+                            cls._delete_segment(modelname, segment_name)
+                        raise
+                nb_archived += len(log_entries)
+        finally:
+            cls._lock.release()
+        return nb_archived
+
+    @classmethod
+    def has_entries(cls, modelname, object_pk):
+        object_pk = smart_text(object_pk)
+        cls._lock.acquire()
+        try:
+            for segment_name in cls.get_segments(modelname):
+                if object_pk in cls._load_index(modelname, segment_name)['objects']:
+                    return True
+            return False
+        finally:
+            cls._lock.release()
+
+    @classmethod
+    def get_entries(cls, modelname, object_pk):
+        """
+        Read the archived entries of an object, newest first.
+        Those entries are not saved: they stay out of the database.
+        """
+        object_pk = smart_text(object_pk)
+        log_entries = {}
+        cls._lock.acquire()
+        try:
+            for segment_name in cls.get_segments(modelname):
+                object_ref = cls._load_index(modelname, segment_name)['objects'].get(object_pk)
+                if object_ref is not None:
+                    for log_entry in cls._read_segment(modelname, segment_name, object_ref[0], object_ref[1]):
+                        log_entries[log_entry.id] = log_entry
+        finally:
+            cls._lock.release()
+        if len(log_entries) > 0:
+            for entry_id in LucteriosLogEntry.objects.filter(id__in=list(log_entries.keys())).values_list('id', flat=True):
+                del log_entries[entry_id]
+        return sorted(log_entries.values(), key=lambda log_entry: (log_entry.timestamp, log_entry.id), reverse=True)
+
+    @classmethod
+    def forget(cls, modelname, before=None):
+        """
+        Remove from the archive the entries of a model type, older than a date if given.
+        Segments entirely older than the date are deleted, segments crossing it are rewritten with their remaining entries.
+        """
+        cls._lock.acquire()
+        try:
+            if before is None:
+                if isdir(cls.get_dir(modelname)):
+                    rmtree(cls.get_dir(modelname))
+                cls._indexes = dict([(index_path, index_item) for index_path, index_item in cls._indexes.items()
+                                     if not index_path.startswith(join(cls.get_dir(modelname), ''))])
+                return
+            time_limit = get_time_value(before)
+            for segment_name in cls.get_segments(modelname):
+                index = cls._load_index(modelname, segment_name)
+                if index['end'] < time_limit:
+                    cls._delete_segment(modelname, segment_name)
+                elif index['begin'] < time_limit:
+                    log_entries = [log_entry for log_entry in cls._read_segment(modelname, segment_name) if get_time_value(log_entry.timestamp) >= time_limit]
+                    cls._write_segment(modelname, segment_name, log_entries)
+        finally:
+            cls._lock.release()
@@ -81,33 +81,36 @@ def get_fields_in_model(instance):
     return instance._meta.fields
 
 
-def get_field_value(obj, field):
+def get_field_value(obj, field, raw=False):
     """
     Gets the value of a given model instance field.
     :param obj: The model instance.
     :type obj: Model
     :param field: The field you want to find the value of.
     :type field: Any
+    :param raw: Read the column value (attname) instead of the related object.
+    :type raw: bool
     :return: The value of the field as a string.
     :rtype: str
     """
+    field_name = field.attname if raw else field.name
     try:
         if isinstance(field, DateTimeField):
             # DateTimeFields are timezone-aware, so we need to convert the field
             # to its naive form before we can accuratly compare them for changes.
             try:
-                value = field.to_python(getattr(obj, field.name, None))
+                value = field.to_python(getattr(obj, field_name, None))
                 if value is not None and settings.USE_TZ and not timezone.is_naive(value):
                     value = timezone.make_naive(value, timezone=timezone.utc)
             except ObjectDoesNotExist:
                 value = field.default if field.default is not NOT_PROVIDED else None
         else:
             try:
-                value = smart_text(getattr(obj, field.name, None))
+                value = smart_text(getattr(obj, field_name, None))
             except ObjectDoesNotExist:
                 value = field.default if field.default is not NOT_PROVIDED else None
     except Exception as err:
-        getLogger('lucterios.framwork').error("auditlog:get_field_value(%s,%s) : %s", obj, field.name, err)
+        getLogger('lucterios.framwork').error("auditlog:get_field_value(%s,%s) : %s", obj, field_name, err)
         raise
     return value
 
@@ -115,9 +118,12 @@ def get_field_value(obj, field):
 def get_fields_diff(old, new, model_fields, fields):
     diff = {}
     for field in fields:
-        old_value = get_field_value(old, field)
-        new_value = get_field_value(new, field)
+        old_value = get_field_value(old, field, True)
+        new_value = get_field_value(new, field, True)
         if old_value != new_value:
+            if field.is_relation:
+                old_value = get_field_value(old, field)
+                new_value = get_field_value(new, field)
             diff[field.name] = smart_text(old_value), smart_text(new_value)
     if len(diff) == 0:
         diff = None
@@ -148,31 +154,13 @@ def model_instance_diff(old, new):
     if not(new is None or isinstance(new, Model)):
         raise TypeError("The supplied new instance is not a valid model instance.")
 
-    if old is not None and new is not None:
-        fields = set(old._meta.fields + new._meta.fields)
-        model_fields = auditlog.get_model_fields(new._meta.model)
+    if new is not None:
+        model = new._meta.model
     elif old is not None:
-        fields = set(get_fields_in_model(old))
-        model_fields = auditlog.get_model_fields(old._meta.model)
-    elif new is not None:
-        fields = set(get_fields_in_model(new))
-        model_fields = auditlog.get_model_fields(new._meta.model)
+        model = old._meta.model
     else:
-        fields = set()
-        model_fields = None
-
-    # Check if fields must be filtered
-    if model_fields and (model_fields['include_fields'] or model_fields['exclude_fields']) and fields:
-        filtered_fields = []
-        if model_fields['include_fields']:
-            filtered_fields = [field for field in fields if field.name in model_fields['include_fields']]
-        else:
-            filtered_fields = fields
-        if model_fields['exclude_fields']:
-            filtered_fields = [field for field in filtered_fields if field.name not in model_fields['exclude_fields']]
-        fields = filtered_fields
-
-    return get_fields_diff(old, new, model_fields, fields)
+        return None
+    return get_fields_diff(old, new, auditlog.get_model_fields(model), auditlog.get_tracked_fields(model))
 
 
 def get_sender_ident_for_m2m(sender, instance):
@@ -79,7 +79,8 @@ def md5sum(filename):
     md5res = md5()
     full_path = join(get_user_dir(), filename)
     with open(full_path, 'rb') as readfile:
-        md5res.update(readfile.read())
+        for file_block in iter(lambda: readfile.read(65536), b''):
+            md5res.update(file_block)
     return md5res.hexdigest()
 
 
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+'''
+Full-text index for search criteria of Lucterios
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+from logging import getLogger
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.db.models.fields import AutoField, IntegerField, CharField, TextField
+from django.core.signals import request_started
+from django.db.models.signals import post_save, post_delete
+from django.utils import six
+
+# False, True (all the models of the applications) or list of model labels ('app_label.ModelName')
+FULLTEXT_SEARCH = False
+if hasattr(settings, 'FULLTEXT_SEARCH'):
+    FULLTEXT_SEARCH = settings.FULLTEXT_SEARCH
+
+FULLTEXT_CHUNK_SIZE = 1000
+
+
+class FullTextSubquery(RawSQL):
+
+    def as_sql(self, compiler, connection):
+        # the 'in' lookup already wraps its right side in parentheses
+        return self.sql, self.params
+
+
+class FullTextBackend(object):
+
+    def __init__(self, model, fieldnames):
+        self.model = model
+        self.fieldnames = list(fieldnames)
+        self.table_name = "lucterios_fts_%s" % model._meta.db_table
+
+    def quote(self, name):
+        return connection.ops.quote_name(name)
+
+    def drop_table(self, cursor):
+        cursor.execute("DROP TABLE %s" % self.quote(self.table_name))
+
+    def clear_table(self, cursor):
+        cursor.execute("DELETE FROM %s" % self.quote(self.table_name))
+
+
+class SQLiteFullText(FullTextBackend):
+
+    MIN_LENGTH = 3
+
+    def create_table(self, cursor):
+        cursor.execute("CREATE VIRTUAL TABLE %s USING fts5(%s, tokenize='trigram')" % (self.quote(self.table_name), ", ".join([self.quote(fieldname) for fieldname in self.fieldnames])))
+
+    def index_rows(self, cursor, rows):
+        cursor.executemany("DELETE FROM %s WHERE rowid=%%s" % self.quote(self.table_name), [(row_id,) for row_id, _values in rows])
+        cursor.executemany("INSERT INTO %s (rowid, %s) VALUES (%%s, %s)" % (self.quote(self.table_name), ", ".join([self.quote(fieldname) for fieldname in self.fieldnames]),
+                                                                           ", ".join(["%s"] * len(self.fieldnames))),
+                           [[row_id] + list(values) for row_id, values in rows])
+
+    def remove_row(self, cursor, row_id):
+        cursor.execute("DELETE FROM %s WHERE rowid=%%s" % self.quote(self.table_name), [row_id])
+
+    def get_sql(self, fieldname, value):
+        if len(value) < self.MIN_LENGTH:
+            return None
+        match_text = '"%s" : "%s"' % (fieldname, value.replace('"', '""'))
+        return "SELECT rowid FROM %s WHERE %s MATCH %%s" % (self.quote(self.table_name), self.quote(self.table_name)), [match_text]
+
+
+class PostgreSQLFullText(FullTextBackend):
+    """
+    Trigram (pg_trgm) indexes: as the SQLite trigram tokenizer, they keep the substring semantic of 'contains'.
+    """
+
+    MIN_LENGTH = 3
+
+    def create_table(self, cursor):
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute("CREATE TABLE %s (object_id integer PRIMARY KEY, %s)" % (self.quote(self.table_name), ", ".join(["%s text" % self.quote(fieldname) for fieldname in self.fieldnames])))
+        for fieldname in self.fieldnames:
+            cursor.execute("CREATE INDEX %s ON %s USING GIN (%s gin_trgm_ops)" % (self.quote("%s_%s" % (self.table_name, fieldname)), self.quote(self.table_name), self.quote(fieldname)))
+
+    def index_rows(self, cursor, rows):
+        fields = ", ".join([self.quote(fieldname) for fieldname in self.fieldnames])
+        placeholders = ", ".join(["%s"] * len(self.fieldnames))
+        updates = ", ".join(["%s=EXCLUDED.%s" % (self.quote(fieldname), self.quote(fieldname)) for fieldname in self.fieldnames])
+        cursor.executemany("INSERT INTO %s (object_id, %s) VALUES (%%s, %s) ON CONFLICT (object_id) DO UPDATE SET %s" % (self.quote(self.table_name), fields, placeholders, updates),
+                           [[row_id] + list(values) for row_id, values in rows])
+
+    def remove_row(self, cursor, row_id):
+        cursor.execute("DELETE FROM %s WHERE object_id=%%s" % self.quote(self.table_name), [row_id])
+
+    def get_sql(self, fieldname, value):
+        if len(value) < self.MIN_LENGTH:
+            return None
+        like_text = "%%%s%%" % value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return "SELECT object_id FROM %s WHERE %s ILIKE %%s" % (self.quote(self.table_name), self.quote(fieldname)), [like_text]
+
+
+class FullTextIndex(object):
+    """
+    Side tables indexing the text search fields, used by the 'contains' criteria.
+    Indexed models are registered when the application is ready (FULLTEXT_SEARCH setting)
+    and kept in sync by post_save and post_delete.
+    Bookkeeping models of the framework (audit log, sessions) are never indexed:
+    they are written and purged in bulk.
+    Writes without those signals (QuerySet.update, bulk_create, raw SQL, loaddata)
+    need a rebuild with the 'lucterios_fulltext' command.
+    """
+
+    _registry = {}
+
+    _tables = None
+
+    _lock = threading.RLock()
+
+    @classmethod
+    def get_backend_class(cls):
+        if connection.vendor == 'sqlite':
+            import sqlite3
+            if sqlite3.sqlite_version_info >= (3, 34, 0):
+                return SQLiteFullText
+        elif connection.vendor == 'postgresql':
+            return PostgreSQLFullText
+        return None
+
+    @classmethod
+    def get_index_fields(cls, model):
+        fieldnames = []
+        for fieldname in model.get_search_fields():
+            if isinstance(fieldname, six.text_type) and ('.' not in fieldname) and (fieldname[-4:] != '_set'):
+                try:
+                    dep_field = model._meta.get_field(fieldname)
+                except FieldDoesNotExist:
+                    continue
+                if isinstance(dep_field, (CharField, TextField)) and dep_field.concrete and (len(dep_field.choices or []) == 0):
+                    fieldnames.append(fieldname)
+        return fieldnames
+
+    @classmethod
+    def register(cls, model, fieldnames=None):
+        backend_class = cls.get_backend_class()
+        if fieldnames is None:
+            fieldnames = cls.get_index_fields(model)
+        pk_field = model._meta.pk.target_field if model._meta.pk.is_relation else model._meta.pk
+        if (backend_class is None) or (len(fieldnames) == 0) or not isinstance(pk_field, (AutoField, IntegerField)):
+            return False
+        cls._lock.acquire()
+        try:
+            cls._registry[model] = backend_class(model, fieldnames)
+            for sub_model in apps.get_models():
+                if issubclass(sub_model, model):
+                    dispatch_uid = "fulltext_%s" % sub_model._meta.label_lower
+                    post_save.connect(cls.index_instance, sender=sub_model, dispatch_uid=dispatch_uid, weak=False)
+                    post_delete.connect(cls.unindex_instance, sender=sub_model, dispatch_uid=dispatch_uid, weak=False)
+        finally:
+            cls._lock.release()
+        return True
+
+    @classmethod
+    def unregister(cls, model):
+        cls._lock.acquire()
+        try:
+            if model in cls._registry:
+                del cls._registry[model]
+            cls._tables = None
+        finally:
+            cls._lock.release()
+
+    @classmethod
+    def get_indexable_labels(cls):
+        from lucterios.framework.models import LucteriosModel
+        if isinstance(FULLTEXT_SEARCH, (list, tuple)):
+            return list(FULLTEXT_SEARCH)
+        return [model._meta.label for model in apps.get_models()
+                if issubclass(model, LucteriosModel) and not model._meta.proxy and (model.__module__ != LucteriosModel.__module__)]
+
+    @classmethod
+    def register_all(cls):
+        for model_label in cls.get_indexable_labels():
+            try:
+                cls.register(apps.get_model(model_label))
+            except Exception:
+                getLogger("lucterios.core.fulltext").exception("register %s", model_label)
+
+    @classmethod
+    def get_models(cls):
+        return list(cls._registry.keys())
+
+    @classmethod
+    def request_started(cls, **_kwargs):
+        # index tables built or dropped by another process: checked again for each request
+        cls._lock.acquire()
+        try:
+            cls._tables = None
+        finally:
+            cls._lock.release()
+
+    @classmethod
+    def is_ready(cls, model):
+        cls._lock.acquire()
+        try:
+            if cls._tables is None:
+                cls._tables = set(connection.introspection.table_names())
+            return (model in cls._registry) and (cls._registry[model].table_name in cls._tables)
+        finally:
+            cls._lock.release()
+
+    @classmethod
+    def _get_backends(cls, instance):
+        return [backend for model, backend in list(cls._registry.items()) if isinstance(instance, model) and cls.is_ready(model)]
+
+    @classmethod
+    def index_instance(cls, sender, instance, raw=False, **_kwargs):
+        if raw:
+            return
+        for backend in cls._get_backends(instance):
+            values = [getattr(instance, fieldname) or '' for fieldname in backend.fieldnames]
+            with connection.cursor() as cursor:
+                backend.index_rows(cursor, [(instance.pk, values)])
+
+    @classmethod
+    def unindex_instance(cls, sender, instance, **_kwargs):
+        for backend in cls._get_backends(instance):
+            with connection.cursor() as cursor:
+                backend.remove_row(cursor, instance.pk)
+
+    @classmethod
+    def get_query(cls, model, fieldname, value, lookup_path=''):
+        if not cls.is_ready(model):
+            return None
+        backend = cls._registry[model]
+        if fieldname not in backend.fieldnames:
+            return None
+        sql = backend.get_sql(fieldname, value)
+        if sql is None:
+            return None
+        return Q(**{lookup_path + 'pk__in': FullTextSubquery(*sql)})
+
+    @classmethod
+    def drop(cls, model):
+        if cls.is_ready(model):
+            with connection.cursor() as cursor:
+                cls._registry[model].drop_table(cursor)
+        cls._lock.acquire()
+        try:
+            cls._tables = None
+        finally:
+            cls._lock.release()
+
+    @classmethod
+    def build(cls, model, rebuild=False):
+        backend = cls._registry[model]
+        nb_rows = 0
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                if cls.is_ready(model):
+                    if rebuild:
+                        backend.drop_table(cursor)
+                        backend.create_table(cursor)
+                    else:
+                        backend.clear_table(cursor)
+                else:
+                    backend.create_table(cursor)
+                rows = []
+                for item in model._base_manager.values_list('pk', *backend.fieldnames).iterator():
+                    rows.append((item[0], [value or '' for value in item[1:]]))
+                    if len(rows) >= FULLTEXT_CHUNK_SIZE:
+                        backend.index_rows(cursor, rows)
+                        nb_rows += len(rows)
+                        rows = []
+                if len(rows) > 0:
+                    backend.index_rows(cursor, rows)
+                    nb_rows += len(rows)
+        cls._lock.acquire()
+        try:
+            cls._tables = None
+        finally:
+            cls._lock.release()
+        return nb_rows
+
+
+request_started.connect(FullTextIndex.request_started, dispatch_uid="fulltext_request_started", weak=False)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+'''
+Build full-text index for search criteria
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lucterios.framework.fulltext import FullTextIndex
+
+
+class Command(BaseCommand):
+    help = 'Build or rebuild full-text index of search fields'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model_names', nargs='*', type=str, help='models to index (app_label.ModelName), all by default')
+        parser.add_argument('--rebuild', action='store_true', dest='rebuild', default=False, help='drop and create index tables')
+
+    def handle(self, model_names, rebuild, *args, **options):
+        if FullTextIndex.get_backend_class() is None:
+            raise CommandError('Full-text index not supported by this database')
+        FullTextIndex.register_all()
+        models = FullTextIndex.get_models()
+        if len(model_names) > 0:
+            models = [model for model in models if model._meta.label in model_names]
+            if len(models) != len(model_names):
+                raise CommandError('Unknown or not indexable model in %s' % ", ".join(model_names))
+        for model in models:
+            nb_rows = FullTextIndex.build(model, rebuild)
+            self.stdout.write("%s: %d records indexed" % (model._meta.label, nb_rows))
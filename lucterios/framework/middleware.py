@@ -25,13 +25,9 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import unicode_literals
 import threading
-import time
 
 from django.utils.deprecation import MiddlewareMixin
-from django.utils.functional import curry
 from django.db.models.signals import pre_save
-from django.conf import settings
-from django.apps import apps
 
 from lucterios.framework.xferbasic import XferContainerException
 from lucterios.framework.error import LucteriosRedirectException
@@ -90,18 +86,16 @@ def is_authenticated(user):
 
 class AuditlogMiddleware(MiddlewareMixin):
     """
-    Middleware to couple the request's user to log items. This is accomplished by currying the signal receiver with the
-    user from the request (or None if the user is not authenticated).
+    Middleware to couple the request's user to log items. The user and the remote address of the request are kept in
+    thread local storage, read by a receiver connected once for all on the pre_save signal of log entries.
     """
 
     def process_request(self, request):
         """
-        Gets the current user from the request and prepares and connects a signal receiver with the user already
-        attached to it.
+        Gets the current user and address from the request and stores them for the current thread.
         """
-        # Initialize thread local storage
         threadlocal.auditlog = {
-            'signal_duid': (self.__class__, time.time()),
+            'user': request.user if hasattr(request, 'user') and is_authenticated(request.user) else None,
             'remote_addr': request.META.get('REMOTE_ADDR'),
         }
 
@@ -109,44 +103,34 @@ class AuditlogMiddleware(MiddlewareMixin):
         if request.META.get('HTTP_X_FORWARDED_FOR'):
             threadlocal.auditlog['remote_addr'] = request.META.get('HTTP_X_FORWARDED_FOR').split(',')[0]
 
-        # Connect signal for automatic logging
-        if hasattr(request, 'user') and is_authenticated(request.user):
-            set_actor = curry(self.set_actor, user=request.user, signal_duid=threadlocal.auditlog['signal_duid'])
-            pre_save.connect(set_actor, sender=LucteriosLogEntry, dispatch_uid=threadlocal.auditlog['signal_duid'], weak=False)
-
     def process_response(self, request, response):
         """
-        Disconnects the signal receiver to prevent it from staying active.
+        Forgets the actor of the request so that the thread does not keep it for the next one.
         """
         if hasattr(threadlocal, 'auditlog'):
-            pre_save.disconnect(sender=LucteriosLogEntry, dispatch_uid=threadlocal.auditlog['signal_duid'])
+            del threadlocal.auditlog
 
         return response
 
     def process_exception(self, request, exception):
         """
-        Disconnects the signal receiver to prevent it from staying active in case of an exception.
+        Forgets the actor of the request in case of an exception.
         """
         if hasattr(threadlocal, 'auditlog'):
-            pre_save.disconnect(sender=LucteriosLogEntry, dispatch_uid=threadlocal.auditlog['signal_duid'])
+            del threadlocal.auditlog
 
         return None
 
     @staticmethod
-    def set_actor(user, sender, instance, signal_duid, **kwargs):
+    def set_actor(sender, instance, **kwargs):
         """
-        Signal receiver with an extra, required 'user' kwarg. This method becomes a real (valid) signal receiver when
-        it is curried with the actor.
+        Signal receiver filling the actor and the address of a log entry from the current request, if any.
         """
-        if hasattr(threadlocal, 'auditlog'):
-            if signal_duid != threadlocal.auditlog['signal_duid']:
-                return
-            try:
-                app_label, model_name = settings.AUTH_USER_MODEL.split('.')
-                auth_user_model = apps.get_model(app_label, model_name)
-            except ValueError:
-                auth_user_model = apps.get_model('auth', 'user')
-            if sender == LucteriosLogEntry and isinstance(user, auth_user_model) and instance.username is None:
-                instance.username = six.text_type(user)
-
-            instance.remote_addr = threadlocal.auditlog['remote_addr']
+        auditlog = getattr(threadlocal, 'auditlog', None)
+        if auditlog is not None:
+            if (auditlog['user'] is not None) and (instance.username is None):
+                instance.username = six.text_type(auditlog['user'])
+            instance.remote_addr = auditlog['remote_addr']
+
+
+pre_save.connect(AuditlogMiddleware.set_actor, sender=LucteriosLogEntry, dispatch_uid="lucterios_auditlog_actor", weak=False)
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('framework', '0002_lucterioslogentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LucteriosRecordLock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lock_ident', models.CharField(max_length=255, unique=True, verbose_name='lock')),
+                ('modelname', models.CharField(db_index=True, max_length=255, verbose_name='model')),
+                ('session_key', models.CharField(db_index=True, max_length=40, verbose_name='session key')),
+                ('expire_date', models.DateTimeField(verbose_name='expire date')),
+            ],
+            options={
+                'verbose_name': 'record lock',
+                'verbose_name_plural': 'record locks',
+                'default_permissions': [],
+            },
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('framework', '0003_lucteriosrecordlock'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='lucteriosrecordlock',
+            name='expire_date',
+            field=models.DateTimeField(db_index=True, verbose_name='expire date'),
+        ),
+    ]
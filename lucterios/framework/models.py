@@ -26,13 +26,15 @@ from __future__ import unicode_literals
 import re
 import json
 import logging
-from datetime import datetime
+import threading
+from contextlib import ContextDecorator
+from datetime import datetime, timedelta
 from types import FunctionType
 
 from django_fsm.signals import post_transition
 
-from django.db import models, transaction
-from django.db.models import Transform, Count, Q
+from django.db import models, transaction, connections, router
+from django.db.models import Transform, Count, Q, Min, Max
 from django.db.models.query import QuerySet
 from django.db.models.deletion import ProtectedError
 from django.db.models.lookups import RegisterLookupMixin
@@ -45,7 +47,7 @@ from django.contrib.auth.models import User
 from django.utils import six, formats, timezone
 from django.utils.encoding import smart_text
 from django.utils.six import integer_types
-from django.utils.translation import ugettext_lazy as _
+from django.utils.translation import ugettext_lazy as _, get_language
 from django.utils.module_loading import import_module
 
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -53,7 +55,7 @@ from apscheduler.jobstores.base import ConflictingIdError
 
 from lucterios.framework.error import LucteriosException, IMPORTANT, GRAVE
 from lucterios.framework.editors import LucteriosEditor
-from lucterios.framework.tools import adapt_value, format_to_string, extract_format, get_format_from_field, get_format_value
+from lucterios.framework.tools import adapt_value, compile_format, extract_format, get_format_from_field, format_to_string
 
 
 class AbsoluteValue(Transform):
@@ -109,6 +111,25 @@ def get_subfield_show(initial_fields, subtable):
     return fields
 
 
+def has_multivalued_join(query_set):
+    for join in query_set.query.alias_map.values():
+        join_field = getattr(join, 'join_field', None)
+        if (join_field is not None) and (join_field.one_to_many or join_field.many_to_many):
+            return True
+    return False
+
+
+def get_items_filtered(model, item_filter):
+    if isinstance(item_filter, Q) and (len(item_filter.children) > 0):
+        items = model.objects.filter(item_filter)
+        # only a join to a "many" side can duplicate rows
+        if has_multivalued_join(items):
+            items = items.distinct()
+    else:
+        items = model.objects.all()
+    return items
+
+
 class LucteriosModel(models.Model):
 
     TO_EVAL_FIELD = re.compile(r"#[A-Za-z_0-9\.]+")
@@ -118,9 +139,18 @@ class LucteriosModel(models.Model):
         fields = [f.name for f in cls._meta.get_fields()]
         if (cls._meta.auto_field is not None) and (cls._meta.auto_field.attname in fields):
             fields.remove(cls._meta.auto_field.attname)
+        if cls.get_version_field() is not None:
+            fields.remove(cls.get_version_field())
         fields.sort()
         return fields
 
+    @classmethod
+    def get_version_field(cls):
+        for field in cls._meta.concrete_fields:
+            if isinstance(field, LucteriosVersionField):
+                return field.attname
+        return None
+
     @classmethod
     def get_long_name(cls):
         return "%s.%s" % (cls._meta.app_label, cls._meta.object_name)
@@ -405,12 +435,13 @@ class LucteriosModel(models.Model):
 
         blank_local_fields = set([field.attname for field in self._meta.local_fields if getattr(self, field.attname) in [None, '']])
 
-        for alias_object in alias_objects:
-            self._merge_fields_object(alias_object)
-            self._merge_genericfield_object(alias_object, generic_fields)
-            self._merge_blankfield_object(alias_object, blank_local_fields)
-            alias_object.delete()
-        self.save()
+        with LogEntryBuffer():
+            for alias_object in alias_objects:
+                self._merge_fields_object(alias_object)
+                self._merge_genericfield_object(alias_object, generic_fields)
+                self._merge_blankfield_object(alias_object, blank_local_fields)
+                alias_object.delete()
+            self.save()
         Signal.call_signal("post_merge", self)
 
     @classmethod
@@ -451,7 +482,7 @@ class LucteriosModel(models.Model):
                     if (dep_field is None or is_simple_field(dep_field)) and not isinstance(field_value, LucteriosModel):
                         field_value = adapt_value(field_value)
                         formatnum, formatstr = extract_format(get_format_from_field(dep_field))
-                        field_val = format_to_string(field_value, formatnum, formatstr)
+                        field_val = compile_format(formatnum, formatstr).format(field_value)
                     else:
                         if field_value is None:
                             field_val = ""
@@ -533,10 +564,49 @@ class LucteriosModel(models.Model):
                     pass
         return final_child
 
+    @classmethod
+    def get_final_children(cls, items, select_related=(), prefetch_related=()):
+        final_children = list(items)
+        if cls.get_final_child is not LucteriosModel.get_final_child:
+            return [item.get_final_child() for item in final_children]
+        item_index = {}
+        for item_idx, item in enumerate(final_children):
+            if isinstance(item, cls) and (item.pk is not None):
+                item_index.setdefault(item.pk, []).append(item_idx)
+        if len(item_index) == 0:
+            return final_children
+        ptr_name = cls.__name__.lower() + '_ptr'
+        for rel_obj in cls._meta.get_fields():
+            if hasattr(rel_obj, 'field') and (rel_obj.field.name == ptr_name) and hasattr(rel_obj.related_model, 'get_final_children'):
+                sub_model = rel_obj.related_model
+                sub_query = sub_model._base_manager.filter(**{'%s__in' % rel_obj.field.name: list(item_index.keys())})
+                if len(select_related) > 0:
+                    sub_query = sub_query.select_related(*select_related)
+                if len(prefetch_related) > 0:
+                    sub_query = sub_query.prefetch_related(*prefetch_related)
+                sub_items = list(sub_query)
+                for sub_item, sub_child in zip(sub_items, sub_model.get_final_children(sub_items, select_related, prefetch_related)):
+                    for item_idx in item_index.get(getattr(sub_item, rel_obj.field.attname), []):
+                        final_children[item_idx] = sub_child
+        return final_children
+
     def can_delete(self):
 
         return ''
 
+    def refresh_from_db(self, using=None, fields=None):
+        models.Model.refresh_from_db(self, using=using, fields=fields)
+        snapshot = getattr(self, '_auditlog_snapshot', None)
+        if snapshot is not None:
+            # the audit log compares the next save with the values read now
+            if fields is None:
+                attnames = [field.attname for field in self._meta.concrete_fields]
+            else:
+                attnames = [self._meta.get_field(fieldname).attname for fieldname in fields]
+            for attname in attnames:
+                if attname in self.__dict__:
+                    snapshot[attname] = self.__dict__[attname]
+
     def delete(self, using=None):
         try:
             models.Model.delete(self, using=using)
@@ -582,6 +652,25 @@ class LucteriosDecimalField(models.DecimalField):
         return generic_format_string(self)
 
 
+class LucteriosVersionField(models.PositiveIntegerField):
+
+    def __init__(self, verbose_name=None, name=None, **kwargs):
+        kwargs['default'] = 0
+        kwargs['editable'] = False
+        models.PositiveIntegerField.__init__(self, verbose_name, name, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = models.PositiveIntegerField.deconstruct(self)
+        del kwargs['default']
+        del kwargs['editable']
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        value = (getattr(model_instance, self.attname) or 0) + 1
+        setattr(model_instance, self.attname, value)
+        return value
+
+
 class LucteriosVirtualField(models.Field):
 
     virtual_disabled = False
@@ -712,6 +801,21 @@ class LucteriosSession(Session, LucteriosModel):
         ordering = ['-expire_date']
 
 
+class LucteriosRecordLock(models.Model):
+    lock_ident = models.CharField(_('lock'), max_length=255, unique=True)
+    modelname = models.CharField(_('model'), max_length=255, db_index=True)
+    session_key = models.CharField(_('session key'), max_length=40, db_index=True)
+    expire_date = models.DateTimeField(_('expire date'), db_index=True)
+
+    class Meta(object):
+        default_permissions = []
+        verbose_name = _('record lock')
+        verbose_name_plural = _('record locks')
+
+
+LOG_ENTRY_PURGE_RANGE = timedelta(days=7)
+
+
 class LogEntryManager(models.Manager):
     """
     Custom manager for the :py:class:`LogEntry` model.
@@ -743,6 +847,13 @@ class LogEntryManager(models.Manager):
             if callable(get_additional_data):
                 kwargs.setdefault('additional_data', get_additional_data())
 
+            # save LogEntry to same database instance is using
+            db = instance._state.db
+            if LogEntryBuffer.is_active():
+                log_entry = self.model(**kwargs)
+                LogEntryBuffer.append(log_entry, db or router.db_for_write(self.model, instance=instance), instance)
+                return log_entry
+
             # Delete log entries with the same pk as a newly created model. This should only be necessary when an pk is
             # used twice.
             if kwargs.get('action', None) is LucteriosLogEntry.Action.CREATE:
@@ -750,8 +861,6 @@ class LogEntryManager(models.Manager):
                     self.filter(modelname=kwargs.get('modelname'), object_id=kwargs.get('object_id')).delete()
                 else:
                     self.filter(modelname=kwargs.get('modelname'), object_pk=kwargs.get('object_pk', '')).delete()
-            # save LogEntry to same database instance is using
-            db = instance._state.db
             return self.create(**kwargs) if db is None or db == '' else self.using(db).create(**kwargs)
         return None
 
@@ -769,12 +878,40 @@ class LogEntryManager(models.Manager):
             return self.none()
 
         pk = self._get_pk_value(instance)
-
         if isinstance(pk, integer_types):
             return self.filter(modelname=instance.__class__.get_long_name(), object_id=pk)
         else:
             return self.filter(modelname=instance.__class__.get_long_name(), object_pk=smart_text(pk))
 
+    def get_archived_for_object(self, instance):
+        """
+        Get the archived log entries for the specified model instance, read from the archive segments.
+
+        :param instance: The model instance to get archived log entries for.
+        :type instance: Model
+        :return: Unsaved log entries, newest first.
+        :rtype: list
+        """
+        if not isinstance(instance, models.Model):
+            return []
+
+        from lucterios.framework.auditlog_archive import LogEntryArchive
+        return LogEntryArchive.get_entries(instance.__class__.get_long_name(), self._get_pk_value(instance))
+
+    def has_archived_for_object(self, instance):
+        """
+        Check, from the archive indexes only, if the specified model instance has archived log entries.
+
+        :param instance: The model instance to check.
+        :type instance: Model
+        :rtype: bool
+        """
+        if not isinstance(instance, models.Model):
+            return False
+
+        from lucterios.framework.auditlog_archive import LogEntryArchive
+        return LogEntryArchive.has_entries(instance.__class__.get_long_name(), self._get_pk_value(instance))
+
     def get_for_objects(self, queryset):
         """
         Get log entries for the objects in the specified queryset.
@@ -812,6 +949,35 @@ class LogEntryManager(models.Manager):
 
         return self.filter(modelname=model.get_long_name())
 
+    def purge(self, modelname, before=None):
+        """
+        Delete the log entries of a model type, only those older than a date if given, archived ones included.
+        Entries are removed by set-based DELETE on successive date ranges to keep each statement short.
+
+        :param modelname: The model type of entries to delete.
+        :type modelname: str
+        :param before: The date limit, all entries if None.
+        :type before: datetime
+        :return: The number of deleted entries.
+        :rtype: int
+        """
+        from lucterios.framework.auditlog_archive import LogEntryArchive
+        LogEntryArchive.forget(modelname, before)
+        log_entries = self.filter(modelname=modelname)
+        if before is None:
+            before = log_entries.aggregate(Max('timestamp'))['timestamp__max']
+            if before is None:
+                return 0
+            before += timedelta(microseconds=1)
+        log_entries = log_entries.filter(timestamp__lt=before)
+        nb_deleted = 0
+        range_begin = log_entries.aggregate(Min('timestamp'))['timestamp__min']
+        while range_begin is not None:
+            range_end = min(range_begin + LOG_ENTRY_PURGE_RANGE, before)
+            nb_deleted += log_entries.filter(timestamp__lt=range_end).delete()[0]
+            range_begin = log_entries.aggregate(Min('timestamp'))['timestamp__min']
+        return nb_deleted
+
     def _get_pk_value(self, instance):
         """
         Get the primary key field value for a model instance.
@@ -895,6 +1061,29 @@ class LucteriosLogEntry(LucteriosModel):
             res.append((modelname, six.text_type(model_item._meta.verbose_name)))
         return sorted(list(set(res)), key=lambda item: item[1])
 
+    _fields_info = {}
+
+    @classmethod
+    def get_field_info(cls, modelname, fieldname):
+        # titles and formats hold translated labels
+        field_key = (modelname, fieldname, get_language())
+        if field_key not in cls._fields_info:
+            try:
+                dep_field = apps.get_model(modelname)._meta.get_field(fieldname)
+            except (LookupError, FieldDoesNotExist):
+                dep_field = None
+            if (dep_field is None) or (not dep_field.editable or dep_field.primary_key):
+                field_info = None
+            else:
+                title = dep_field.verbose_name if hasattr(dep_field, 'verbose_name') else dep_field.name
+                if isinstance(getattr(dep_field, '_format_string', None), FunctionType):
+                    field_format = None  # computed format, evaluated for each value
+                else:
+                    field_format = extract_format(get_format_from_field(dep_field))
+                field_info = (dep_field, title, field_format)
+            cls._fields_info[field_key] = field_info
+        return cls._fields_info[field_key]
+
     def get_field(self, name):
         try:
             model = apps.get_model(self.modelname)
@@ -903,25 +1092,28 @@ class LucteriosLogEntry(LucteriosModel):
             return None
 
     def get_message(self):
-        def get_new_line(action, dep_field, value):
-            if hasattr(dep_field, 'verbose_name'):
-                title = dep_field.verbose_name
-            else:
-                title = dep_field.name
+        def get_new_line(action, field_info, value):
+            dep_field, title, field_format = field_info
+            if field_format is None:
+                field_format = extract_format(get_format_from_field(dep_field))
             if action in (self.Action.CREATE, self.Action.ADD) or (value[0] == value[1]):
-                return '%s: "%s"' % (title, get_format_value(dep_field, value[1]))
+                return '%s: "%s"' % (title, format_to_string(value[1], *field_format))
             elif action == self.Action.UPDATE:
-                return '%s: "%s" -> "%s"' % (title, get_format_value(dep_field, value[0]), get_format_value(dep_field, value[1]))
+                return '%s: "%s" -> "%s"' % (title, format_to_string(value[0], *field_format), format_to_string(value[1], *field_format))
             else:
-                return '%s: "%s"' % (title, get_format_value(dep_field, value[0]))
+                return '%s: "%s"' % (title, format_to_string(value[0], *field_format))
 
+        message_key = (self.modelname, self.action, self.changes, self.additional_data, get_language())
+        message_cache = getattr(self, '_message_cache', None)
+        if (message_cache is not None) and (message_cache[0] == message_key):
+            return list(message_cache[1])
         changes = json.loads(self.changes)
         res = []
         for key, value in changes.items():
-            dep_field = self.get_field(key)
-            if (dep_field is None) or (not dep_field.editable or dep_field.primary_key):
+            field_info = self.get_field_info(self.modelname, key)
+            if field_info is None:
                 continue
-            res.append(get_new_line(self.action, dep_field, value))
+            res.append(get_new_line(self.action, field_info, value))
         if self.additional_data is not None:
             additional_data = json.loads(self.additional_data)
             for field_title, values in additional_data.items():
@@ -930,23 +1122,30 @@ class LucteriosLogEntry(LucteriosModel):
                     res_data = []
                     for value_item in value_data:
                         if isinstance(value_item, dict) and ('modelname' in value_item) and ('changes' in value_item):
-                            sub_model = apps.get_model(value_item['modelname'])
                             for sub_fieldname, diff_value in value_item['changes'].items():
-                                sub_dep_field = sub_model._meta.get_field(sub_fieldname)
-                                if (sub_dep_field is None) or (not sub_dep_field.editable or sub_dep_field.primary_key):
+                                sub_field_info = self.get_field_info(value_item['modelname'], sub_fieldname)
+                                if sub_field_info is None:
                                     continue
-                                res_data.append(get_new_line(action_id, sub_dep_field, diff_value))
+                                res_data.append(get_new_line(action_id, sub_field_info, diff_value))
                         else:
                             res_data.append(value_item)
                     res.append('%s: %s = "%s"' % (field_title, LucteriosLogEntry.Action.get_action_title(action_id),
                                                   '" "'.join(res_data)))
-        return res
+        self._message_cache = (message_key, res)
+        return list(res)
+
+    def _get_additional_dict(self):
+        if getattr(self, '_additional_dict', None) is None:
+            self._additional_dict = {} if self.additional_data is None else json.loads(self.additional_data)
+        return self._additional_dict
+
+    def dump_additional_data(self):
+        if getattr(self, '_additional_dict', None) is not None:
+            self.additional_data = json.dumps(self._additional_dict, default=six.text_type, separators=(',', ':'))
 
     def change_additional_data(self, sender_ident, log_action, addon_data):
-        if self.additional_data is None:
-            additional_data = {}
-        else:
-            additional_data = json.loads(self.additional_data)
+        additional_data = self._get_additional_dict()
+        log_action = six.text_type(log_action)
         if sender_ident not in additional_data:
             additional_data[sender_ident] = {}
         if log_action not in additional_data[sender_ident]:
@@ -955,8 +1154,9 @@ class LucteriosLogEntry(LucteriosModel):
             additional_data[sender_ident][log_action].extend(addon_data)
         else:
             additional_data[sender_ident][log_action].append(addon_data)
-        self.additional_data = json.dumps(additional_data, default=six.text_type)
-        self.save()
+        if not getattr(self, '_buffered', False):
+            self.dump_additional_data()
+            self.save()
 
     class Meta(object):
         default_permissions = []
@@ -966,6 +1166,85 @@ class LucteriosLogEntry(LucteriosModel):
         verbose_name_plural = _("log entries")
 
 
+class LogEntryBuffer(ContextDecorator):
+    """
+    Keep the log entries written inside the block in memory and insert them with bulk_create when the
+    outermost block ends without error, still inside the current transaction.
+    """
+
+    BATCH_SIZE = 500
+
+    _local = threading.local()
+
+    @classmethod
+    def is_active(cls):
+        return getattr(cls._local, 'depth', 0) > 0
+
+    @classmethod
+    def append(cls, log_entry, db, instance=None):
+        object_key = (db, log_entry.modelname, log_entry.object_pk)
+        if log_entry.action == LucteriosLogEntry.Action.CREATE:
+            # same rule as an immediate write: a new object forgets the older entries of its pk
+            for old_entry in cls._local.objects.get(object_key, []):
+                old_entry._dropped = True
+            cls._local.objects[object_key] = []
+        log_entry._buffered = True
+        log_entry._dropped = False
+        log_entry._state.db = db
+        cls._local.objects.setdefault(object_key, []).append(log_entry)
+        cls._local.entries.append(log_entry)
+        if instance is not None:
+            cls._local.instances.append((instance, log_entry))
+
+    def __enter__(self):
+        if not self.is_active():
+            self._local.depth = 0
+            self._local.entries = []
+            self._local.objects = {}
+            self._local.instances = []
+        self._local.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            log_entries = [log_entry for log_entry in self._local.entries if not log_entry._dropped]
+            instances = self._local.instances
+            self._local.entries = []
+            self._local.objects = {}
+            self._local.instances = []
+            if exc_type is None:
+                self.flush(log_entries)
+            for instance, log_entry in instances:
+                # entry not written, or written without getting its id back (SQLite, MySQL):
+                # a later change of this instance must log a new entry instead of saving this one again
+                if (log_entry.pk is None) and (getattr(instance, '_last_log', None) is log_entry):
+                    del instance._last_log
+        return False
+
+    @classmethod
+    def flush(cls, log_entries):
+        entries_by_db = {}
+        for log_entry in log_entries:
+            log_entry._buffered = False
+            log_entry.dump_additional_data()
+            entries_by_db.setdefault(log_entry._state.db, []).append(log_entry)
+        for db, db_entries in entries_by_db.items():
+            if connections[db].needs_rollback:
+                continue
+            manager = LucteriosLogEntry.objects.db_manager(db)
+            created_ids = {}
+            for log_entry in db_entries:
+                if log_entry.action == LucteriosLogEntry.Action.CREATE:
+                    created_ids.setdefault(log_entry.modelname, []).append(log_entry.object_pk)
+                # actor and remote address are set by pre_save receivers
+                pre_save.send(sender=LucteriosLogEntry, instance=log_entry, raw=False, using=db, update_fields=None)
+            for modelname, object_pks in created_ids.items():
+                for index in range(0, len(object_pks), cls.BATCH_SIZE):
+                    manager.filter(modelname=modelname, object_pk__in=object_pks[index:index + cls.BATCH_SIZE]).delete()
+            manager.bulk_create(db_entries, batch_size=cls.BATCH_SIZE)
+
+
 class PrintFieldsPlugIn(object):
     _plug_ins = {}
     name = "EMPTY"
@@ -1048,8 +1327,8 @@ class LucteriosScheduler(object):
 
     @classmethod
     def remove(cls, callback):
-        scheduler = cls.get_scheduler()
-        if scheduler.get_job(callback.__name__) is not None:
+        scheduler = LucteriosScheduler._scheduler
+        if (scheduler is not None) and (scheduler.get_job(callback.__name__) is not None):
             scheduler.remove_job(callback.__name__)
 
     @classmethod
@@ -26,25 +26,30 @@ from __future__ import unicode_literals
 from lxml import etree
 from copy import deepcopy
 from os.path import join, dirname, isfile
-from logging import getLogger
+from logging import getLogger, DEBUG
+import re
 
 from django.utils import six
-from django.db.models import Q
 from django.utils.translation import ugettext as _
 
 from lucterios.framework.xfercomponents import XferCompTab, \
     XferCompLinkLabel, XferCompLabelForm, XferCompImage, XferCompGrid, \
     XferCompDate, XferCompDateTime, XferCompSelect, XferCompTime, XferCompCheck
 from lucterios.framework.error import LucteriosException, IMPORTANT, GRAVE
-from lucterios.framework.tools import toHtml, format_to_string
+from lucterios.framework.tools import toHtml, compile_format
 from lucterios.framework.filetools import BASE64_PREFIX, get_image_absolutepath, get_image_size
-from lucterios.framework.reporting import transforme_xml2pdf, get_text_size
+from lucterios.framework.reporting import transforme_model2pdf, transforme_model2file, get_text_size
 from lucterios.framework.xferbasic import XferContainerAbstract
+from lucterios.framework.models import get_items_filtered
 
 DPI = 0.3528125
 
+PLAIN_TEXT = re.compile(r'^[^<>&\x00-\x08\x0b\x0c\x0e-\x1f]*$')
+
 
 def remove_format(xml_text):
+    if ('&' not in xml_text) and ('<' not in xml_text) and ('{[' not in xml_text):
+        return xml_text
     xml_text = xml_text.replace('&#160;', ' ')
     xml_text = xml_text.replace('<b>', '')
     xml_text = xml_text.replace('<i>', '')
@@ -83,13 +88,23 @@ def calcul_text_size(text, font_size=9, line_height=10, text_align='left', is_ce
     return width, height
 
 
+def is_plain_text(text):
+    return (PLAIN_TEXT.match(text) is not None) and ('{[' not in text) and (']}' not in text)
+
+
 def convert_to_html(tagname, text, font_family="sans-serif", font_size=9, line_height=10, text_align='left'):
     try:
-        html_text = ''
-        html_node = etree.HTML('<div>%s</div>' % toHtml(text))
-        html_text = etree.tostring(html_node.find('body/div'), xml_declaration=False, encoding='utf-8').decode("utf-8")
-        html_text = html_text.strip()[5:-6]
-        xml_text = etree.XML("<%(tagname)s>%(text)s</%(tagname)s>" % {'tagname': tagname, 'text': html_text})
+        html_text = six.text_type(text)
+        if is_plain_text(html_text):
+            # nothing to interpret: HTML parsing would give back the same text
+            xml_text = etree.Element(tagname)
+            if html_text != '':
+                xml_text.text = html_text
+        else:
+            html_node = etree.HTML('<div>%s</div>' % toHtml(html_text))
+            html_text = etree.tostring(html_node.find('body/div'), xml_declaration=False, encoding='utf-8').decode("utf-8")
+            html_text = html_text.strip()[5:-6]
+            xml_text = etree.XML("<%(tagname)s>%(text)s</%(tagname)s>" % {'tagname': tagname, 'text': html_text})
         xml_text.attrib['font_family'] = font_family
         xml_text.attrib['font_size'] = "%d" % font_size
         xml_text.attrib['line_height'] = "%d" % line_height
@@ -202,16 +217,16 @@ class PrintTable(PrintItem):
             size_cx, size_cy = calcul_text_size(header.descript, 9, 10, "center", True)
             self.size_rows[0] = max(self.size_rows[0], size_cy)
             self.columns.append([header.descript, size_cx * self.RATIO])
+        formated_columns = [compile_format(header.htype, header.formatstr).format_column(self.comp.get_column(header.name)) for header in self.comp.headers]
         row_idx = 0
-        for recordid in self.comp.record_ids:
-            record = self.comp.records[recordid]
+        for _recordid in self.comp.record_ids:
             while len(self.rows) <= row_idx:
                 self.rows.append([])
             while len(self.size_rows) <= (row_idx + 1):
                 self.size_rows.append(0)
             hd_idx = 0
             for header in self.comp.headers:
-                value = format_to_string(record[header.name], header.htype, header.formatstr)
+                value = formated_columns[hd_idx][row_idx]
                 if header.htype == 'icon':
                     value = BASE64_PREFIX + value
                     img_size = get_image_size(value)
@@ -385,19 +400,36 @@ class ReportGenerator(object):
         if request is not None:
             self.xfer._initialize(request)
 
-    def generate(self, request):
+    def build(self, request):
         self.modelxml = etree.Element('model')
         self.add_page()
         self.fill_content(request)
         self.fill_attrib()
+        return self.modelxml
+
+    def generate(self, request):
         xml_generated = etree.tostring(
-            self.modelxml, xml_declaration=True, pretty_print=True, encoding='utf-8')
+            self.build(request), xml_declaration=True, pretty_print=True, encoding='utf-8')
         getLogger("lucterios.core.print").debug(xml_generated.decode("utf-8"))
         return xml_generated
 
+    def _render_pdf(self, request, pdf_filename=None):
+        # the model is rendered as built: no serialised copy of the report
+        report_model = self.build(request)
+        if getLogger("lucterios.core.print").isEnabledFor(DEBUG):
+            getLogger("lucterios.core.print").debug(etree.tostring(report_model, pretty_print=True, encoding='utf-8').decode("utf-8"))
+        try:
+            if pdf_filename is None:
+                return transforme_model2pdf(report_model, self.watermark)
+            else:
+                return transforme_model2file(report_model, self.watermark, pdf_filename)
+        except ValueError:
+            getLogger("lucterios.core.print").exception('transforme_model2pdf')
+            raise LucteriosException(IMPORTANT, _('This impression failed !'))
+
     def generate_report(self, request, is_csv):
-        report_content = self.generate(request)
         if is_csv:
+            report_content = self.generate(request)
             xsl_file = join(dirname(__file__), "ConvertxlpToCSV.xsl")
             if not isfile(xsl_file):
                 raise LucteriosException(GRAVE, "Error:no csv xsl file!")
@@ -408,16 +440,15 @@ class ReportGenerator(object):
                 xml_br.text = ','
             content = six.text_type(csv_transform(xml_rep_content)).encode('utf-8')
         else:
-            try:
-                content = transforme_xml2pdf(report_content, self.watermark)
-            except ValueError:
-                getLogger("lucterios.core.print").exception('transforme_xml2pdf')
-                raise LucteriosException(IMPORTANT, _('This impression failed !'))
+            content = self._render_pdf(request)
         if len(content) > 0:
             return content
         else:
             return ""
 
+    def save_report(self, request, pdf_filename):
+        return self._render_pdf(request, pdf_filename)
+
 
 class ActionGenerator(ReportGenerator):
 
@@ -565,10 +596,7 @@ class ReportModelGenerator(ReportGenerator):
         self.filter_callback = None
 
     def get_items_filtered(self):
-        if isinstance(self.filter, Q) and (len(self.filter.children) > 0):
-            item_list = self.model.objects.filter(self.filter).distinct()
-        else:
-            item_list = self.model.objects.all()
+        item_list = get_items_filtered(self.model, self.filter)
         if self.filter_callback is None:
             return item_list
         else:
@@ -29,6 +29,8 @@ from reportlab.pdfgen import canvas
 from lxml import etree
 from logging import getLogger
 from re import compile, sub
+from collections import OrderedDict
+import threading
 
 from django.utils import six
 
@@ -281,6 +283,11 @@ class ConvertHTML_XMLReportlab(object):
 
     @classmethod
     def convert(cls, html_items, no_para):
+        if len(html_items) == 0:
+            # plain text: no tree to walk
+            if (html_items.text is not None) and (html_items.text.strip() != ''):
+                return [html_items.text]
+            return ['']
         getLogger('lucterios.printing').debug("\n[[[ ConvertHTML_XMLReportlab html = %s", etree.tostring(html_items, pretty_print=True).decode())
         xmlrl_items = etree.Element('MULTI')
         parser = cls(xmlrl_items, no_para)
@@ -336,6 +343,61 @@ def initial_fonts():
         g_initial_fonts = True
 
 
+class TextWidthCache(object):
+    """
+    Widths of texts measured for the layout, by font and size.
+    The last measured texts are kept; ASCII texts are measured from a table of character widths.
+    """
+
+    MAX_SIZE = 20000
+
+    _widths = OrderedDict()
+
+    _char_widths = {}
+
+    _lock = threading.RLock()
+
+    @classmethod
+    def clear(cls):
+        cls._lock.acquire()
+        try:
+            cls._widths.clear()
+            cls._char_widths.clear()
+        finally:
+            cls._lock.release()
+
+    @classmethod
+    def get_char_widths(cls, font_name):
+        if font_name not in cls._char_widths:
+            cls._char_widths[font_name] = [stringWidth(chr(char_code), font_name, 1000) for char_code in range(128)]
+        return cls._char_widths[font_name]
+
+    @classmethod
+    def measure(cls, text, font_name, font_size):
+        try:
+            text.encode('ascii')
+        except UnicodeEncodeError:
+            return stringWidth(text, font_name, font_size)
+        char_widths = cls.get_char_widths(font_name)
+        return sum([char_widths[ord(char)] for char in text]) * 0.001 * font_size
+
+    @classmethod
+    def get_width(cls, text, font_name, font_size):
+        key = (text, font_name, font_size)
+        cls._lock.acquire()
+        try:
+            if key in cls._widths:
+                cls._widths.move_to_end(key)
+                return cls._widths[key]
+            width = cls.measure(text, font_name, font_size)
+            cls._widths[key] = width
+            if len(cls._widths) > cls.MAX_SIZE:
+                cls._widths.popitem(last=False)
+            return width
+        finally:
+            cls._lock.release()
+
+
 def get_text_size(para_text, font_size=9, line_height=10, text_align='left', is_cell=False):
     initial_fonts()
     lines = para_text.split('\n')
@@ -343,7 +405,7 @@ def get_text_size(para_text, font_size=9, line_height=10, text_align='left', is_
     for line in lines:
         if len(line) > len(max_line):
             max_line = line
-    width = stringWidth(max_line, "sans-serif", font_size)
+    width = TextWidthCache.get_width(max_line, "sans-serif", font_size)
     if is_cell:
         height = font_size * max(1, len(lines) * 2 / 3)
     else:
@@ -354,8 +416,8 @@ def get_text_size(para_text, font_size=9, line_height=10, text_align='left', is_
 
 class LucteriosPDF(object):
 
-    def __init__(self, watermark):
-        self.pdf = canvas.Canvas("lucterios.pdf")
+    def __init__(self, watermark, filename="lucterios.pdf"):
+        self.pdf = canvas.Canvas(filename)
         self.styles = getSampleStyleSheet()
         self.xml = None
         self.pages = None
@@ -372,6 +434,7 @@ class LucteriosPDF(object):
         self.current_page = None
         self.is_changing_page = False
         self.watermark = watermark.strip()
+        self._para_texts = {}
         initial_fonts()
 
     @property
@@ -454,8 +517,17 @@ class LucteriosPDF(object):
             current_y = self.y_offset + get_size(xmlitem, 'top')
         return current_y
 
+    def get_para_texts(self, xmltext, no_para):
+        if len(xmltext) == 0:
+            return ConvertHTML_XMLReportlab.convert(xmltext, no_para)
+        # rich texts are often repeated in a document: convert them once
+        para_key = (etree.tostring(xmltext, with_tail=False), no_para)
+        if para_key not in self._para_texts:
+            self._para_texts[para_key] = ConvertHTML_XMLReportlab.convert(xmltext, no_para)
+        return self._para_texts[para_key]
+
     def create_para(self, xmltext, current_w, current_h, offset_font_size=0, no_para=False):
-        para_text_list = ConvertHTML_XMLReportlab.convert(xmltext, no_para)
+        para_text_list = self.get_para_texts(xmltext, no_para)
         font_name = xmltext.get('font_family')
         if font_name is None:
             font_name = 'sans-serif'
@@ -505,6 +577,7 @@ class LucteriosPDF(object):
     def parse_table(self, xmltable, current_x, current_y, current_w, current_h):
 
         def get_table_heigth(current_data, current_width_columns):
+            # rows do not depend on each other: a table is as high as the sum of its rows
             table = Table(
                 current_data, style=TABLE_STYLE, colWidths=current_width_columns)
             _, table_h = table.wrapOn(self.pdf, current_w, current_h)
@@ -518,8 +591,10 @@ class LucteriosPDF(object):
             self.position_y = current_y + max(new_current_h, current_h)
             return
         cellcolumns, width_columns, _ = self.extract_columns_for_table(xmltable.xpath('columns'))
+        header_height = get_table_heigth([cellcolumns], width_columns)
         data = []
         data.append(cellcolumns)
+        table_height = header_height
         for row in xmltable.xpath('rows'):
             row_line = []
             col_idx = 0
@@ -531,15 +606,17 @@ class LucteriosPDF(object):
                     paras, _ = self.create_para(cell, width_columns[col_idx], 0)
                     row_line.append(paras[0][0])
                 col_idx += 1
-            table_height = get_table_heigth(data + [row_line], width_columns)
-            # six.print_("table y:%f height:%f h-b:%F" % (current_y / mm, table_height / mm, (self.height - self.bottom_h - self.b_margin) / mm))
-            if (current_y + table_height) > (self.height - self.bottom_h - self.b_margin):
+            row_height = get_table_heigth([row_line], width_columns)
+            # six.print_("table y:%f height:%f h-b:%F" % (current_y / mm, (table_height + row_height) / mm, (self.height - self.bottom_h - self.b_margin) / mm))
+            if (current_y + table_height + row_height) > (self.height - self.bottom_h - self.b_margin):
                 draw_table(width_columns, data)
                 self.add_page()
                 current_y = self.header_h + self.t_margin
                 data = []
                 data.append(cellcolumns)
+                table_height = header_height
             data.append(row_line)
+            table_height += row_height
         getLogger('lucterios.printing').debug("-- parse_table (x=%.2f/y=%.2f/h=%.2f/w=%.2f) --", current_x, current_y, current_h, current_w)
         draw_table(width_columns, data)
 
@@ -645,7 +722,10 @@ class LucteriosPDF(object):
         self._parse_comp(bottom[0], self.height - self.b_margin - self.bottom_h)
 
     def execute(self, xml_content):
-        self.xml = etree.fromstring(xml_content)
+        self.render(etree.fromstring(xml_content))
+
+    def render(self, xml_model):
+        self.xml = xml_model
         self._init()
         for page in self.pages:
             self.current_page = page
@@ -657,6 +737,9 @@ class LucteriosPDF(object):
     def output(self):
         return self.pdf.getpdfdata()
 
+    def save(self):
+        self.pdf.save()
+
 
 def transforme_xml2pdf(xml_content, watermark):
     lpdf = LucteriosPDF(watermark)
@@ -664,6 +747,19 @@ def transforme_xml2pdf(xml_content, watermark):
     return lpdf.output()
 
 
+def transforme_model2pdf(xml_model, watermark):
+    lpdf = LucteriosPDF(watermark)
+    lpdf.render(xml_model)
+    return lpdf.output()
+
+
+def transforme_model2file(xml_model, watermark, pdf_filename):
+    lpdf = LucteriosPDF(watermark, pdf_filename)
+    lpdf.render(xml_model)
+    lpdf.save()
+    return isfile(pdf_filename)
+
+
 def transform_file_xml2pdf(xml_filename, pdf_filename):
     with open(xml_filename, 'rb') as flb:
         pdf_content = transforme_xml2pdf(flb.read())
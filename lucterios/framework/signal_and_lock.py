@@ -25,13 +25,16 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import unicode_literals
 import threading
 import logging
+from datetime import timedelta
 
 from django.utils.translation import ugettext_lazy as _
-from django.utils import six
+from django.utils import six, timezone
+from django.utils.module_loading import import_string
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction, IntegrityError
 
 from lucterios.framework.error import LucteriosException, IMPORTANT
-from lucterios.framework.models import LucteriosSession
+from lucterios.framework.models import LucteriosSession, LucteriosRecordLock
 from importlib import import_module
 
 
@@ -98,22 +101,156 @@ class Signal(object):
 unlocker_view_class = None
 
 
+class MemoryRecordLockStore(object):
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._lock_list = {}
+        self._models = {}
+        self._sessions = {}
+
+    def get(self, lock_ident):
+        if lock_ident in self._lock_list.keys():
+            session_key, _modelname, expire_date = self._lock_list[lock_ident]
+            if expire_date > timezone.now():
+                return session_key
+            self.remove(lock_ident)
+        return None
+
+    def set(self, lock_ident, modelname, session_key, expire_date):
+        self.remove(lock_ident)
+        self._lock_list[lock_ident] = (session_key, modelname, expire_date)
+        self._models.setdefault(modelname, set()).add(lock_ident)
+        self._sessions.setdefault(session_key, set()).add(lock_ident)
+        return True
+
+    def remove(self, lock_ident, session_key=None):
+        if lock_ident in self._lock_list.keys():
+            old_session_key, modelname, _expire_date = self._lock_list[lock_ident]
+            if (session_key is None) or (session_key == old_session_key):
+                del self._lock_list[lock_ident]
+                self._models[modelname].discard(lock_ident)
+                self._sessions[old_session_key].discard(lock_ident)
+
+    def remove_session(self, session_key):
+        for lock_ident in list(self._sessions.get(session_key, ())):
+            self.remove(lock_ident)
+
+    def has_model(self, modelname):
+        dt_now = timezone.now()
+        for lock_ident in self._models.get(modelname, ()):
+            if self._lock_list[lock_ident][2] > dt_now:
+                return True
+        return False
+
+
+class DatabaseRecordLockStore(object):
+
+    def clear(self):
+        LucteriosRecordLock.objects.all().delete()
+
+    def get(self, lock_ident):
+        lock_item = LucteriosRecordLock.objects.filter(lock_ident=lock_ident).first()
+        if lock_item is not None:
+            if lock_item.expire_date > timezone.now():
+                return lock_item.session_key
+            lock_item.delete()
+        return None
+
+    def set(self, lock_ident, modelname, session_key, expire_date):
+        if LucteriosRecordLock.objects.filter(lock_ident=lock_ident, session_key=session_key).update(expire_date=expire_date) > 0:
+            return True
+        # expired locks of any record: nothing else removes them from the table
+        LucteriosRecordLock.objects.filter(expire_date__lte=timezone.now()).delete()
+        try:
+            with transaction.atomic():
+                LucteriosRecordLock.objects.create(lock_ident=lock_ident, modelname=modelname, session_key=session_key, expire_date=expire_date)
+            return True
+        except IntegrityError:
+            # taken by another process in the meantime
+            return False
+
+    def remove(self, lock_ident, session_key=None):
+        lock_items = LucteriosRecordLock.objects.filter(lock_ident=lock_ident)
+        if session_key is not None:
+            lock_items = lock_items.filter(session_key=session_key)
+        lock_items.delete()
+
+    def remove_session(self, session_key):
+        LucteriosRecordLock.objects.filter(session_key=session_key).delete()
+
+    def has_model(self, modelname):
+        return LucteriosRecordLock.objects.filter(modelname=modelname, expire_date__gt=timezone.now()).exists()
+
+
+RECORD_LOCK_STORES = {'memory': MemoryRecordLockStore, 'database': DatabaseRecordLockStore}
+
+
 class RecordLocker(object):
 
-    _lock_list = {}
+    _store = None
 
     _lock = threading.RLock()
 
+    @classmethod
+    def get_store(cls):
+        cls._lock.acquire()
+        try:
+            if cls._store is None:
+                from django.conf import settings
+                store_name = getattr(settings, 'RECORD_LOCK_STORE', 'database')
+                if store_name in RECORD_LOCK_STORES.keys():
+                    cls._store = RECORD_LOCK_STORES[store_name]()
+                else:
+                    cls._store = import_string(store_name)()
+            return cls._store
+        finally:
+            cls._lock.release()
+
+    @classmethod
+    def get_ttl(cls):
+        from django.conf import settings
+        return getattr(settings, 'RECORD_LOCK_TTL', settings.SESSION_COOKIE_AGE)
+
+    @classmethod
+    def get_lock_ident(cls, model_item):
+        return "-".join((cls.get_model_ident(model_item.__class__), six.text_type(model_item.pk)))
+
+    @classmethod
+    def get_model_ident(cls, model_class):
+        return "-".join((six.text_type(model_class.__module__), six.text_type(model_class.__name__)))
+
     @classmethod
     def clear(cls):
         logging.getLogger("lucterios.core.record").debug(">> clear")
         cls._lock.acquire()
         try:
-            cls._lock_list = {}
+            cls.get_store().clear()
         finally:
             cls._lock.release()
         logging.getLogger("lucterios.core.record").debug("<< clear")
 
+    @classmethod
+    def _get_owner_name(cls, store, lock_ident):
+        try:
+            return LucteriosSession.objects.get(pk=store.get(lock_ident)).username
+        except ObjectDoesNotExist:
+            return '---'
+
+    @classmethod
+    def _check_owner(cls, store, lock_ident, session_key):
+        old_session_key = store.get(lock_ident)
+        if (old_session_key is not None) and (old_session_key != session_key):
+            try:
+                old_session = LucteriosSession.objects.get(pk=old_session_key)
+                if old_session.get_is_active():
+                    raise LucteriosException(IMPORTANT, _("Record locked by '%s'!") % old_session.username)
+            except ObjectDoesNotExist:
+                pass
+            store.remove(lock_ident, old_session_key)
+
     @classmethod
     def lock(cls, request, model_item):
         logging.getLogger("lucterios.core.record").debug(">> lock [%s] %s", request.user, model_item)
@@ -123,21 +260,16 @@ class RecordLocker(object):
             from django.conf import settings
             session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
             if session_key is not None:
-                lock_ident = "-".join((six.text_type(model_item.__module__),
-                                       six.text_type(model_item.__class__.__name__), six.text_type(model_item.pk)))
+                lock_ident = cls.get_lock_ident(model_item)
                 params['LOCK_IDENT'] = lock_ident
-                if lock_ident in cls._lock_list.keys():
-                    old_session_key = cls._lock_list[lock_ident]
-                    if old_session_key != session_key:
-                        try:
-                            old_session = LucteriosSession.objects.get(pk=old_session_key)
-                            if old_session.get_is_active():
-                                raise LucteriosException(IMPORTANT, _("Record locked by '%s'!") % old_session.username)
-                            else:
-                                del cls._lock_list[lock_ident]
-                        except ObjectDoesNotExist:
-                            pass
-                cls._lock_list[lock_ident] = session_key
+                store = cls.get_store()
+                expire_date = timezone.now() + timedelta(seconds=cls.get_ttl())
+                cls._check_owner(store, lock_ident, session_key)
+                if not store.set(lock_ident, cls.get_model_ident(model_item.__class__), session_key, expire_date):
+                    cls._check_owner(store, lock_ident, session_key)
+                    if not store.set(lock_ident, cls.get_model_ident(model_item.__class__), session_key, expire_date):
+                        # taken again by another process
+                        raise LucteriosException(IMPORTANT, _("Record locked by '%s'!") % cls._get_owner_name(store, lock_ident))
             return params
         finally:
             cls._lock.release()
@@ -148,9 +280,7 @@ class RecordLocker(object):
         logging.getLogger("lucterios.core.record").debug(">> is_lock %s", model_item)
         cls._lock.acquire()
         try:
-            lock_ident = "-".join((six.text_type(model_item.__module__),
-                                   six.text_type(model_item.__class__.__name__), six.text_type(model_item.pk)))
-            return lock_ident in cls._lock_list.keys()
+            return cls.get_store().get(cls.get_lock_ident(model_item)) is not None
         finally:
             cls._lock.release()
             logging.getLogger("lucterios.core.record").debug("<< is_lock %s", model_item)
@@ -160,11 +290,7 @@ class RecordLocker(object):
         logging.getLogger("lucterios.core.record").debug(">> has_item_lock %s", model_class)
         cls._lock.acquire()
         try:
-            lock_root = "-".join((six.text_type(model_class.__module__), six.text_type(model_class.__name__)))
-            for lock_ident in cls._lock_list.keys():
-                if lock_ident.startswith(lock_root):
-                    return True
-            return False
+            return cls.get_store().has_model(cls.get_model_ident(model_class))
         finally:
             cls._lock.release()
             logging.getLogger("lucterios.core.record").debug("<< has_item_lock %s", model_class)
@@ -177,14 +303,9 @@ class RecordLocker(object):
             from django.conf import settings
             session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
             if (session_key is not None) and (params is None):
-                lock_ident_list = list(cls._lock_list.keys())
-                for lock_ident in lock_ident_list:
-                    if (lock_ident in cls._lock_list) and (cls._lock_list[lock_ident] == session_key):
-                        del cls._lock_list[lock_ident]
+                cls.get_store().remove_session(session_key)
             elif (session_key is not None) and ('LOCK_IDENT' in params.keys()):
-                lock_ident = params['LOCK_IDENT']
-                if (lock_ident in cls._lock_list.keys()) and (cls._lock_list[lock_ident] == session_key):
-                    del cls._lock_list[lock_ident]
+                cls.get_store().remove(params['LOCK_IDENT'], session_key)
         finally:
             cls._lock.release()
             logging.getLogger("lucterios.core.record").debug(">> unlock [%s]", request.user)
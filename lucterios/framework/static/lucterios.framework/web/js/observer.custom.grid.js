@@ -451,6 +451,7 @@ var compGrid = compGeneric
 			change_numpage : function(newPage) {
 				this.owner.getContext().put('GRID_PAGE%{0}'.format(this.name), newPage);
 				this.owner.getContext().put('GRID_SIZE%{0}'.format(this.name), this.size_by_page);
+				this.owner.getContext().put('GRID_FLIP%{0}'.format(this.name), '1');
 				this.owner.refresh();
 			},
 
@@ -9,6 +9,7 @@ var MODE_EXPORT_CSV = 4;
 var ObserverPrint = ObserverAbstract.extend({
 	mode : MODE_NONE,
 	print_content : null,
+	print_download : null,
 	title : '',
 
 	getObserverName : function() {
@@ -22,6 +23,7 @@ var ObserverPrint = ObserverAbstract.extend({
 		this.title = print_elements.title;
 		this.mode = parseInt(print_elements.mode, 10) || MODE_PREVIEW;
 		this.print_content = print_elements.content;
+		this.print_download = print_elements.download || null;
 	},
 
 	show : function(aTitle, aGUIType) {
@@ -34,6 +36,12 @@ var ObserverPrint = ObserverAbstract.extend({
 			file_name += '.pdf';
 		}
 
-		Singleton().mFileManager.saveFile(this.print_content, file_name);
+		if (this.print_download !== null) {
+			Singleton().Transport().getFileContent(this.print_download, function(blob) {
+				Singleton().mFileManager.saveBlob(blob, file_name);
+			});
+		} else {
+			Singleton().mFileManager.saveFile(this.print_content, file_name);
+		}
 	}
 });
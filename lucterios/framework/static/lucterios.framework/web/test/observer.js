@@ -29,6 +29,11 @@ module('Observer', {
 		this.mFileName = aFileName;
 	},
 
+	saveBlob : function(aBlob, aFileName) {
+		this.mFileContent = aBlob;
+		this.mFileName = aFileName;
+	},
+
 	callback : function() {
 		this.mCalled++;
 	}
@@ -434,6 +439,43 @@ test(
 			equal(this.mObsFactory.CallList.size(), 0, "Call Nb");
 		});
 
+test("Print_Download", function() {
+	var json_receive = {
+		"context" : {
+			"PRINT_MODE" : "3",
+			"MODEL" : "1"
+		},
+		"close" : null,
+		"print" : {
+			"title" : "Example",
+			"mode" : 3,
+			"content" : "",
+			"download" : "CORE/download?filename=print/abc.pdf&sign=0123456789abcdef0123456789abcdef"
+		},
+		"meta" : {
+			"extension" : "lucterios.dummy",
+			"title" : "Example",
+			"action" : "exampleListing",
+			"observer" : "core.print"
+		}
+	};
+
+	Singleton().Transport().JSONReceive = '%PDF-1.4';
+	Singleton().mFileManager = this;
+	equal(this.mFileContent, null, "Empty file");
+	var obs = new ObserverPrint();
+	obs.setSource("lucterios.dummy", "exampleListing");
+	obs.setContent(json_receive);
+	obs.show("Example");
+
+	equal(obs.mode, MODE_EXPORT_PDF, 'mode');
+	equal(Singleton().Transport().XmlParam['URL'], 'CORE/download?filename=print/abc.pdf&sign=0123456789abcdef0123456789abcdef', 'download url');
+	ok(this.mFileContent != null, "File write");
+	equal(this.mFileContent.size, 8, "File size");
+	equal(this.mFileName, 'Example.pdf', 'file name');
+	equal(this.mObsFactory.CallList.size(), 0, "Call Nb");
+});
+
 test("Dialog", function() {
 	var json_receive = {
 		"context" : {
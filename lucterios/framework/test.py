@@ -36,6 +36,7 @@ from django.utils import six, timezone
 
 from lucterios.framework.middleware import LucteriosErrorMiddleware
 from lucterios.framework.xfergraphic import XferContainerAcknowledge
+from lucterios.framework.xfersearch import FieldDescList
 from lucterios.CORE.models import LucteriosUser
 from lucterios.CORE.parameters import notfree_mode_connect, Params
 
@@ -131,6 +132,7 @@ class LucteriosTestAbstract(object):
         self.response = None
         self.clean_resp()
         Params.clear()
+        FieldDescList.clear_cache()
         notfree_mode_connect()
         if not isdir(self.PDF_DIRECTORY):
             makedirs(self.PDF_DIRECTORY)
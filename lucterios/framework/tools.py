@@ -26,13 +26,13 @@ from __future__ import unicode_literals
 from datetime import datetime, date, time
 from calendar import monthrange
 from _decimal import Decimal
-from babel.numbers import format_currency
+from babel.core import Locale, UnknownLocaleError
+from babel.numbers import format_currency, format_decimal, get_decimal_symbol, get_group_symbol
 from babel.dates import format_date, format_time, format_datetime
 
 import threading
 import logging
 import warnings
-import locale
 import sys
 
 from django.utils import six
@@ -534,14 +534,34 @@ def adapt_value(value):
         return value
 
 
+_babel_locales = {}
+
+
+def get_babel_locale(lang=None):
+    from django.utils import translation
+    from django.conf import settings
+    if lang is None:
+        lang = translation.get_language()
+    if lang is None:  # translations deactivated
+        lang = settings.LANGUAGE_CODE
+    babel_locale = _babel_locales.get(lang)
+    if babel_locale is None:
+        try:
+            babel_locale = Locale.parse(translation.to_locale(lang))
+        except (TypeError, ValueError, UnknownLocaleError):
+            babel_locale = Locale.parse('en_US')
+        _babel_locales[lang] = babel_locale
+    return babel_locale
+
+
 def get_date_formating(date_value):
     if isinstance(date_value, datetime):
-        value = format_datetime(date_value, format='full', locale=locale.getlocale()[0])
+        value = format_datetime(date_value, format='full', locale=get_babel_locale())
         return value[:value.index(':') + 3]
     if isinstance(date_value, date):
-        return format_date(date_value, format='long', locale=locale.getlocale()[0])
+        return format_date(date_value, format='long', locale=get_babel_locale())
     if isinstance(date_value, time):
-        return format_time(date_value, format='HH:mm', locale=locale.getlocale()[0])
+        return format_time(date_value, format='HH:mm', locale=get_babel_locale())
     else:
         return date_value
 
@@ -558,25 +578,10 @@ def get_bool_textual(value):
 
 def set_locale_lang(lang):
     from django.utils import translation
-    try:
-        if lang[:2].lower() == 'fr':
-            translation.activate('fr')
-            try:
-                locale.setlocale(locale.LC_ALL, 'french')
-            except Exception:
-                locale.setlocale(locale.LC_ALL, 'fr_FR.UTF-8')
-            return
-        if lang[:2].lower() == 'en':
-            translation.activate('en')
-            try:
-                locale.setlocale(locale.LC_ALL, 'english')
-            except Exception:
-                locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
-            return
-    except Exception:
-        pass
-    translation.activate('en')
-    locale.setlocale(locale.LC_ALL, 'C.UTF-8')
+    if isinstance(lang, six.string_types) and (lang[:2].lower() == 'fr'):
+        translation.activate('fr')
+    else:
+        translation.activate('en')
 
 
 def _convert_value_B(value, format_num):
@@ -612,85 +617,189 @@ def _convert_value_H(value, format_num):
 
 
 def _convert_value_N(value, format_num):
-    return locale.format("%.*f", (int(format_num[1]), float(value)), True)
+    return compile_format(format_num, None)._convert_number(value, format_num)
 
 
-def _convert_value_C(value, format_num):
-    value = _convert_value_N(value, format_num)
-    tmp_val = format_currency(0, format_num[2:])
-    tmp_val = tmp_val.replace(',', '').replace('.', '')
-    for _ in range(6):
-        tmp_val = tmp_val.replace('00', '0')
-    value = tmp_val.replace('0', value)
-    return value
+_currency_templates = {}
 
 
-def format_value(value, format_num):
-    sub_format = None
-    if isinstance(value, dict):
-        if 'format' in value.keys():
-            sub_format = value['format']
-        if 'value' in value.keys():
-            value = value['value']
-        else:
-            value = None
-    if value is None:
-        value = "---"
-        format_num = ''
-    if isinstance(format_num, dict):
-        new_format_num = {}
-        for key, val in format_num.items():
-            new_format_num[six.text_type(key)] = val
-        if six.text_type(value) in new_format_num.keys():
-            value = new_format_num[six.text_type(value)]
-        format_num = ''
-    try:
-        fct = getattr(sys.modules[__name__], "_convert_value_%s" % format_num[0:1], None)
-        if fct is not None:
-            value = fct(value, format_num)
-    except Exception:
-        pass
-    if sub_format is not None:
-        value = sub_format.replace('{0}', six.text_type(value))
-    return value
+def _get_currency_template(currency):
+    tmp_val = _currency_templates.get(currency)
+    if tmp_val is None:
+        from django.conf import settings
+        tmp_val = format_currency(0, currency, locale=get_babel_locale(settings.LANGUAGE_CODE))
+        tmp_val = tmp_val.replace(',', '').replace('.', '')
+        for _ in range(6):
+            tmp_val = tmp_val.replace('00', '0')
+        _currency_templates[currency] = tmp_val
+    return tmp_val
 
 
-def format_to_string(value, format_num, format_str):
-    if format_num is None:
-        format_num = ''
-    if format_str is None:
-        format_str = '{0}'
-    format_str = format_str.replace('%s', '{0}')
-    if ';' in format_str:
-        format_str = format_str.split(';')
+def _convert_value_C(value, format_num):
+    return compile_format(format_num, None)._convert_currency(value, format_num)
+
+
+class CompiledFormat(object):
+
+    def __init__(self, format_num, format_str, babel_locale=None):
+        if babel_locale is None:
+            babel_locale = get_babel_locale()
+        self.babel_locale = babel_locale
+        if format_num is None:
+            format_num = ''
+        if format_str is None:
+            format_str = '{0}'
+        self.choices = None
+        if isinstance(format_num, dict):
+            self.choices = {}
+            for key, val in format_num.items():
+                self.choices[six.text_type(key)] = val
+            format_num = ''
+        self.format_num = format_num
+        self.convert_fct = None
         try:
-            if (abs(float(value)) < 1e-5) and (len(format_str) > 2):
-                format_str = format_str[2]
-                value = float(value)
-            elif (float(value) < 1e-5) and (len(format_str) > 1):
-                format_str = format_str[1]
-                value = abs(float(value))
-            else:
-                format_str = format_str[0]
+            self.convert_fct = getattr(sys.modules[__name__], "_convert_value_%s" % format_num[0:1], None)
+        except Exception:
+            pass
+        try:
+            if self.convert_fct is _convert_value_N:
+                self._compile_number(format_num)
+                self.convert_fct = self._convert_number
+            elif self.convert_fct is _convert_value_C:
+                self._compile_number(format_num)
+                self.currency_template = _get_currency_template(format_num[2:])
+                self.convert_fct = self._convert_currency
+            elif self.convert_fct is _convert_value_B:
+                self.bool_texts = (_("No"), _("Yes"))
+                self.convert_fct = self._convert_bool
+        except Exception:
+            pass
+        format_str = format_str.replace('%s', '{0}')
+        if ';' in format_str:
+            self.format_strs = format_str.split(';')
+        else:
+            self.format_strs = [format_str]
+
+    def _compile_number(self, format_num):
+        self.number_format = "%%.%df" % int(format_num[1])
+        self.decimal_point = get_decimal_symbol(self.babel_locale)
+        self.thousands_sep = get_group_symbol(self.babel_locale)
+        primary_size, secondary_size = self.babel_locale.decimal_formats[None].grouping
+        self.group_sizes = [primary_size] + [secondary_size] * 50
+
+    def _convert_number(self, value, format_num):
+        num_txt = self.number_format % float(value)
+        sign = ''
+        if num_txt[0] == '-':
+            sign = '-'
+            num_txt = num_txt[1:]
+        int_part, point, dec_part = num_txt.partition('.')
+        if not int_part.isdigit():
+            return format_decimal(float(value), locale=self.babel_locale)
+        groups = []
+        for group_size in self.group_sizes:
+            if int_part == '':
+                break
+            groups.append(int_part[-group_size:])
+            int_part = int_part[:-group_size]
+        if int_part != '':
+            groups.append(int_part)
+        groups.reverse()
+        num_txt = sign + self.thousands_sep.join(groups)
+        if point != '':
+            num_txt += self.decimal_point + dec_part
+        return num_txt
+
+    def _convert_currency(self, value, format_num):
+        return self.currency_template.replace('0', self._convert_number(value, format_num))
+
+    def _convert_bool(self, value, format_num):
+        return self.bool_texts[bool(value)]
+
+    def _get_format_str(self, value):
+        if len(self.format_strs) == 1:
+            return self.format_strs[0], value
+        try:
+            if (abs(float(value)) < 1e-5) and (len(self.format_strs) > 2):
+                return self.format_strs[2], float(value)
+            elif float(value) < 1e-5:
+                return self.format_strs[1], abs(float(value))
         except Exception:
-            format_str = format_str[0]
-    if '{0}' not in format_str:
-        return format_str
+            pass
+        return self.format_strs[0], value
+
+    def format_value(self, value):
+        sub_format = None
+        convert_fct = self.convert_fct
+        if isinstance(value, dict):
+            if 'format' in value.keys():
+                sub_format = value['format']
+            if 'value' in value.keys():
+                value = value['value']
+            else:
+                value = None
+        if value is None:
+            value = "---"
+            convert_fct = None
+        elif (self.choices is not None) and (six.text_type(value) in self.choices):
+            value = self.choices[six.text_type(value)]
+        if convert_fct is not None:
+            try:
+                value = convert_fct(value, self.format_num)
+            except Exception:
+                pass
+        if sub_format is not None:
+            value = sub_format.replace('{0}', six.text_type(value))
+        return value
 
-    if isinstance(value, list) or isinstance(value, tuple):
-        value = list(value)
+    def format(self, value):
+        format_str, value = self._get_format_str(value)
+        if '{0}' not in format_str:
+            return format_str
+        if isinstance(value, list) or isinstance(value, tuple):
+            value = [self.format_value(item) for item in value]
+        else:
+            return format_str.replace('{0}', six.text_type(self.format_value(value)))
+        if '{1}' not in format_str:
+            value = ['{[br/]}'.join([six.text_type(item) for item in value])]
+        res_txt = format_str
         for val_idx in range(len(value)):
-            value[val_idx] = format_value(value[val_idx], format_num)
+            res_txt = res_txt.replace('{%d}' % val_idx, value[val_idx])
+        return res_txt
+
+    def format_column(self, values):
+        return [self.format(value) for value in values]
+
+
+FORMAT_CACHE_SIZE = 1000
+_compiled_formats = {}
+
+
+def compile_format(format_num, format_str):
+    if isinstance(format_num, dict):
+        format_key = tuple((six.text_type(key), six.text_type(val)) for key, val in format_num.items())
     else:
-        value = [format_value(value, format_num)]
+        format_key = format_num
+    babel_locale = get_babel_locale()
+    cache_key = (format_key, format_str, babel_locale)
+    try:
+        compiled = _compiled_formats.get(cache_key)
+    except TypeError:
+        return CompiledFormat(format_num, format_str, babel_locale)
+    if compiled is None:
+        compiled = CompiledFormat(format_num, format_str, babel_locale)
+        if len(_compiled_formats) >= FORMAT_CACHE_SIZE:
+            _compiled_formats.clear()
+        _compiled_formats[cache_key] = compiled
+    return compiled
+
 
-    if '{1}' not in format_str:
-        value = ['{[br/]}'.join([six.text_type(item) for item in value])]
+def format_value(value, format_num):
+    return compile_format(format_num, None).format_value(value)
 
-    res_txt = format_str
-    for val_idx in range(len(value)):
-        res_txt = res_txt.replace('{%d}' % val_idx, value[val_idx])
-    return res_txt
+
+def format_to_string(value, format_num, format_str):
+    return compile_format(format_num, format_str).format(value)
 
 
 def get_format_from_field(dep_field):
@@ -27,7 +27,6 @@ from logging import getLogger
 
 from django.utils.translation import ugettext_lazy as _
 from django.db import IntegrityError
-from django.db.models import Q
 from django.utils import six
 
 from lucterios.framework.error import LucteriosException, GRAVE, IMPORTANT
@@ -37,7 +36,7 @@ from lucterios.framework.xfercomponents import XferCompImage, XferCompLabelForm,
     XferCompButton
 from lucterios.framework.xfergraphic import XferContainerAcknowledge, XferContainerCustom
 from django_fsm import TransitionNotAllowed
-from lucterios.framework.models import LucteriosLogEntry
+from lucterios.framework.models import LucteriosLogEntry, get_items_filtered
 
 
 TITLE_OK = _("Ok")
@@ -83,7 +82,7 @@ def action_list_sorted(item):
 
 
 def add_auditlog_button(xfer, instance, posx, posy):
-    if xfer.with_auditlog_btn and LucteriosLogEntry.objects.get_for_object(instance).count() > 0:
+    if xfer.with_auditlog_btn and (LucteriosLogEntry.objects.get_for_object(instance).exists() or LucteriosLogEntry.objects.has_archived_for_object(instance)):
         btn = XferCompButton('auditlogbtn')
         btn.set_action(xfer.request, ActionsManage.get_action_url(LucteriosLogEntry.get_long_name(), 'Show', xfer),
                        modal=FORMTYPE_MODAL, close=CLOSE_NO, params={'model': instance.__class__.get_long_name(),
@@ -108,6 +107,8 @@ def add_auditlogs_button(xfer, model, posx, posy):
 class XferListEditor(XferContainerCustom):
     multi_page = True
     with_auditlog_btn = True
+    approximate_count = False
+    keyset_pager = False
 
     def __init__(self, **kwargs):
         XferContainerCustom.__init__(self, **kwargs)
@@ -119,16 +120,14 @@ class XferListEditor(XferContainerCustom):
         return
 
     def get_items_from_filter(self):
-        if isinstance(self.filter, Q) and (len(self.filter.children) > 0):
-            items = self.model.objects.filter(self.filter).distinct()
-        else:
-            items = self.model.objects.all()
-        return items
+        return get_items_filtered(self.model, self.filter)
 
     def fill_grid(self, row, model, field_id, items):
         grid = XferCompGrid(field_id)
         if self.size_by_page is not None:
             grid.size_by_page = self.size_by_page
+        grid.approximate_count = self.approximate_count
+        grid.keyset_pager = self.keyset_pager
         if self.multi_page:
             xfer = self
         else:
@@ -277,11 +276,21 @@ class XferSave(XferContainerAcknowledge):
     raise_except_class = None
     redirect_to_show = 'Show'
 
+    def check_version(self):
+        version_field = self.item.get_version_field() if hasattr(self.item, 'get_version_field') else None
+        record_version = self.getparam('RECORD_VERSION', -1)
+        if (version_field is not None) and (record_version is not None) and (record_version >= 0) and not self.is_new:
+            # claim the version read by the editor: fails if saved by someone else in the meantime
+            if self.model.objects.filter(pk=self.item.pk, **{version_field: record_version}).update(**{version_field: record_version + 1}) == 0:
+                raise LucteriosException(IMPORTANT, _("This record has been modified by another user!{[br/]}Close and reopen it to get last changes."))
+            setattr(self.item, version_field, record_version)
+
     def fillresponse(self):
         if "SAVE" in self.params.keys():
             del self.params["SAVE"]
         if self.has_changed:
             self.item.editor.before_save(self)
+            self.check_version()
             try:
                 self.item.save()
                 self.has_changed = False
@@ -292,6 +301,8 @@ class XferSave(XferContainerAcknowledge):
                 six.print_(err)
                 self.raise_except(
                     _("This record exists yet!"), self.raise_except_class)
+        if "RECORD_VERSION" in self.params.keys():
+            del self.params["RECORD_VERSION"]
         if self.except_msg == '':
             self.item.editor.saving(self)
         if self.getparam('URL_TO_REDIRECT') is not None:
@@ -36,6 +36,7 @@ from lucterios.framework.tools import get_icon_path, WrapAction, FORMTYPE_MODAL,
     set_locale_lang
 from lucterios.framework.error import LucteriosException, get_error_trace, IMPORTANT
 from lucterios.framework import signal_and_lock
+from lucterios.framework.models import LogEntryBuffer
 from django.http.response import JsonResponse
 
 NULL_VALUE = 'NULL'
@@ -143,7 +144,12 @@ class XferContainerAbstract(View):
                 self.fill_manytomany_fields()
             else:
                 self.clear_fields_in_params()
-            if self.locked:
+            version_field = self.item.get_version_field() if hasattr(self.item, 'get_version_field') else None
+            if self.locked and (version_field is not None):
+                # optimistic concurrency: checked by XferSave instead of locking
+                if not self.readonly and ('RECORD_VERSION' not in self.params.keys()):
+                    self.params['RECORD_VERSION'] = six.text_type(getattr(self.item, version_field))
+            elif self.locked:
                 lock_params = signal_and_lock.RecordLocker.lock(
                     self.request, self.item)
                 self.params.update(lock_params)
@@ -296,9 +302,10 @@ class XferContainerAbstract(View):
     def get_post(self, request, *args, **kwargs):
         getLogger("lucterios.core.request").debug(">> get %s [%s]", request.path, request.user)
         try:
-            self._initialize(request, *args, **kwargs)
-            getLogger("lucterios.core.request").debug("... get params=%s", self.params)
-            self.fillresponse(**self._get_params())
+            with LogEntryBuffer():
+                self._initialize(request, *args, **kwargs)
+                getLogger("lucterios.core.request").debug("... get params=%s", self.params)
+                self.fillresponse(**self._get_params())
             self._finalize()
             res = self.get_response()
             return res
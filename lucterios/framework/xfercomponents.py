@@ -25,15 +25,27 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import unicode_literals
 from logging import getLogger
 from datetime import datetime, time, date
+from time import monotonic
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from hashlib import md5
+import threading
 import warnings
+import json
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
 
 from django.utils import six
 from django.utils.translation import ugettext_lazy as _
 from django.conf import settings
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ObjectDoesNotExist, FieldDoesNotExist
+from django.db import connections
+from django.db.models import Q
+from django.db.models.fields.related_descriptors import ReverseManyToOneDescriptor
 
 from lucterios.framework.tools import WrapAction, ActionsManage, SELECT_MULTI, CLOSE_YES, get_actions_json, adapt_value,\
-    format_to_string
+    compile_format
 from lucterios.framework.tools import FORMTYPE_MODAL, SELECT_SINGLE, SELECT_NONE
 from lucterios.framework.models import get_format_from_field, extract_format,\
     LucteriosVirtualField
@@ -308,7 +320,7 @@ class XferCompLabelForm(XferComponent):
         return new_lbl
 
     def get_print_value(self):
-        return format_to_string(self.value, self._formatnum, self._formatstr)
+        return compile_format(self._formatnum, self._formatstr).format(self.value)
 
 
 class XferCompLinkLabel(XferCompLabelForm):
@@ -695,14 +707,95 @@ SIZE_BY_PAGE = 25
 if hasattr(settings, 'SIZE_BY_PAGE'):
     SIZE_BY_PAGE = settings.SIZE_BY_PAGE
 
+GRID_COUNT_DELAY = 120  # seconds
+if hasattr(settings, 'GRID_COUNT_DELAY'):
+    GRID_COUNT_DELAY = settings.GRID_COUNT_DELAY
+
+GRID_COUNT_APPROXIMATE_MIN = 100000
+if hasattr(settings, 'GRID_COUNT_APPROXIMATE_MIN'):
+    GRID_COUNT_APPROXIMATE_MIN = settings.GRID_COUNT_APPROXIMATE_MIN
+
 GRID_PAGE = 'GRID_PAGE%'
 GRID_SIZE = 'GRID_SIZE%'
 GRID_ORDER = 'GRID_ORDER%'
+GRID_CURSOR = 'GRID_CURSOR%'
+GRID_FLIP = 'GRID_FLIP%'
+
+NO_CELL_VALUE = object()
+JSON_SIMPLE_TYPES = six.string_types + six.integer_types + (float, bool, type(None))
 
 DEFAULT_ACTION_LIST = [('show', _("Edit"), "images/show.png", SELECT_SINGLE), ('edit', _("Modify"), "images/edit.png",
                                                                                SELECT_SINGLE), ('delete', _("Delete"), "images/delete.png", SELECT_MULTI), ('add', _("Add"), "images/add.png", SELECT_NONE)]
 
 
+class GridRecord(MutableMapping):
+    """
+    Row of a grid: values are read from and written to the grid columns.
+    """
+
+    def __init__(self, grid, compid):
+        self.grid = grid
+        self.compid = compid
+
+    def __getitem__(self, name):
+        return self.grid.get_record(self.compid)[name]
+
+    def __setitem__(self, name, value):
+        self.grid.set_value(self.compid, name, value)
+
+    def __delitem__(self, name):
+        # a cell of a header column comes back to its default value
+        row_idx = self.grid._record_index[self.compid]
+        column = self.grid._columns.get(name, [])
+        if (row_idx >= len(column)) or (column[row_idx] is NO_CELL_VALUE):
+            raise KeyError(name)
+        column[row_idx] = NO_CELL_VALUE
+
+    def __iter__(self):
+        return iter(self.grid.get_record(self.compid))
+
+    def __len__(self):
+        return len(self.grid.get_record(self.compid))
+
+    def __repr__(self):
+        return repr(self.grid.get_record(self.compid))
+
+
+class GridRecords(MutableMapping):
+    """
+    Rows of a grid by id, in the order of the grid.
+    """
+
+    def __init__(self, grid):
+        self.grid = grid
+
+    def __getitem__(self, compid):
+        if compid not in self.grid._record_index:
+            raise KeyError(compid)
+        return GridRecord(self.grid, compid)
+
+    def __setitem__(self, compid, record):
+        if compid in self.grid._record_index:
+            self.grid.delete_record(compid)
+        self.grid._new_record(compid)
+        for name, value in record.items():
+            self.grid.set_value(compid, name, value)
+
+    def __delitem__(self, compid):
+        if compid not in self.grid._record_index:
+            raise KeyError(compid)
+        self.grid.delete_record(compid)
+
+    def __iter__(self):
+        return iter(list(self.grid.record_ids))
+
+    def __len__(self):
+        return len(self.grid.record_ids)
+
+    def __repr__(self):
+        return repr(dict([(compid, self.grid.get_record(compid)) for compid in self.grid.record_ids]))
+
+
 class XferCompHeader(object):
 
     def __init__(self, name, descript, htype, orderable, formatstr="%s"):
@@ -718,6 +811,10 @@ class XferCompHeader(object):
 
 class XferCompGrid(XferComponent):
 
+    _count_cache = {}
+
+    _count_lock = threading.RLock()
+
     def __init__(self, name):
         XferComponent.__init__(self, name)
         self._component_ident = "GRID"
@@ -725,12 +822,15 @@ class XferCompGrid(XferComponent):
         self.nb_lines = 0
         self.headers = []
         self.record_ids = []
-        self.records = {}
+        self._record_index = {}
+        self._columns = {}
         self.actions = []
         self.page_max = 0
         self.page_num = 0
         self.order_list = None
         self.no_pager = False
+        self.approximate_count = False
+        self.keyset_pager = False
 
     def add_header(self, name, descript, htype="", horderable=0, formatstr="%s"):
         self.headers.append(XferCompHeader(name, descript, htype, horderable, formatstr))
@@ -789,25 +889,78 @@ class XferCompGrid(XferComponent):
             self.no_pager = True
         return (record_min, record_max)
 
+    def _get_default_value(self, name):
+        header = self.get_header(name)
+        if header is None:
+            return None
+        elif header.htype == 'N0':
+            return 0
+        elif isinstance(header.htype, six.text_type) and header.htype.startswith('N'):
+            return 0.0
+        elif header.htype == 'B':
+            return False
+        else:
+            return ""
+
     def _new_record(self, compid):
-        if compid not in self.records.keys():
-            new_record = {}
-            for header in self.headers:
-                if header.htype == 'N0':
-                    new_record[header.name] = 0
-                elif isinstance(header.htype, six.text_type) and header.htype.startswith('N'):
-                    new_record[header.name] = 0.0
-                elif header.htype == 'B':
-                    new_record[header.name] = False
-                else:
-                    new_record[header.name] = ""
-            self.records[compid] = new_record
+        if compid not in self._record_index:
+            self._record_index[compid] = len(self.record_ids)
             self.record_ids.append(compid)
-            self.records[compid]['__color_ref__'] = None
+
+    def delete_record(self, compid):
+        row_idx = self._record_index[compid]
+        del self.record_ids[row_idx]
+        for column in self._columns.values():
+            if row_idx < len(column):
+                del column[row_idx]
+        self._record_index = dict([(record_id, record_idx) for record_idx, record_id in enumerate(self.record_ids)])
 
     def set_value(self, compid, name, value):
-        self._new_record(compid)
-        self.records[compid][name] = value
+        row_idx = self._record_index.get(compid)
+        if row_idx is None:
+            row_idx = len(self.record_ids)
+            self._record_index[compid] = row_idx
+            self.record_ids.append(compid)
+        column = self._columns.get(name)
+        if column is None:
+            column = []
+            self._columns[name] = column
+        if len(column) == row_idx:
+            column.append(value)
+        else:
+            if len(column) < row_idx:
+                column.extend([NO_CELL_VALUE] * (row_idx - len(column)))
+                column.append(value)
+            else:
+                column[row_idx] = value
+
+    def get_value(self, compid, name):
+        row_idx = self._record_index[compid]
+        column = self._columns.get(name, [])
+        if (row_idx < len(column)) and (column[row_idx] is not NO_CELL_VALUE):
+            return column[row_idx]
+        return self._get_default_value(name)
+
+    def get_column(self, name):
+        default_value = self._get_default_value(name)
+        values = [default_value if value is NO_CELL_VALUE else value for value in self._columns.get(name, [])]
+        values.extend([default_value] * (len(self.record_ids) - len(values)))
+        return values
+
+    def get_record(self, compid):
+        row_idx = self._record_index[compid]
+        record = {}
+        for header in self.headers:
+            record[header.name] = self.get_value(compid, header.name)
+        for name, column in self._columns.items():
+            if (row_idx < len(column)) and (column[row_idx] is not NO_CELL_VALUE):
+                record[name] = column[row_idx]
+        record.setdefault('__color_ref__', None)
+        return record
+
+    @property
+    def records(self):
+        return GridRecords(self)
 
     def get_json(self):
         compjson = XferComponent.get_json(self)
@@ -822,16 +975,19 @@ class XferCompGrid(XferComponent):
         return compjson
 
     def get_json_value(self):
+        columns = [(header.name, [value if isinstance(value, JSON_SIMPLE_TYPES) else adapt_value(value) for value in self.get_column(header.name)])
+                   for header in self.headers]
+        columns.append(('__color_ref__', self.get_column('__color_ref__')))
+        extra_columns = [(name, column) for name, column in self._columns.items()
+                         if isinstance(name, six.text_type) and name.startswith('__') and (name != '__color_ref__') and (self.get_header(name) is None)]
         compjson = []
-        for key in self.record_ids:
-            record = self.records[key]
-            json_record = {}
-            json_record['id'] = key
-            for header in self.headers:
-                json_record[header.name] = adapt_value(record[header.name])
-            for rec_name in record.keys():
-                if isinstance(rec_name, six.text_type) and rec_name.startswith('__') and (rec_name not in self.headers):
-                    json_record[rec_name] = record[rec_name]
+        for row_idx, key in enumerate(self.record_ids):
+            json_record = {'id': key}
+            for name, column in columns:
+                json_record[name] = column[row_idx]
+            for name, column in extra_columns:
+                if (row_idx < len(column)) and (column[row_idx] is not NO_CELL_VALUE):
+                    json_record[name] = column[row_idx]
             compjson.append(json_record)
         return compjson
 
@@ -842,12 +998,12 @@ class XferCompGrid(XferComponent):
             if isinstance(fieldname, tuple):
                 verbose_name, fieldname = fieldname
                 hfield = None
-                if ('.' not in fieldname) and len(query_set) > 0:
+                if '.' not in fieldname:
                     try:
-                        first_record = query_set[0]
-                        first_value = getattr(first_record, fieldname)
-                        if isinstance(first_value, six.text_type) and first_value.startswith(BASE64_PREFIX):
-                            hfield = 'icon'
+                        for first_record in query_set[:1]:
+                            first_value = getattr(first_record, fieldname)
+                            if isinstance(first_value, six.text_type) and first_value.startswith(BASE64_PREFIX):
+                                hfield = 'icon'
                     except Exception:
                         pass
             elif fieldname[-4:] == '_set':  # field is one-to-many relation
@@ -866,38 +1022,226 @@ class XferCompGrid(XferComponent):
                     horderable = 1
             self.add_header(fieldname, verbose_name, hfield, horderable, format_str)
 
+    def _get_related_lookups(self, model, fieldnames):
+        select_related = []
+        prefetch_related = []
+        for fieldname in fieldnames:
+            if isinstance(fieldname, tuple):
+                _, fieldname = fieldname
+            if fieldname[-4:] == '_set':  # field is one-to-many relation
+                if isinstance(getattr(model, fieldname, None), ReverseManyToOneDescriptor):
+                    prefetch_related.append(fieldname)
+                continue
+            current_model = model
+            lookup = []
+            for field_name in fieldname.split('.'):
+                try:
+                    dep_field = current_model._meta.get_field(field_name)
+                except FieldDoesNotExist:
+                    break
+                if not dep_field.is_relation or (dep_field.related_model is None):
+                    break
+                lookup.append(field_name)
+                if dep_field.many_to_many or dep_field.one_to_many:
+                    prefetch_related.append('__'.join(lookup))
+                    break
+                select_related.append('__'.join(lookup))
+                current_model = dep_field.related_model
+        return sorted(set(select_related)), sorted(set(prefetch_related))
+
+    def _get_approximate_count(self, query_set):
+        connection = connections[query_set.db]
+        if len(query_set.query.where) > 0:
+            return None
+        if connection.vendor == 'postgresql':
+            sql_text = "SELECT reltuples FROM pg_class WHERE oid = %s::regclass"
+        elif connection.vendor == 'mysql':
+            sql_text = "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s"
+        else:
+            return None
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(sql_text, [query_set.model._meta.db_table])
+                row = cursor.fetchone()
+        except Exception:
+            getLogger("lucterios.core").debug("approximate count failure", exc_info=True)
+            return None
+        if (row is None) or (row[0] is None) or (int(row[0]) < GRID_COUNT_APPROXIMATE_MIN):
+            return None
+        return int(row[0])
+
+    def _get_count(self, query_set, xfer_custom):
+        try:
+            sql_text, sql_params = query_set.query.sql_with_params()
+            count_key = (query_set.db, sql_text, repr(sql_params))
+        except Exception:
+            return query_set.count()
+        # the count is reused only when the client flips the pages of a same grid: this marker is not sent back
+        page_flip = (xfer_custom is not None) and (xfer_custom.params.pop(GRID_FLIP + self.name, None) is not None)
+        current_time = monotonic()
+        with self._count_lock:
+            if page_flip and (count_key in self._count_cache):
+                nb_lines, count_time = self._count_cache[count_key]
+                if (current_time - count_time) < GRID_COUNT_DELAY:
+                    return nb_lines
+        nb_lines = None
+        if self.approximate_count:
+            nb_lines = self._get_approximate_count(query_set)
+        if nb_lines is None:
+            nb_lines = query_set.count()
+        with self._count_lock:
+            for old_key in [key for key, value in self._count_cache.items() if (current_time - value[1]) >= GRID_COUNT_DELAY]:
+                del self._count_cache[old_key]
+            self._count_cache[count_key] = (nb_lines, current_time)
+        return nb_lines
+
+    def _get_keyset_order(self, query_set):
+        if self.order_list is not None:
+            order_fields = list(self.order_list)
+        elif len(query_set.query.order_by) > 0:
+            order_fields = list(query_set.query.order_by)
+        else:
+            order_fields = list(query_set.model._meta.ordering)
+        pk_name = query_set.model._meta.pk.name
+        attnames = []
+        for order_field in order_fields:
+            if not isinstance(order_field, six.text_type):
+                return None, None
+            field_name = order_field.lstrip('-')
+            if field_name == 'pk':
+                dep_field = query_set.model._meta.pk
+            else:
+                try:
+                    dep_field = query_set.model._meta.get_field(field_name)
+                except FieldDoesNotExist:
+                    return None, None
+            if not dep_field.concrete or dep_field.is_relation or dep_field.null:
+                # NULL does not compare in a keyset filter: OFFSET paging
+                return None, None
+            attnames.append(dep_field.attname)
+        if query_set.model._meta.pk.attname not in attnames:
+            order_fields.append(pk_name)
+            attnames.append(query_set.model._meta.pk.attname)
+        return order_fields, attnames
+
+    def _get_keyset_filter(self, order_fields, values, forward, inclusive):
+        keyset_filter = Q()
+        for field_idx, order_field in enumerate(order_fields):
+            criteria = {}
+            for previous_idx in range(field_idx):
+                criteria[order_fields[previous_idx].lstrip('-')] = values[previous_idx]
+            if (order_field[0] != '-') == forward:
+                criteria[order_field.lstrip('-') + '__gt'] = values[field_idx]
+            else:
+                criteria[order_field.lstrip('-') + '__lt'] = values[field_idx]
+            keyset_filter |= Q(**criteria)
+        if inclusive:
+            keyset_filter |= Q(**dict([(order_field.lstrip('-'), value) for order_field, value in zip(order_fields, values)]))
+        return keyset_filter
+
+    def _decode_cursor(self, cursor_text, query_sign):
+        try:
+            cursor = json.loads(urlsafe_b64decode(cursor_text.encode('ascii')).decode('utf-8'))
+            if cursor['sign'] == query_sign:
+                return cursor
+        except (ValueError, TypeError, KeyError):
+            pass
+        return None
+
+    def _encode_cursor(self, query_sign, first_values, last_values):
+        def value_to_json(value):
+            if hasattr(value, 'isoformat'):
+                return value.isoformat()
+            return six.text_type(value)
+        cursor = {'sign': query_sign, 'page': self.page_num, 'first': first_values, 'last': last_values}
+        return urlsafe_b64encode(json.dumps(cursor, default=value_to_json).encode('utf-8')).decode('ascii')
+
+    def _get_keyset_items(self, query_set, record_min, record_max, xfer_custom):
+        order_fields, attnames = self._get_keyset_order(query_set)
+        if order_fields is None:
+            return query_set[record_min:record_max]
+        query_set = query_set.order_by(*order_fields)
+        try:
+            sql_text, sql_params = query_set.query.sql_with_params()
+        except Exception:
+            return query_set[record_min:record_max]
+        query_sign = md5(("%s %r" % (sql_text, sql_params)).encode('utf-8')).hexdigest()
+        cursor = self._decode_cursor(xfer_custom.getparam(GRID_CURSOR + self.name, ''), query_sign)
+        page_size = record_max - record_min
+        if (self.page_num == 0) or (cursor is None):
+            items = list(query_set[record_min:record_max])
+        elif self.page_num == (cursor['page'] + 1):
+            items = list(query_set.filter(self._get_keyset_filter(order_fields, cursor['last'], True, False))[:page_size])
+        elif self.page_num == cursor['page']:
+            items = list(query_set.filter(self._get_keyset_filter(order_fields, cursor['first'], True, True))[:page_size])
+        elif self.page_num == (cursor['page'] - 1):
+            reverse_fields = [order_field[1:] if order_field[0] == '-' else '-' + order_field for order_field in order_fields]
+            items = list(query_set.order_by(*reverse_fields).filter(self._get_keyset_filter(order_fields, cursor['first'], False, False))[:page_size])
+            items.reverse()
+        else:
+            items = list(query_set[record_min:record_max])
+        first_values = [getattr(items[0], attname) for attname in attnames] if len(items) > 0 else [None]
+        last_values = [getattr(items[-1], attname) for attname in attnames] if len(items) > 0 else [None]
+        if (self.page_max <= 1) or (None in first_values) or (None in last_values):
+            if (GRID_CURSOR + self.name) in xfer_custom.params:
+                del xfer_custom.params[GRID_CURSOR + self.name]
+        else:
+            xfer_custom.params[GRID_CURSOR + self.name] = self._encode_cursor(query_sign, first_values, last_values)
+        return items
+
     def set_model(self, query_set, fieldnames, xfer_custom=None):
         if fieldnames is None:
             fieldnames = query_set.model.get_default_fields()
         self._add_header_from_model(query_set, fieldnames, xfer_custom is not None)
-        self.nb_lines = len(query_set)
+        self.nb_lines = self._get_count(query_set, xfer_custom)
         primary_key_fieldname = query_set.model._meta.pk.attname
         record_min, record_max = self.define_page(xfer_custom)
         if self.order_list is not None:
             query_set = query_set.order_by(*self.order_list)
-        for value in query_set[record_min:record_max]:
-            child = value.get_final_child()
-            child.set_context(xfer_custom)
-            pk_id = getattr(child, primary_key_fieldname)
-            self.set_value(pk_id, '__color_ref__', child.get_color_ref())
-            for fieldname in fieldnames:
-                if isinstance(fieldname, tuple):
-                    _, fieldname = fieldname
-                if fieldname[-4:] == '_set':  # field is one-to-many relation
-                    resvalue = []
-                    sub_items = getattr(child, fieldname).all()
-                    for sub_items_value in sub_items:
-                        resvalue.append(six.text_type(sub_items_value))
-                else:
-                    resvalue = child
-                    for field_name in fieldname.split('.'):
-                        if resvalue is not None:
-                            try:
-                                resvalue = getattr(resvalue, field_name)
-                            except (ObjectDoesNotExist, AttributeError):
-                                getLogger("lucterios.core").exception("fieldname '%s' not found", field_name)
-                                resvalue = None
-                self.set_value(pk_id, fieldname, resvalue)
+        select_related, prefetch_related = self._get_related_lookups(query_set.model, fieldnames)
+        if len(select_related) > 0:
+            query_set = query_set.select_related(*select_related)
+        if len(prefetch_related) > 0:
+            query_set = query_set.prefetch_related(*prefetch_related)
+        if self.keyset_pager and (xfer_custom is not None) and not self.no_pager:
+            page_items = self._get_keyset_items(query_set, record_min, record_max, xfer_custom)
+        else:
+            page_items = query_set[record_min:record_max]
+        for child in query_set.model.get_final_children(page_items, select_related, prefetch_related):
+            self._set_item_values(child, fieldnames, primary_key_fieldname, xfer_custom)
+
+    def _set_item_values(self, child, fieldnames, primary_key_fieldname, xfer_custom):
+        child.set_context(xfer_custom)
+        pk_id = getattr(child, primary_key_fieldname)
+        self.set_value(pk_id, '__color_ref__', child.get_color_ref())
+        for fieldname in fieldnames:
+            if isinstance(fieldname, tuple):
+                _, fieldname = fieldname
+            if fieldname[-4:] == '_set':  # field is one-to-many relation
+                resvalue = []
+                sub_items = getattr(child, fieldname).all()
+                for sub_items_value in sub_items:
+                    resvalue.append(six.text_type(sub_items_value))
+            else:
+                resvalue = child
+                for field_name in fieldname.split('.'):
+                    if resvalue is not None:
+                        try:
+                            resvalue = getattr(resvalue, field_name)
+                        except (ObjectDoesNotExist, AttributeError):
+                            getLogger("lucterios.core").exception("fieldname '%s' not found", field_name)
+                            resvalue = None
+            self.set_value(pk_id, fieldname, resvalue)
+
+    def set_objects(self, model, items, fieldnames, xfer_custom=None):
+        """Fill the grid with instances not read from a query set (no ordering, no pager)"""
+        if fieldnames is None:
+            fieldnames = model.get_default_fields()
+        self._add_header_from_model(model.objects.none(), fieldnames, False)
+        self.nb_lines = len(items)
+        self.define_page(None)
+        for item in items:
+            self._set_item_values(item, fieldnames, model._meta.pk.attname, xfer_custom)
 
     def add_action_notified(self, xfer_custom, model=None):
         from lucterios.framework.xferadvance import action_list_sorted
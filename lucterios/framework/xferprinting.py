@@ -26,10 +26,14 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import unicode_literals
 from base64 import b64encode
 from logging import getLogger
-from os.path import join
+from os import listdir, unlink
+from os.path import join, isfile, getmtime, getsize
+from time import time
+from uuid import uuid4
 from zipfile import ZipFile
 from _io import BytesIO
 
+from django.conf import settings
 from django.utils.translation import ugettext as _
 from django.utils import six
 
@@ -39,12 +43,33 @@ from lucterios.framework.xfergraphic import XferContainerCustom
 from lucterios.framework.xfercomponents import XferCompSelect, XferCompFloat, XferCompEdit, XferCompMemo, XferCompCheck, XferCompLabelForm,\
     XferCompDownLoad
 from lucterios.framework.tools import CLOSE_YES, FORMTYPE_MODAL, WrapAction
-from lucterios.framework.filetools import get_user_dir
+from lucterios.framework.filetools import get_user_dir, get_user_path, md5sum
 from lucterios.framework.xfersearch import get_search_query
 
 PRINT_PDF_FILE = 3
 PRINT_CSV_FILE = 4
 
+# larger PDF reports are sent as a 'download' link: None keeps them all inline, for clients not following this link
+PRINT_INLINE_MAXSIZE = 1048576
+if hasattr(settings, 'PRINT_INLINE_MAXSIZE'):
+    PRINT_INLINE_MAXSIZE = settings.PRINT_INLINE_MAXSIZE
+
+PRINT_FILE_DIR = 'print'
+PRINT_FILE_DELAY = 3600  # seconds
+
+
+def get_print_filename():
+    print_dir = get_user_path(PRINT_FILE_DIR, '')
+    time_limit = time() - PRINT_FILE_DELAY
+    for old_name in listdir(print_dir):
+        old_path = join(print_dir, old_name)
+        if isfile(old_path) and (getmtime(old_path) < time_limit):
+            try:
+                unlink(old_path)
+            except OSError:
+                pass
+    return "%s/%s.pdf" % (PRINT_FILE_DIR, uuid4().hex)
+
 
 class XferContainerPrint(XferContainerAbstract):
 
@@ -58,6 +83,7 @@ class XferContainerPrint(XferContainerAbstract):
     def __init__(self):
         XferContainerAbstract.__init__(self)
         self.report_content = ""
+        self.report_download = None
         self.report_mode = PRINT_PDF_FILE
         self.print_selector = []
         self.selector = None
@@ -229,11 +255,29 @@ parent.get('print_sep').setEnabled(!is_persitent);
                     report_generator.watermark = self.PRINT_DUPLICATA
                 if report_generator.title == '':
                     report_generator.title = self.caption
-                self.report_content = b64encode(report_generator.generate_report(self.request, self.report_mode == PRINT_CSV_FILE))
+                if self.report_mode == PRINT_CSV_FILE:
+                    self.report_content = b64encode(report_generator.generate_report(self.request, True))
+                else:
+                    self._fill_pdf_report(report_generator)
+
+    def _fill_pdf_report(self, report_generator):
+        pdf_filename = get_print_filename()
+        pdf_path = join(get_user_dir(), pdf_filename)
+        report_generator.save_report(self.request, pdf_path)
+        if (PRINT_INLINE_MAXSIZE is not None) and (getsize(pdf_path) > PRINT_INLINE_MAXSIZE):
+            # large report: downloaded by the client instead of embedded in the response
+            self.report_download = pdf_filename
+            self.report_content = b''
+        else:
+            with open(pdf_path, 'rb') as pdf_file:
+                self.report_content = b64encode(pdf_file.read())
+            unlink(pdf_path)
 
     def get_print_name(self):
         return six.text_type(self.caption)
 
     def _finalize(self):
         self.responsejson['print'] = {'mode': self.report_mode, 'title': self.get_print_name(), 'content': self.report_content.decode()}
+        if self.report_download is not None:
+            self.responsejson['print']['download'] = "CORE/download?filename=%s&sign=%s" % (self.report_download, md5sum(self.report_download))
         XferContainerAbstract._finalize(self)
@@ -25,11 +25,19 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import unicode_literals
 import json
+import threading
+import time
 
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist
+from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
-from django.utils import six
+from django.utils.functional import Promise
+from django.utils import six, translation
+from django.db.models.fields import Field, CharField, TextField
 from django.db.models.fields.related import ManyToManyField
-from django.db.models import Q
+from django.db.models import Q, Count
+from django.db.models.signals import post_save, post_delete
 
 from lucterios.framework.tools import CLOSE_NO, FORMTYPE_REFRESH
 from lucterios.framework.tools import WrapAction, ActionsManage
@@ -37,6 +45,8 @@ from lucterios.framework.xfercomponents import XferCompImage, XferCompLabelForm,
     XferCompSelect, XferCompButton, XferCompFloat, XferCompEdit, XferCompCheck, \
     XferCompDate, XferCompTime, XferCompCheckList
 from lucterios.framework.xferadvance import action_list_sorted
+from lucterios.framework.fulltext import FullTextIndex
+from lucterios.framework.models import get_items_filtered
 from lucterios.framework.xfergraphic import XferContainerCustom, get_range_value
 
 TYPE_FLOAT = 'float'
@@ -48,6 +58,20 @@ TYPE_DATETIME = 'datetime'
 TYPE_LIST = 'list'
 TYPE_LISTMULT = 'listmult'
 
+SEARCH_LIST_LAZY_SIZE = 0
+if hasattr(settings, 'SEARCH_LIST_LAZY_SIZE'):
+    SEARCH_LIST_LAZY_SIZE = settings.SEARCH_LIST_LAZY_SIZE
+
+# seconds a cached search field description stays valid: the signals only reach the current process
+SEARCH_FIELDS_CACHE_TIMEOUT = 60
+if hasattr(settings, 'SEARCH_FIELDS_CACHE_TIMEOUT'):
+    SEARCH_FIELDS_CACHE_TIMEOUT = settings.SEARCH_FIELDS_CACHE_TIMEOUT
+
+SEARCH_LIST_PAGE_SIZE = 25
+SEARCH_LIST_PAGE_MAX = 500
+
+search_choices_view_class = None
+
 OP_NULL = ('0', '')
 OP_EQUAL = ('1', _('equals'), '__iexact')
 OP_DIFFERENT = ('2', _("different"), '__iexact')
@@ -85,6 +109,21 @@ def get_script_for_operator():
     return script
 
 
+def get_script_for_lazy_choices():
+    # lists not embedded in the script (findLazy) are asked to the search choices view
+    return """
+findLazyChoices=function(lazy_desc, filter_text) {
+    var params=new HashMap();
+    params.put('modelname', lazy_desc.modelname);
+    params.put('fieldname', lazy_desc.fieldname);
+    params.put('searchFilter', filter_text);
+    params.put('size', String(lazy_desc.size));
+    var response=Singleton().Transport().transfertFileFromServerString(lazy_desc.url, params);
+    return response.choices || [];
+};
+"""
+
+
 def get_criteria_list(criteria):
     criteria_list = []
     for criteria_item in criteria.split('//'):
@@ -125,6 +164,12 @@ class FieldDescItem(object):
         self.dbfieldname = ''
         self.dbfield = None
         self.initial_q = Q()
+        self.list_models = []
+        self.lazy_model = None
+        self.index_model = None
+        self.index_path = ''
+        self.model = None
+        self.multi_path = ''
         if isinstance(self.fieldname, tuple) and (len(self.fieldname) == 4):
             self.dbfield = self.fieldname[1]
             self.dbfieldname = self.fieldname[2]
@@ -139,6 +184,10 @@ class FieldDescItem(object):
             else:
                 self.field_type = TYPE_LIST
             self.field_list = []
+            self.list_models = [sub_model]
+            if (SEARCH_LIST_LAZY_SIZE > 0) and (sub_model.objects.count() > SEARCH_LIST_LAZY_SIZE):
+                self.lazy_model = sub_model
+                return True
             for select_obj in sub_model.objects.all():
                 self.field_list.append(
                     (six.text_type(select_obj.id), six.text_type(select_obj)))
@@ -152,6 +201,10 @@ class FieldDescItem(object):
                 self.dbfieldname, sub_fied_desc.dbfieldname)
             self.field_type = sub_fied_desc.field_type
             self.field_list = sub_fied_desc.field_list
+            self.list_models = sub_fied_desc.list_models
+            self.lazy_model = sub_fied_desc.lazy_model
+            self.index_model = sub_fied_desc.index_model
+            self.index_path = "%s__%s" % (self.sub_fieldnames[0] if self.sub_fieldnames[0][-4:] != '_set' else self.sub_fieldnames[0][:-4], sub_fied_desc.index_path)
         return True
 
     def init_field_from_name(self, model):
@@ -190,8 +243,32 @@ class FieldDescItem(object):
             self.field_list = [
                 (six.text_type(min_value), six.text_type(max_value), '0')]
 
+    def _init_multi_path(self):
+        self.multi_path = ''
+        current_model = self.model
+        path = []
+        for sub_name in self.dbfieldname.split('__'):
+            try:
+                dep_field = current_model._meta.get_field(sub_name)
+            except FieldDoesNotExist:
+                break
+            path.append(sub_name)
+            if dep_field.one_to_many or dep_field.many_to_many:
+                self.multi_path = '__'.join(path)
+                break
+            if not dep_field.is_relation:
+                break
+            current_model = dep_field.related_model
+
     def init(self, model):
+        if self.init_field(model):
+            self.model = model if isinstance(model, type) else model.__class__
+            self._init_multi_path()
+            return True
+        else:
+            return False
 
+    def init_field(self, model):
         self.init_field_from_name(model)
         if self.dbfield is not None:
             from django.db.models.fields import IntegerField, DecimalField, BooleanField, TextField, DateField, TimeField, DateTimeField
@@ -206,6 +283,7 @@ class FieldDescItem(object):
                 self.field_type = TYPE_BOOL
             elif isinstance(self.dbfield, TextField):
                 self.field_type = TYPE_STR
+                self.index_model = model if isinstance(model, type) else model.__class__
             elif isinstance(self.dbfield, DateField):
                 self.field_type = TYPE_DATE
             elif isinstance(self.dbfield, TimeField):
@@ -220,6 +298,7 @@ class FieldDescItem(object):
                 return self._init_for_list(self.dbfield.model, False)
             else:
                 self.field_type = TYPE_STR
+                self.index_model = model if isinstance(model, type) else model.__class__
             return True
         else:
             return False
@@ -228,10 +307,43 @@ class FieldDescItem(object):
         # list => '[["xxx",yyyy],["xxx","yyyy"],[xxx,yyyy]]'
         return json.dumps(self.field_list)
 
-    def add_from_script(self):
+    def _get_lazy_query(self, filter_text):
+        query = Q()
+        if filter_text != '':
+            text_fields = []
+            default_fields = self.lazy_model.get_default_fields() if hasattr(self.lazy_model, 'get_default_fields') else []
+            for field_name in default_fields:
+                if isinstance(field_name, six.text_type) and ('.' not in field_name):
+                    text_fields.append(field_name)
+            text_fields = [field.name for field in self.lazy_model._meta.concrete_fields
+                           if isinstance(field, (CharField, TextField)) and ((len(text_fields) == 0) or (field.name in text_fields))]
+            for filter_item in filter_text.split():
+                item_query = Q()
+                for field_name in text_fields:
+                    item_query |= Q(**{field_name + '__icontains': filter_item})
+                query &= item_query
+        return query
+
+    def get_choices(self, filter_text='', page_num=0, page_size=SEARCH_LIST_PAGE_SIZE):
+        if self.lazy_model is None:
+            choices = [item for item in self.field_list if filter_text.lower() in item[1].lower()]
+            nb_lines = len(choices)
+            choices = choices[page_num * page_size:(page_num + 1) * page_size]
+        else:
+            query_set = self.lazy_model.objects.filter(self._get_lazy_query(filter_text))
+            query_set = query_set.order_by(*(list(self.lazy_model._meta.ordering) + ['pk']))
+            nb_lines = query_set.count()
+            choices = [(six.text_type(select_obj.id), six.text_type(select_obj))
+                       for select_obj in query_set[page_num * page_size:(page_num + 1) * page_size]]
+        return choices, nb_lines
+
+    def add_from_script(self, modelname=''):
         script_ref = "findFields['%s']='%s';\n" % (self.fieldname, self.field_type)
         if (self.field_type == TYPE_LIST) or (self.field_type == TYPE_LISTMULT) or (self.field_type == TYPE_FLOAT):
             script_ref += "findLists['%s']=%s;\n" % (self.fieldname, self.get_list().replace("'", "\\'"))
+        if (self.lazy_model is not None) and (search_choices_view_class is not None):
+            lazy_desc = {'url': search_choices_view_class.url_text, 'modelname': modelname, 'fieldname': self.fieldname, 'size': SEARCH_LIST_PAGE_SIZE}
+            script_ref += "findLazy['%s']=%s;\n" % (self.fieldname, json.dumps(lazy_desc).replace("'", "\\'"))
         return script_ref
 
     def get_value(self, value, operation):
@@ -249,7 +361,10 @@ class FieldDescItem(object):
         elif (self.field_type == TYPE_LIST) or (self.field_type == TYPE_LISTMULT):
             new_val_txt = ''
             ids = value.split(';')
-            for new_item in self.field_list:
+            field_list = self.field_list
+            if self.lazy_model is not None:
+                field_list = [(six.text_type(select_obj.id), six.text_type(select_obj)) for select_obj in self.lazy_model.objects.filter(id__in=ids)]
+            for new_item in field_list:
                 if new_item[0] in ids:
                     if new_val_txt != '':
                         new_val_txt += ' %s ' % OP_LIST[operation][1]
@@ -269,6 +384,11 @@ class FieldDescItem(object):
         desc_text = "{[b]}%s{[/b]} %s {[i]}%s{[/i]}" % (self.description, sep_criteria, new_val_txt)
         return desc_text
 
+    def get_fulltext_query(self, value):
+        if self.index_model is None:
+            return None
+        return FullTextIndex.get_query(self.index_model, self.sub_fieldnames[-1], value, self.index_path)
+
     def get_query(self, value, operation):
         def get_int_list(value):
             val_ids = []
@@ -277,7 +397,12 @@ class FieldDescItem(object):
             return val_ids
         query_res = self.initial_q
         field_with_op = self.dbfieldname + OP_LIST[operation][2]
-        if self.field_type == TYPE_BOOL:
+        fulltext_q = None
+        if (self.field_type == TYPE_STR) and (operation == int(OP_CONTAINS[0])):
+            fulltext_q = self.get_fulltext_query(value)
+        if fulltext_q is not None:
+            query_res = self.initial_q & fulltext_q
+        elif self.field_type == TYPE_BOOL:
             if value == 'o':
                 query_res = query_res & Q(**{self.dbfieldname: True})
             else:
@@ -289,10 +414,10 @@ class FieldDescItem(object):
             if operation == int(OP_OR[0]):
                 query_res = query_res & Q(**{field_with_op: val_ids})
             else:
-                query_res = self.initial_q
-
-                for value_item in val_ids:
-                    query_res = query_res & Q(**{field_with_op: value_item})
+                # related rows holding all the values: one grouped sub-query instead of one join per value
+                query_set = self.model._default_manager.filter(self.initial_q & Q(**{self.dbfieldname + '__in': val_ids}))
+                query_set = query_set.values('pk').annotate(nb_values=Count(self.dbfieldname, distinct=True)).filter(nb_values=len(set(val_ids)))
+                query_res = Q(pk__in=query_set.values('pk'))
         elif (self.field_type == TYPE_FLOAT) and operation == int(OP_EQUAL[0]):
             value = float(value)
             field_with_op1 = self.dbfieldname + OP_LESS[2]
@@ -330,29 +455,115 @@ class FieldDescItem(object):
         return None
 
 
+def get_description_key(value):
+    if isinstance(value, (list, tuple)):
+        return tuple([get_description_key(item) for item in value])
+    if isinstance(value, dict):
+        return tuple([(key, get_description_key(value[key])) for key in sorted(value.keys())])
+    if isinstance(value, Field):
+        _name, path, args, kwargs = value.deconstruct()
+        return (path, get_description_key(args), get_description_key(kwargs))
+    if isinstance(value, Q):
+        return (value.connector, value.negated, get_description_key(value.children))
+    if isinstance(value, (Promise, six.text_type)):
+        return six.text_type(value)
+    return repr(value)
+
+
 class FieldDescList(object):
 
+    _cache = {}
+
+    _generation = 0
+
+    _lock = threading.RLock()
+
     def __init__(self):
         self.field_desc_list = []
         self.field_id_desc = []
-
-    def initial(self, model):
+        self.list_models = set()
+        self.modelname = ''
+        self.model = None
+        self.select_and_script = None
+
+    @classmethod
+    def clear_cache(cls, sender=None, **_kwargs):
+        cls._lock.acquire()
+        try:
+            cls._generation += 1
+            if sender is None:
+                cls._cache = {}
+            else:
+                for cache_key, (fields_desc, _load_time) in list(cls._cache.items()):
+                    for list_model in fields_desc.list_models:
+                        if issubclass(sender, list_model):
+                            del cls._cache[cache_key]
+                            break
+        finally:
+            cls._lock.release()
+
+    @classmethod
+    def _watch_model(cls, list_model):
+        for model in apps.get_models():
+            if issubclass(model, list_model):
+                dispatch_uid = "fielddesc_%s" % model._meta.label_lower
+                post_save.connect(cls.clear_cache, sender=model, dispatch_uid=dispatch_uid, weak=False)
+                post_delete.connect(cls.clear_cache, sender=model, dispatch_uid=dispatch_uid, weak=False)
+
+    def _load(self, model, search_fields):
+        self.modelname = model._meta.label
+        self.model = model if isinstance(model, type) else model.__class__
         self.field_desc_list = []
-        for field_name in model.get_search_fields():
+        for field_name in search_fields:
             new_field = FieldDescItem(field_name)
             if new_field.init(model):
                 self.field_desc_list.append(new_field)
+                self.list_models.update(new_field.list_models)
         self.field_id_desc = FieldDescItem('id')
         self.field_id_desc.init(model)
         self.field_id_desc.field_type = TYPE_LISTMULT
+        self.select_and_script = self.get_select_and_script()
+
+    def initial(self, model):
+        model_class = model if isinstance(model, type) else model.__class__
+        search_fields = model.get_search_fields()
+        cache_key = (model_class, translation.get_language(), get_description_key(search_fields))
+        self._lock.acquire()
+        try:
+            fields_desc, load_time = self._cache.get(cache_key, (None, 0))
+            if (load_time + SEARCH_FIELDS_CACHE_TIMEOUT) < time.time():
+                fields_desc = None
+            generation = self._generation
+        finally:
+            self._lock.release()
+        if fields_desc is None:
+            fields_desc = FieldDescList()
+            fields_desc._load(model, search_fields)
+            for list_model in fields_desc.list_models:
+                self._watch_model(list_model)
+            self._lock.acquire()
+            try:
+                if generation == self._generation:
+                    self._cache[cache_key] = (fields_desc, time.time())
+            finally:
+                self._lock.release()
+        self.field_desc_list = fields_desc.field_desc_list
+        self.field_id_desc = fields_desc.field_id_desc
+        self.list_models = fields_desc.list_models
+        self.modelname = fields_desc.modelname
+        self.model = fields_desc.model
+        self.select_and_script = fields_desc.select_and_script
 
     def get_select_and_script(self):
+        if self.select_and_script is not None:
+            return list(self.select_and_script[0]), self.select_and_script[1]
         selector = []
         script_ref = "findFields=new Array();\n"
         script_ref += "findLists=new Array();\n"
+        script_ref += "findLazy=new Array();\n"
         for field_desc_item in self.field_desc_list:
             selector.append((field_desc_item.fieldname, field_desc_item.description))
-            script_ref += field_desc_item.add_from_script()
+            script_ref += field_desc_item.add_from_script(self.modelname)
         return selector, script_ref
 
     def get(self, fieldname):
@@ -365,6 +576,7 @@ class FieldDescList(object):
 
     def get_query_from_criterialist(self, criteria_list):
         filter_result = Q()
+        multi_filters = {}
         criteria_desc = {}
         crit_index = 0
         for criteria_item in criteria_list:
@@ -374,10 +586,17 @@ class FieldDescList(object):
                 new_val = criteria_item[2]
                 field_desc_item = self.get(new_name)
                 if field_desc_item is not None:
-                    filter_result = filter_result & field_desc_item.get_query(new_val, new_op)
+                    item_query = field_desc_item.get_query(new_val, new_op)
+                    if (field_desc_item.multi_path == '') or ((field_desc_item.field_type == TYPE_LISTMULT) and (new_op == int(OP_AND[0]))):
+                        filter_result = filter_result & item_query
+                    else:
+                        # criteria on a same "many" relation must match a same related row
+                        multi_filters[field_desc_item.multi_path] = multi_filters.get(field_desc_item.multi_path, Q()) & item_query
                     desc_text = field_desc_item.get_criteria_description(new_op, new_val)
                     criteria_desc[six.text_type(crit_index)] = desc_text
                     crit_index += 1
+        for multi_path in sorted(multi_filters.keys()):
+            filter_result = filter_result & Q(pk__in=self.model._default_manager.filter(multi_filters[multi_path]).values('pk'))
         return filter_result, criteria_desc
 
 
@@ -437,11 +656,12 @@ class XferSearchEditor(XferContainerCustom):
 
     def fillresponse_search_select(self):
         selector, script_ref = self.fields_desc.get_select_and_script()
+        script_ref += get_script_for_lazy_choices()
         script_ref += """
 var name=current.getValue();
 var type=findFields[name];
 parent.get('searchValueFloat').setVisible(type=='float');
-parent.get('searchValueStr').setVisible(type=='str');
+parent.get('searchValueStr').setVisible((type=='str') || (findLazy[name]!==undefined));
 parent.get('searchValueBool').setVisible(type=='bool');
 parent.get('searchValueDate').setVisible(type=='date' || type=='datetime');
 parent.get('searchValueTime').setVisible(type=='time' || type=='datetime');
@@ -467,6 +687,9 @@ if (type=='time' || type=='datetime') {
 }
 if ((type=='list') || (type=='listmult')) {
     var select_case=findLists[name];
+    if (findLazy[name]!==undefined) {
+        select_case=findLazyChoices(findLazy[name],'');
+    }
     parent.get('searchValueList').setValue({case:select_case,value:0});
 }
 """
@@ -509,6 +732,13 @@ if ((type=='list') || (type=='listmult')) {
         comp = XferCompEdit("searchValueStr")
         comp.set_location(3, 13)
         comp.set_size(20, 200)
+        # for a lazy list, the text filters the choices
+        comp.java_script = """
+var name=parent.get('searchSelector').getValue();
+if ((typeof findLazy!=='undefined') && (findLazy[name]!==undefined)) {
+    parent.get('searchValueList').setValue({case:findLazyChoices(findLazy[name],current.getValue()),value:0});
+}
+"""
         self.add_component(comp)
         comp = XferCompCheckList("searchValueList")
         comp.set_location(3, 14)
@@ -556,10 +786,7 @@ if ((type=='list') || (type=='listmult')) {
             row += 1
 
     def filter_items(self):
-        if isinstance(self.filter, Q) and (len(self.filter.children) > 0):
-            self.items = self.model.objects.filter(self.filter).distinct()
-        else:
-            self.items = self.model.objects.all()
+        self.items = get_items_filtered(self.model, self.filter)
 
     def fillresponse(self):
         self.fields_desc.initial(self.item)